@@ -41,8 +41,10 @@ from .state import Monitor
 from .experiment import Computation, Result, Experiment
 from .parameterset import ParameterSet, ConstrainedParameterSet, \
     PrioritizedParamSet, CartesianParameterSet, ExplicitParameterSet
-from .environment import Serializer, FileSerializer, InSituEnvironment
-from .datacube import Datacube, build_result_cube, build_datacube
+from .environment import Serializer, FileSerializer, DedupSerializer, \
+    InSituEnvironment, PoolEnvironment
+from .datacube import Datacube, ArrayDatacube, build_result_cube, \
+    build_datacube
 from .parser import BaseParser, ClusterParser, CTParser
 from .util import call_with
 from .config import get_ct_folder, get_default_environment
@@ -56,8 +58,10 @@ __date__ = "08 Oct. 2015"
 
 __all__ = ["Monitor", "Computation", "ParameterSet", "ConstrainedParameterSet",
            "Result", "Experiment", "Serializer", "FileSerializer" "Datacube",
+           "ArrayDatacube", "DedupSerializer",
            "build_result_cube", "build_datacube", "BaseParser", "ClusterParser",
            "call_with", "set_stdout_logging", "InSituEnvironment",
+           "PoolEnvironment",
            "get_default_environment", "CTParser"]
 
 
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
 
+import json
+import numbers
+import struct
 from functools import reduce
 from itertools import product
 from copy import copy, deepcopy
@@ -154,6 +157,53 @@ class Datacube(Mapping):
     def __init__(self, parameters_ls, results_ls, exp_name="", force=True,
                  autopacking=False):
         self.autopacking = autopacking
+        metadata, domain, parameter_list, metrics = \
+            self._infer_structure(parameters_ls, results_ls, exp_name, force)
+
+        # Allocate the data vector
+        shape = []
+        for p in parameter_list:
+            v = domain[p]
+            shape.append(len(v))
+        shape.append(len(metrics))
+        length = reduce(lambda x,y:x*y, shape, 1)
+        data = [None for _ in range(length)]
+
+        # Fill the data vector
+        hasher = Hasher(metrics, domain, metadata)
+        for params, _metrics in zip(parameters_ls, results_ls):
+            for metric_name, val in _metrics.items():
+                params_ = {k:str(v) for k,v in params.items()}
+                index = hasher(str(metric_name), params_)
+                data[index] = val
+        datahash = "n/a"
+
+        # Set info
+        self.name = exp_name
+        self.metadata = metadata
+        self.domain = domain
+        self.parameters = parameter_list
+        self.metrics = metrics
+        self.data = data
+        self.datahash = datahash
+        self.hash = hasher
+        self.shape = tuple(shape)
+
+    @classmethod
+    def _infer_structure(cls, parameters_ls, results_ls, exp_name="",
+                         force=True):
+        """
+        Return
+        ------
+        metadata: mapping str -> str
+            The metadata and their (stringified) value
+        domain: mapping str -> list of str
+            The (sorted and stringified) domain of each parameter
+        parameter_list: list of str
+            The sorted parameter names
+        metrics: list of str
+            The sorted metric names
+        """
         param_tmp = {}
         # Build back the parameters domain
         if not force and len(parameters_ls) == 0:
@@ -198,35 +248,7 @@ class Datacube(Mapping):
         metrics = list(_set)
         metrics.sort()
         metrics = [str(m) for m in metrics]
-
-        # Allocate the data vector
-        shape = []
-        for p in parameter_list:
-            v = domain[p]
-            shape.append(len(v))
-        shape.append(len(metrics))
-        length = reduce(lambda x,y:x*y, shape, 1)
-        data = [None for _ in range(length)]
-
-        # Fill the data vector
-        hasher = Hasher(metrics, domain, metadata)
-        for params, _metrics in zip(parameters_ls, results_ls):
-            for metric_name, val in _metrics.items():
-                params_ = {k:str(v) for k,v in params.items()}
-                index = hasher(str(metric_name), params_)
-                data[index] = val
-        datahash = "n/a"
-
-        # Set info
-        self.name = exp_name
-        self.metadata = metadata
-        self.domain = domain
-        self.parameters = parameter_list
-        self.metrics = metrics
-        self.data = data
-        self.datahash = datahash
-        self.hash = hasher
-        self.shape = tuple(shape)
+        return metadata, domain, parameter_list, metrics
 
     def compute_data_hash(self):
         self.datahash = hashlist(self.data)
@@ -367,16 +389,26 @@ class Datacube(Mapping):
         # +-> Looking for a scalar
         # +--> We are sure to have a list of slices of one item
         if return_scalar:
-            metric = self.metrics[m_slice.start]
-            # We need to include the metadata for the hasher
-            params = {k:v for k,v in self.metadata.items()}
-            for i, slc in enumerate(p_slices):
-                p_name = self.parameters[i]
-                vals = self.domain[p_name]
-                params[p_name] = vals[slc.start]
-            return self.data[self.hash(metric, params)]
+            return self._get_scalar(p_slices, m_slice)
 
         # +-> Looking for a sliced Result
+        return self._slice(p_slices, m_slice)
+
+    def _get_scalar(self, p_slices, m_slice):
+        """Return the value at the given position. `p_slices` and `m_slice`
+        are slices of one item"""
+        metric = self.metrics[m_slice.start]
+        # We need to include the metadata for the hasher
+        params = {k:v for k,v in self.metadata.items()}
+        for i, slc in enumerate(p_slices):
+            p_name = self.parameters[i]
+            vals = self.domain[p_name]
+            params[p_name] = vals[slc.start]
+        return self.data[self.hash(metric, params)]
+
+    def _slice(self, p_slices, m_slice):
+        """Return a view of this cube restricted to the given slices/lists
+        of indices"""
         clone = copy(self)
         # Deepcopy of the dict which will be modified in place
         clone.metadata = deepcopy(self.metadata)
@@ -638,19 +670,389 @@ class Datacube(Mapping):
         return not self.__eq__(other)
 
 
+class ArrayDatacube(Datacube):
+    """
+    A :class:`Datacube` whose values are held in a dense NumPy array of shape
+    `shape` instead of a flat Python list. Slicing produces views on that
+    array and :meth:`numpyfy` does not need to rebuild the cube value by
+    value. Requires NumPy.
+
+    The values are stored as `float` whenever all the results are real
+    numbers (or None), and as `object` otherwise. The cube can also be built
+    directly from columns (cf. :meth:`from_columns`) and saved to a file
+    which can be memory-mapped back (cf. :meth:`save` and :meth:`load`).
+
+    Constructor parameters
+    ----------------------
+    Same as :class:`Datacube`
+
+    Instance variables
+    ------------------
+    Same as :class:`Datacube`, except for:
+    data: numpy.ndarray (of shape `shape`)
+        The raw data
+    missing: numpy.ndarray of bool (of shape `shape`)
+        Whether the corresponding value of `data` is missing
+    """
+    __MAGIC__ = b"\x93CTCUBE1"
+
+    def __init__(self, parameters_ls, results_ls, exp_name="", force=True,
+                 autopacking=False):
+        # Transpose the rows into columns
+        names = set()
+        for params in parameters_ls:
+            names.update(params.keys())
+        for params in parameters_ls:
+            if len(params) != len(names):
+                raise IndexError("Expecting %d parameters/metadata, got %d"
+                                 % (len(names), len(params)))
+        parameters = {name: [params[name] for params in parameters_ls]
+                      for name in names}
+        metric_names = set()
+        for res in results_ls:
+            metric_names.update(res.keys())
+        results = {name: [res.get(name) for res in results_ls]
+                   for name in metric_names}
+        self._fill(parameters, results, exp_name, force, autopacking)
+
+    @classmethod
+    def from_columns(cls, parameters, results, exp_name="", force=True,
+                     autopacking=False):
+        """
+        Build the cube from columns rather than from one mapping per
+        computation. Each parameter column is factorized once and the
+        position of every computation is computed in a vectorized fashion.
+
+        parameters: mapping param_name -> sequence of values
+            The value of the parameter for each computation
+        results: mapping metric_name -> sequence of values
+            The value of the metric for each computation, in the same order
+            as `parameters`. Missing values are None (or NaN)
+        exp_name, force, autopacking:
+            Cf. :class:`Datacube`
+        """
+        cube = cls.__new__(cls)
+        cube._fill(parameters, results, exp_name, force, autopacking)
+        return cube
+
+    @classmethod
+    def _factorize(cls, values):
+        """
+        Return
+        ------
+        domain: list
+            The sorted distinct values
+        codes: numpy.ndarray of int
+            The index in `domain` of each value
+        """
+        import numpy as np
+        if isinstance(values, np.ndarray) and values.dtype != object:
+            domain, codes = np.unique(values, return_inverse=True)
+            return domain.tolist(), codes.ravel()
+        positions = {}
+        codes = np.fromiter((positions.setdefault(v, len(positions))
+                             for v in values), dtype=np.intp,
+                            count=len(values))
+        if len(positions) == 0:
+            return [], codes
+        domain = sort_per_type(list(positions))
+        remap = np.empty(len(domain), dtype=np.intp)
+        for i, v in enumerate(domain):
+            remap[positions[v]] = i
+        return domain, remap[codes]
+
+    @classmethod
+    def _as_column(cls, values):
+        """Return `values` as a one-dimensional array, of `object` dtype
+        unless the values are numbers"""
+        import numpy as np
+        column = values
+        if not isinstance(column, np.ndarray):
+            column = np.asarray(values)
+            if column.ndim != 1 or column.dtype.kind not in "biuf":
+                # Keep the original objects (e.g. str rather than numpy.str_)
+                column = np.empty(len(values), dtype=object)
+                for i, v in enumerate(values):
+                    column[i] = v
+        elif column.dtype.kind not in "biufO":
+            column = column.astype(object)
+        return column
+
+    def _fill(self, parameters, results, exp_name, force, autopacking):
+        import numpy as np
+        lengths = set(len(v) for v in parameters.values())
+        lengths.update(len(v) for v in results.values())
+        if len(lengths) > 1:
+            raise ValueError("All the columns must have the same length ({})"
+                             "".format(exp_name))
+        n_comps = lengths.pop() if len(lengths) > 0 else 0
+        if not force and n_comps == 0:
+            raise ValueError("Empty cube. Use 'force=True' to ignore this "
+                             "issue ({}).".format(exp_name))
+
+        # Factorize the parameters
+        metadata = {}
+        parameter_list = []
+        domain = {}
+        codes = {}
+        for name, values in parameters.items():
+            values, codes_ = self._factorize(values)
+            if len(values) > 1:
+                domain[name] = [str(x) for x in values]
+                parameter_list.append(name)
+                codes[name] = codes_
+            elif len(values) == 1:
+                metadata[name] = str(values[0])
+            elif not force:
+                raise ValueError("Parameter '{}' has an empty domain. If "
+                                 "it is not useful, remove it ({})"
+                                 "".format(name, exp_name))
+        parameter_list.sort()
+        metric_names = sorted(results.keys())
+        metrics = [str(m) for m in metric_names]
+
+        # Flat position of each computation (stride dot-product)
+        positions = np.zeros(n_comps, dtype=np.intp)
+        for name in parameter_list:
+            positions *= len(domain[name])
+            positions += codes[name]
+
+        # Store the data as floats (NaN for the missing values) if every
+        # value is a real number, as objects otherwise
+        columns, presents = [], []
+        numeric = True
+        for name in metric_names:
+            column = self._as_column(results[name])
+            if column.dtype == object:
+                present = np.fromiter((v is not None for v in column),
+                                      dtype=bool, count=n_comps)
+                numeric = numeric and all(isinstance(v, numbers.Real)
+                                          for v in column[present])
+            elif column.dtype.kind == "f":
+                present = ~np.isnan(column)
+            else:
+                present = np.ones(n_comps, dtype=bool)
+            columns.append(column)
+            presents.append(present)
+
+        shape = tuple([len(domain[p]) for p in parameter_list] +
+                      [len(metrics)])
+        if numeric:
+            data = np.full(shape, np.nan, dtype=float)
+        else:
+            data = np.empty(shape, dtype=object)
+        missing = np.ones(shape, dtype=bool)
+
+        # Fill the data array, one metric at a time
+        if data.size > 0:
+            flat_data = data.reshape(-1, len(metrics))
+            flat_missing = missing.reshape(-1, len(metrics))
+            for i, (column, present) in enumerate(zip(columns, presents)):
+                flat_data[positions[present], i] = column[present]
+                flat_missing[positions[present], i] = False
+
+        # Set info
+        self.autopacking = autopacking
+        self.name = exp_name
+        self.metadata = metadata
+        self.domain = domain
+        self.parameters = parameter_list
+        self.metrics = metrics
+        self.data = data
+        self.missing = missing
+        self.datahash = "n/a"
+        self.hash = Hasher(metrics, domain, metadata)
+        self.shape = shape
+
+    def save(self, path):
+        """
+        Save the cube to `path` so that it can be memory-mapped back with
+        :meth:`load`. Only cubes of numbers can be saved.
+
+        The file is made of a magic string, the length of the header (8-byte
+        little-endian unsigned integer), a JSON header (name, metadata,
+        domain, parameters, metrics, shape and dtype) padded to a multiple
+        of 64 bytes, the values in C order and, finally, the missing mask.
+        """
+        import numpy as np
+        if self.data.dtype == object:
+            raise ValueError("Only cubes of numbers can be saved ({})"
+                             "".format(self.name))
+        header = {
+            "name": self.name,
+            "metadata": self.metadata,
+            "domain": self.domain,
+            "parameters": self.parameters,
+            "metrics": self.metrics,
+            "shape": list(self.shape),
+            "dtype": self.data.dtype.str,
+            "autopacking": self.autopacking,
+        }
+        header = json.dumps(header).encode("utf-8")
+        offset = len(self.__MAGIC__) + 8 + len(header)
+        header += b" " * (-offset % 64)
+        with open(path, "wb") as hdl:
+            hdl.write(self.__MAGIC__)
+            hdl.write(struct.pack("<Q", len(header)))
+            hdl.write(header)
+            hdl.write(np.ascontiguousarray(self.data).tobytes())
+            hdl.write(np.ascontiguousarray(self.missing).tobytes())
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        """
+        Load a cube saved with :meth:`save`.
+
+        path: str
+            The path of the file
+        mmap_mode: str or None (default: "r")
+            The mode used to memory-map the values (cf. `numpy.memmap`).
+            Slicing the cube and :meth:`numpyfy` only read the required
+            pages. If None, the values are read into memory
+        """
+        import numpy as np
+        with open(path, "rb") as hdl:
+            if hdl.read(len(cls.__MAGIC__)) != cls.__MAGIC__:
+                raise ValueError("'{}' is not a datacube file".format(path))
+            length, = struct.unpack("<Q", hdl.read(8))
+            header = json.loads(hdl.read(length).decode("utf-8"))
+        offset = len(cls.__MAGIC__) + 8 + length
+        shape = tuple(header["shape"])
+        dtype = np.dtype(header["dtype"])
+
+        def read(dtype, offset):
+            size = reduce(lambda x, y: x*y, shape, 1)
+            if mmap_mode is None or size == 0:
+                with open(path, "rb") as hdl:
+                    hdl.seek(offset)
+                    return np.fromfile(hdl, dtype=dtype,
+                                       count=size).reshape(shape)
+            return np.memmap(path, dtype=dtype, mode=mmap_mode,
+                             offset=offset, shape=shape)
+
+        data = read(dtype, offset)
+        missing = read(np.dtype(bool), offset + data.nbytes)
+
+        cube = cls.__new__(cls)
+        cube.autopacking = header["autopacking"]
+        cube.name = header["name"]
+        cube.metadata = header["metadata"]
+        cube.domain = header["domain"]
+        cube.parameters = header["parameters"]
+        cube.metrics = header["metrics"]
+        cube.data = data
+        cube.missing = missing
+        cube.datahash = "n/a"
+        cube.hash = Hasher(cube.metrics, cube.domain, cube.metadata)
+        cube.shape = shape
+        return cube
+
+    def compute_data_hash(self):
+        self.datahash = hashlist([None if m else v for v, m in
+                                  zip(self.data.ravel().tolist(),
+                                      self.missing.ravel().tolist())])
+        return self.datahash
+
+    def _get_scalar(self, p_slices, m_slice):
+        index = tuple(slc.start for slc in p_slices) + (m_slice.start,)
+        if self.missing[index]:
+            return None
+        return self.data[index]
+
+    def _slice(self, p_slices, m_slice):
+        import numpy as np
+        clone = super(ArrayDatacube, self)._slice(p_slices, m_slice)
+        data, missing = self.data, self.missing
+        axis = 0
+        for i, slc in enumerate(list(p_slices) + [m_slice]):
+            # A parameter left with a single value has become a metadatum:
+            # its axis must be dropped
+            kept = i == len(p_slices) or self.parameters[i] in clone.domain
+            if isinstance(slc, slice):
+                if not kept:
+                    slc = range(data.shape[axis])[slc][0]
+                key = (slice(None),) * axis + (slc,)
+                data, missing = data[key], missing[key]
+            elif kept:
+                data = np.take(data, slc, axis=axis)
+                missing = np.take(missing, slc, axis=axis)
+            else:
+                key = (slice(None),) * axis + (slc[0],)
+                data, missing = data[key], missing[key]
+            if kept:
+                axis += 1
+        clone.data = data
+        clone.missing = missing
+        return clone
+
+    def numpyfy(self, squeeze=True):
+        """
+        Return the values as a float array of shape `shape` (missing
+        values are NaN). If the cube already holds floats, no copy is made:
+        the returned array is a view on this cube.
+        """
+        import numpy as np
+        arr = self.data
+        if arr.dtype != float:
+            arr = np.where(self.missing, np.nan, arr).astype(float)
+        if len(self.parameters) > 0 and squeeze and arr.shape[-1] == 1:
+            arr = arr.squeeze()
+        return arr
+
+    def reorder_parameters(self, *args):
+        # Do not reorder the parameters of the cubes sharing the list
+        before = self.parameters
+        self.parameters = list(before)
+        super(ArrayDatacube, self).reorder_parameters(*args)
+        axes = [before.index(p) for p in self.parameters] + [len(before)]
+        self.data = self.data.transpose(axes)
+        self.missing = self.missing.transpose(axes)
+        self.shape = self.data.shape
+
+    def items(self):
+        import numpy as np
+        p_gen = product(*[self.domain[p] for p in self.parameters])
+        for params, index in zip(p_gen, np.ndindex(*self.shape[:-1])):
+            values, missing = self.data[index], self.missing[index]
+            data = tuple(None if m else v for v, m in zip(values, missing))
+            yield params, data
+
+    def __eq__(self, other):
+        import numpy as np
+        if not isinstance(other, self.__class__):
+            return False
+        same = True
+        same = same and (self.name == other.name)
+        same = same and (self.metadata == other.metadata)
+        same = same and (self.parameters == other.parameters)
+        same = same and (self.domain == other.domain)
+        same = same and (self.metrics == other.metrics)
+        same = same and np.array_equal(self.missing, other.missing)
+        same = same and np.array_equal(self.data[~self.missing],
+                                       other.data[~other.missing])
+        return same
+
+
 @deprecated
 def build_result_cube(exp_name):
     return build_datacube(exp_name)
 
 
 def build_datacube(exp_name, storage_factory=PickleStorage, force=True,
-                   autopacking=False, **default_meta):
+                   autopacking=False, datacube_factory=Datacube,
+                   metrics=None, **default_meta):
     """
+    datacube_factory: callable (default: :class:`Datacube`)
+        The class of the cube to build (e.g. :class:`ArrayDatacube`)
+    metrics: iterable of str or None (default: None)
+        The metrics of the cube. None for all the metrics. Storages which
+        can do so do not read the other metrics at all
     default_meta: mapping str -> str
         The (potientially) missing metadata
     """
     storage = storage_factory(experiment_name=exp_name)
-    parameters_ls, results_ls = storage.load_params_and_results(**default_meta)
-    return Datacube(parameters_ls, results_ls, exp_name, force=force,
-                    autopacking=autopacking)
+    parameters_ls, results_ls = storage.load_params_and_results(
+        metrics=metrics, **default_meta)
+    return datacube_factory(parameters_ls, results_ls, exp_name, force=force,
+                            autopacking=autopacking)
 
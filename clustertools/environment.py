@@ -1,19 +1,26 @@
 # -*- coding: utf-8 -*-
 import shutil
 import sys
+import glob
 import os
 import subprocess
 import logging
-from time import time as epoch
+import threading
+import socket
+from time import time as epoch, monotonic, sleep
 from datetime import datetime
 from abc import ABCMeta, abstractmethod
 from shlex import quote as escape
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, \
+    wait, FIRST_COMPLETED
 import copy
+import hashlib
 
 import dill
 
 from clustertools.util import catch_logging
-from .state import PendingState, AbortedState
+from .state import PendingState, AbortedState, LaunchableState
+from .storage import Storage
 
 __author__ = "Begon Jean-Michel <jm.begon@gmail.com>"
 __copyright__ = "3-clause BSD License"
@@ -28,9 +35,9 @@ class Serializer(object):
         """Return a unserializable string"""
         return dill.dumps(lazy_computation, -1)
 
-    def deserialize(self, serlialized):
+    def deserialize(self, serialized):
         """Return the object represented by the serialized string"""
-        return dill.loads(serlialized)
+        return dill.loads(serialized)
 
     def serialize_and_script(self, lazy_computation):
         """Return a script to run the lazy_computation"""
@@ -50,6 +57,28 @@ class Serializer(object):
     def __call__(self, serialized):
         self.deserialize_and_run(serialized)
 
+    def save_payload(self, lazy_computation, fpath):
+        """Save the serialized computation in the file `fpath`"""
+        with open(fpath, "wb") as hdl:
+            dill.dump(self.serialize(lazy_computation), hdl, -1)
+
+    def payload_script(self):
+        """Return a script to run the computation saved by
+        :meth:`save_payload`, whose path is to be appended as last
+        argument"""
+        return [sys.executable, '-c',
+                'import sys;'
+                'from {mod} import {cls};'
+                '{repr}.run_payload(sys.argv[1])'
+                ''.format(mod=__name__,
+                          cls=self.__class__.__name__,
+                          repr=repr(self))]
+
+    def run_payload(self, fpath):
+        with open(fpath, "rb") as hdl:
+            serialized = dill.load(hdl)
+        self.deserialize_and_run(serialized)
+
 
 class FileSerializer(Serializer):
 
@@ -60,16 +89,300 @@ class FileSerializer(Serializer):
             dill.dump(lazy_computation, hdl, -1)
         return fpath
 
-    def deserialize(self, serlialized):
-        with open(serlialized, "rb") as hdl:
+    def deserialize(self, serialized):
+        with open(serialized, "rb") as hdl:
             lazy_computation = dill.load(hdl)
         try:
-            os.remove(serlialized)
+            os.remove(serialized)
         except IOError:
             pass
         return lazy_computation
 
 
+class DedupSerializer(Serializer):
+    """
+    `DedupSerializer`
+    =================
+    A `Serializer` which only embeds a small record per computation (its
+    name and parameters) in the script. What the computations share (their
+    class and the rest of their attributes) is saved once in the mess
+    folder of the experiment, in files named after the hash of their
+    content.
+
+    The shared files are not removed after loading since other computations
+    might still need them. The shared attributes are only dumped when they
+    differ from those of the computations serialized before: objects are
+    compared by identity (so they must not be modified in place in the
+    meantime), except for the plain values and the storages, which are
+    compared by value and by representation respectively.
+    """
+    # What differs from one computation to the other
+    __OWN_ATTRIBUTES__ = ("comp_name", "parameters", "current_state")
+    # Attributes of these types are compared by value
+    __VALUE_TYPES__ = (str, bytes, bool, int, float, type(None))
+
+    def __init__(self):
+        self._class_paths = {}  # (class, messy folder) -> path
+        self._shared_paths = {}  # shared key -> (shared attributes, path)
+
+    def _store(self, storage, payload):
+        """Save the `payload` (unless it already exists) and return its
+        path"""
+        digest = hashlib.sha256(payload).hexdigest()
+        fpath = storage.get_messy_path("{}.blob".format(digest))
+        if not os.path.exists(fpath):
+            tmp_path = "{}.{}-{}.tmp".format(fpath, os.getpid(),
+                                             threading.get_ident())
+            with open(tmp_path, "wb") as hdl:
+                hdl.write(payload)
+            os.replace(tmp_path, fpath)
+        return fpath
+
+    @classmethod
+    def _load(cls, fpath):
+        with open(fpath, "rb") as hdl:
+            return dill.load(hdl)
+
+    def _shared_key(self, class_key, shared):
+        """Return a key identifying the `shared` attributes without dumping
+        them"""
+        key = [class_key]
+        for name, value in sorted(shared.items()):
+            if isinstance(value, self.__VALUE_TYPES__):
+                key.append((name, type(value), value))
+            elif isinstance(value, Storage):
+                key.append((name, type(value), repr(value)))
+            else:
+                key.append((name, id(value)))
+        return tuple(key)
+
+    def serialize(self, lazy_computation):
+        storage = lazy_computation.storage
+        # The class (which might be heavy if defined in the main script) is
+        # only dumped once
+        key = lazy_computation.__class__, storage.get_messy_path()
+        class_path = self._class_paths.get(key)
+        if class_path is None:
+            class_path = self._store(storage,
+                                     dill.dumps(lazy_computation.__class__,
+                                                -1))
+            self._class_paths[key] = class_path
+        shared = {k: v for k, v in lazy_computation.__getstate__().items()
+                  if k not in self.__OWN_ATTRIBUTES__}
+        key = self._shared_key(key, shared)
+        cached = self._shared_paths.get(key)
+        if cached is None:
+            # The attributes are kept so that the identities in the key
+            # cannot be reused by other objects
+            cached = shared, self._store(storage, dill.dumps(shared, -1))
+            self._shared_paths[key] = cached
+        shared_path = cached[1]
+        return dill.dumps((class_path, shared_path,
+                           lazy_computation.comp_name,
+                           lazy_computation.parameters,
+                           lazy_computation.current_state), -1)
+
+    def deserialize(self, serialized):
+        class_path, shared_path, comp_name, parameters, current_state = \
+            dill.loads(serialized)
+        computation_cls = self._load(class_path)
+        lazy_computation = computation_cls.__new__(computation_cls)
+        lazy_computation.__setstate__(self._load(shared_path))
+        lazy_computation.comp_name = comp_name
+        lazy_computation.current_state = current_state
+        return lazy_computation.lazyfy(**parameters)
+
+
+def run_and_log(lazy_computation, log_file=None):
+    """Run the `lazy_computation`, redirecting the standard output and error
+    to the `log_file` (if not None)"""
+    if log_file is None:
+        lazy_computation()
+        return
+    sys_backup = sys.stdout, sys.stderr
+    try:
+        with open(log_file, "w") as hdl:
+            sys.stdout = sys.stderr = hdl
+            lazy_computation()
+    finally:
+        sys.stdout, sys.stderr = sys_backup
+
+
+def _run_in_worker(serializer, serialized, log_file=None):
+    # Entry point of the worker processes of the `PoolEnvironment`
+    run_and_log(serializer.deserialize(serialized), log_file)
+
+
+class ComputationQueue(object):
+    """
+    `ComputationQueue`
+    ==================
+    A queue of serialized computations stored as files in a folder and
+    shared by several :class:`Worker`. A worker claims a computation by
+    renaming its file, which is atomic, so that a computation is never run
+    twice even if the workers run on different machines (provided the
+    folder is on a shared file system).
+
+    Constructor parameters
+    ----------------------
+    folder: str
+        The folder of the queue (created if needed)
+    """
+    __SUFFIX__ = ".comp"
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._count = 0
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+
+    def __repr__(self):
+        return "{cls}(folder={folder})".format(cls=self.__class__.__name__,
+                                               folder=repr(self.folder))
+
+    def __len__(self):
+        """The number of computations which have not been claimed yet"""
+        return len([fname for fname in os.listdir(self.folder)
+                    if fname.endswith(self.__SUFFIX__)])
+
+    def put(self, lazy_computation):
+        """Add the computation at the end of the queue"""
+        fname = "{:08d}-{}{}".format(self._count, lazy_computation.comp_name,
+                                     self.__SUFFIX__)
+        fpath = os.path.join(self.folder, fname)
+        # Workers might be running: the file must not be seen half-written
+        tmp_path = "{}.tmp".format(fpath)
+        with open(tmp_path, "wb") as hdl:
+            dill.dump(lazy_computation, hdl, -1)
+        os.replace(tmp_path, fpath)
+        self._count += 1
+
+    def claim(self):
+        """Return the path of the first computation claimed in the queue, or
+        None if the queue is empty"""
+        fnames = sorted(fname for fname in os.listdir(self.folder)
+                        if fname.endswith(self.__SUFFIX__))
+        for fname in fnames:
+            fpath = os.path.join(self.folder, fname)
+            claimed = "{}.{}-{}".format(fpath, socket.gethostname(),
+                                        os.getpid())
+            try:
+                os.rename(fpath, claimed)
+            except OSError:
+                # Claimed by another worker
+                continue
+            return claimed
+        return None
+
+    def load(self, claimed):
+        """Return the lazy computation at path `claimed`"""
+        with open(claimed, "rb") as hdl:
+            return dill.load(hdl)
+
+    def release(self, claimed):
+        """Remove the computation once it has been run"""
+        try:
+            os.remove(claimed)
+        except OSError:
+            pass
+
+    @classmethod
+    def _is_alive(cls, pid):
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            # E.g. owned by another user
+            pass
+        return True
+
+    def collect(self):
+        """Release the computations claimed by the workers of this host which
+        died before releasing them. If no computation is left, remove the
+        queue. Return whether it was removed"""
+        hostname = socket.gethostname()
+        left = False
+        for fname in os.listdir(self.folder):
+            if fname.endswith(self.__SUFFIX__):
+                left = True
+                continue
+            _, sep, owner = fname.rpartition(self.__SUFFIX__ + ".")
+            if len(sep) == 0:
+                # Manifests and files being put
+                continue
+            host, _, pid = owner.rpartition("-")
+            if host == hostname and pid.isdigit() and \
+                    not self._is_alive(int(pid)):
+                self.release(os.path.join(self.folder, fname))
+            else:
+                left = True
+        if left:
+            return False
+        shutil.rmtree(self.folder, ignore_errors=True)
+        return True
+
+
+class Worker(object):
+    """
+    `Worker`
+    ========
+    A long-lived process which runs the computations of a
+    :class:`ComputationQueue` one after the other until the queue is empty.
+    The interpreter start-up and the imports are thus paid once per worker
+    rather than once per computation.
+
+    Constructor parameters
+    ----------------------
+    folder: str
+        The folder of the :class:`ComputationQueue`
+    stdout: boolean (default: False)
+        Whether to print the output of the computations on the standard
+        output rather than redirect them to their log file
+    """
+    def __init__(self, folder, stdout=False):
+        self.folder = folder
+        self.stdout = stdout
+
+    def __repr__(self):
+        return "{cls}(folder={folder}, stdout={stdout})" \
+               "".format(cls=self.__class__.__name__,
+                         folder=repr(self.folder),
+                         stdout=repr(self.stdout))
+
+    def script(self):
+        """Return a script to run the worker"""
+        return [sys.executable, '-c',
+                'from {mod} import {cls};'
+                '{repr}()'.format(mod=__name__,
+                                  cls=self.__class__.__name__,
+                                  repr=repr(self))]
+
+    def __call__(self):
+        """Run the computations of the queue and return how many were run"""
+        logger = logging.getLogger("clustertools")
+        queue = ComputationQueue(self.folder)
+        # Each computation is run as in `InSituEnvironment`
+        environment = InSituEnvironment(stdout=self.stdout)
+        count = 0
+        claimed = queue.claim()
+        while claimed is not None:
+            try:
+                lazy_computation = queue.load(claimed)
+                logger.info("Running '{}'".format(lazy_computation.comp_name))
+                environment.issue(lazy_computation)
+            except Exception as exception:
+                # The state is saved by the computation itself
+                logger.warning("Computation '{}' failed. Reason: {}"
+                               "".format(claimed, repr(exception)))
+            finally:
+                queue.release(claimed)
+            count += 1
+            claimed = queue.claim()
+        queue.collect()
+        return count
+
+
 class Session(object):
     """
     `Session`
@@ -82,6 +395,7 @@ class Session(object):
         self.exp_len = None
         self.storage = None
         self.n_launch = 0
+        self.n_failed = 0
         self.opened = False
         self.fail_fast = parent_environment.fail_fast
         self.logger = logging.getLogger("clustertools")
@@ -101,6 +415,7 @@ class Session(object):
 
     def __enter__(self):
         self.n_launch = 0
+        self.n_failed = 0
         self.logger.info("Launching experiment '{exp_name}' in environment "
                          "'{cls}'"
                          "".format(exp_name=self.storage.exp_name,
@@ -125,10 +440,10 @@ class Session(object):
             raise ValueError("The session has not been opened.")
         try:
             if self.update_state:
-                self.storage.update_state(PendingState(
-                    lazy_computation.comp_name))
+                self.storage.update_state(PendingState.from_(
+                    lazy_computation.current_state))
             self.logger.debug("Launching '{}'""".format(repr(lazy_computation)))
-            self.environment.issue(lazy_computation)
+            self.issue(lazy_computation)
             self.n_launch += 1
         except Exception as exception:
             if self.update_state:
@@ -138,12 +453,16 @@ class Session(object):
             self.logger.warning("Could not launch '{}'. Reason: {}"
                                 "".format(repr(lazy_computation),
                                           repr(exception)))
+            self.n_failed += 1
             if self.fail_fast:
                 raise
             return False
 
         return True
 
+    def issue(self, lazy_computation):
+        self.environment.issue(lazy_computation)
+
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.logger.info("Experiment '{exp_name}': {n_launch}/{exp_len} "
                          "computation(s)".format(exp_name=self.storage.exp_name,
@@ -158,6 +477,253 @@ class DebugSession(Session):
         return False
 
 
+class ArraySession(Session):
+    """
+    `ArraySession`
+    ==============
+    A `Session` which does not issue the computations one by one. Instead,
+    it groups them by environment parameters (as given by the
+    `_env_params` method of the environment) and issues each group at once
+    through the `issue_array` method of the environment. A group is issued
+    when it reaches `max_array_size` computations or when the session is
+    closed.
+    """
+    def __init__(self, parent_environment, max_array_size=1000):
+        super().__init__(parent_environment)
+        self.max_array_size = max_array_size
+        self.groups = {}
+
+    def run(self, lazy_computation):
+        if not self.is_open():
+            raise ValueError("The session has not been opened.")
+        env_params = self.environment._env_params(lazy_computation)
+        key = repr(sorted(env_params.items()))
+        _, group = self.groups.setdefault(key, (env_params, []))
+        group.append(lazy_computation)
+        if len(group) >= self.max_array_size:
+            return self.flush(key)
+        return True
+
+    def flush(self, key):
+        """Issue the group of computations corresponding to `key`"""
+        env_params, lazy_computations = self.groups.pop(key)
+        comp_names = [x.comp_name for x in lazy_computations]
+        try:
+            if self.update_state:
+                self.storage.update_states(
+                    [PendingState.from_(x.current_state)
+                     for x in lazy_computations])
+            self.logger.debug("Launching group of {} computations: {}"
+                              "".format(len(comp_names), comp_names))
+            self.issue_group(lazy_computations, env_params)
+            self.n_launch += len(lazy_computations)
+        except Exception as exception:
+            if self.update_state:
+                self.storage.update_states([AbortedState(comp_name,
+                                                         exception=exception)
+                                            for comp_name in comp_names])
+            self.logger.warning("Could not launch the group of {} "
+                                "computations. Reason: {}"
+                                "".format(len(comp_names), repr(exception)))
+            self.n_failed += len(lazy_computations)
+            if self.fail_fast:
+                raise
+            return False
+
+        return True
+
+    def issue_group(self, lazy_computations, env_params):
+        self.environment.issue_array(lazy_computations, env_params)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                for key in list(self.groups.keys()):
+                    self.flush(key)
+        finally:
+            self.groups = {}
+            super().__exit__(exc_type, exc_val, exc_tb)
+
+
+class PackSession(ArraySession):
+    """
+    `PackSession`
+    =============
+    An `ArraySession` which issues each group of computations as a single
+    job through the `issue_pack` method of the environment
+    """
+    def issue_group(self, lazy_computations, env_params):
+        self.environment.issue_pack(lazy_computations, env_params)
+
+
+class QueueSession(Session):
+    """
+    `QueueSession`
+    ==============
+    A `Session` which puts the computations in a :class:`ComputationQueue`
+    and starts `n_workers` :class:`Worker` to run them (through the
+    `start_workers` method of the environment) when it is closed.
+    """
+    def __init__(self, parent_environment, n_workers):
+        super().__init__(parent_environment)
+        self.n_workers = n_workers
+        self.queue = None
+        self.comp_names = []
+
+    def __enter__(self):
+        super().__enter__()
+        folder = self.storage.get_messy_path("queue-{}".format(str(epoch())))
+        self.queue = ComputationQueue(folder)
+        self.comp_names = []
+        return self
+
+    def issue(self, lazy_computation):
+        self.queue.put(lazy_computation)
+        self.comp_names.append(lazy_computation.comp_name)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if len(self.comp_names) > 0:
+                # The queued computations are pending, even if the session
+                # was interrupted
+                self.start_workers()
+        finally:
+            super().__exit__(exc_type, exc_val, exc_tb)
+
+    def start_workers(self):
+        n_workers = min(self.n_workers, len(self.comp_names))
+        try:
+            self.logger.debug("Starting {} workers for {} computations"
+                              "".format(n_workers, len(self.comp_names)))
+            self.environment.start_workers(self.queue, n_workers,
+                                           self.storage, self.comp_names)
+        except Exception as exception:
+            if self.update_state:
+                self.storage.update_states([AbortedState(comp_name,
+                                                         exception=exception)
+                                            for comp_name in self.comp_names])
+            self.logger.warning("Could not start the workers. Reason: {}"
+                                "".format(repr(exception)))
+            self.n_launch -= len(self.comp_names)
+            self.n_failed += len(self.comp_names)
+            if self.fail_fast:
+                raise
+
+
+class ExecutorSession(Session):
+    """
+    `ExecutorSession`
+    =================
+    A `Session` which issues the computations concurrently through an
+    executor (by default, a pool of `max_in_flight` threads calling the
+    `issue` method of the environment). At most `max_in_flight`
+    computations are in flight at any time: :meth:`run` blocks until one is
+    over. The computations which fail are marked as aborted as they come
+    back. Closing the session waits for all of them.
+    """
+    def __init__(self, parent_environment, max_in_flight):
+        super().__init__(parent_environment)
+        self.max_in_flight = max_in_flight
+        self.executor = None
+        self.futures = {}  # future -> comp_name
+
+    def create_executor(self):
+        return ThreadPoolExecutor(max_workers=self.max_in_flight)
+
+    def submit(self, lazy_computation):
+        """Submit the computation to the executor and return the future"""
+        return self.executor.submit(self.environment.issue, lazy_computation)
+
+    def __enter__(self):
+        super().__enter__()
+        self.executor = self.create_executor()
+        self.futures = {}
+        return self
+
+    def run(self, lazy_computation):
+        if self.is_open():
+            # Wait for a free slot
+            self.collect(self.max_in_flight - 1)
+        return super().run(lazy_computation)
+
+    def issue(self, lazy_computation):
+        future = self.submit(lazy_computation)
+        self.futures[future] = lazy_computation.comp_name
+
+    def collect(self, max_running=0):
+        """Wait until at most `max_running` computations are in flight and
+        account for the ones which are over"""
+        while True:
+            for future in [x for x in self.futures if x.done()]:
+                self._terminate(future)
+            if len(self.futures) <= max_running:
+                return
+            wait(self.futures, return_when=FIRST_COMPLETED)
+
+    def _terminate(self, future):
+        comp_name = self.futures.pop(future)
+        exception = future.exception()
+        if exception is None:
+            return
+        if self.update_state:
+            self.storage.update_state(AbortedState(comp_name,
+                                                   exception=exception))
+        self.logger.warning("Computation '{}' failed. Reason: {}"
+                            "".format(comp_name, repr(exception)))
+        self.n_launch -= 1
+        self.n_failed += 1
+        if self.fail_fast:
+            raise exception
+
+    def cancel(self):
+        """Cancel the computations which have not started yet and make them
+        launchable again"""
+        cancelled = [future for future in self.futures if future.cancel()]
+        comp_names = [self.futures.pop(future) for future in cancelled]
+        if self.update_state and len(comp_names) > 0:
+            self.storage.update_states([LaunchableState(comp_name)
+                                        for comp_name in comp_names])
+        self.n_launch -= len(comp_names)
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            if exc_type is None:
+                self.collect()
+        finally:
+            if len(self.futures) > 0:
+                # Interrupted or failed fast
+                self.cancel()
+            self.executor.shutdown(wait=True)
+            self.executor = None
+            self.futures = {}
+            super().__exit__(exc_type, exc_val, exc_tb)
+
+
+class PoolSession(ExecutorSession):
+    """
+    `PoolSession`
+    =============
+    An `ExecutorSession` which runs the computations in a pool of
+    `n_workers` processes.
+    """
+    def __init__(self, parent_environment, n_workers):
+        super().__init__(parent_environment, n_workers)
+
+    @property
+    def n_workers(self):
+        return self.max_in_flight
+
+    def create_executor(self):
+        return ProcessPoolExecutor(max_workers=self.n_workers)
+
+    def submit(self, lazy_computation):
+        log_file = self.environment.get_log_file(lazy_computation)
+        serialized = self.environment.serializer.serialize(lazy_computation)
+        return self.executor.submit(_run_in_worker,
+                                    self.environment.serializer,
+                                    serialized, log_file)
+
+
 class Environment(object, metaclass=ABCMeta):
     """
     `Environment`
@@ -204,6 +770,15 @@ class Environment(object, metaclass=ABCMeta):
         """
         return None
 
+    @classmethod
+    def list_job_states(cls, user=None):
+        """
+        Same as :meth:`list_up_jobs` but return a mapping from the job names
+        to their state in the scheduler, or None if the environment does not
+        support this feature
+        """
+        return None
+
     def __init__(self, fail_fast=True):
         self.fail_fast = fail_fast
         self._customizers = []
@@ -252,7 +827,6 @@ class Environment(object, metaclass=ABCMeta):
             raise AttributeError('{} is not usable in this setting'
                                  ''.format(self.__class__.__name__))
 
-        error_count = 0
         with self.create_session(experiment) as session:
             for lazy_comp in experiment.yield_computations(self.context(),
                                                            start,
@@ -260,9 +834,9 @@ class Environment(object, metaclass=ABCMeta):
                                                            self.auto_refresh):
                 # a lazy_comp (lazy_computation) is a callable which runs
                 # the computation
-                if not session.run(lazy_comp):
-                    error_count += 1
-        return error_count
+                session.run(lazy_comp)
+        # Sessions might issue some computations when closing
+        return session.n_failed
 
     @abstractmethod
     def issue(self, lazy_computation):
@@ -378,21 +952,62 @@ class InSituEnvironment(Environment):
                          stdout=repr(self.stdout),
                          fail_fast=self.fail_fast)
 
-    def issue(self, lazy_computation):
+    def get_log_file(self, lazy_computation):
+        """Return the path of the log file of the computation, or None to
+        print on the standard output"""
         if self.stdout:
-            lazy_computation()
-            return
-
+            return None
         storage = lazy_computation.storage
-        log_file = storage.get_log_prefix(lazy_computation.comp_name,
-                                          ".{}".format(str(epoch())))
-        sys_backup = sys.stdout, sys.stderr
-        try:
-            with open(log_file, "w") as hdl:
-                sys.stdout = sys.stderr = hdl
-                lazy_computation()
-        finally:
-            sys.stdout, sys.stderr = sys_backup
+        return storage.get_log_prefix(lazy_computation.comp_name,
+                                      ".{}".format(str(epoch())))
+
+    def issue(self, lazy_computation):
+        run_and_log(lazy_computation, self.get_log_file(lazy_computation))
+
+
+class PoolEnvironment(InSituEnvironment):
+    """
+    PoolEnvironment
+    ===============
+    An `Environment` that runs the computations in parallel in a pool of
+    worker processes on the current machine. The launch returns once all the
+    computations are over.
+
+    Constructor Parameters
+    ----------------------
+    n_workers: int or None (default: None)
+        The number of worker processes, i.e. the maximum number of
+        computations running at the same time. None for the number of CPUs
+    serializer: :class:`Serializer` (default: Serializer())
+        The serializer used to transfer the computations to the workers
+    stdout: boolean (defaul: False)
+        Whether to print on the standard output rather than redirect
+        to a log file. Setting False is the standard way for environment.
+    fail_fast: boolean (default: True)
+        Whether to stop at the first computation which fails. The
+        computations which have not started yet are then made launchable
+        again
+    """
+    def __init__(self, n_workers=None, serializer=Serializer(), stdout=False,
+                 fail_fast=True):
+        super().__init__(stdout, fail_fast)
+        if n_workers is None:
+            n_workers = os.cpu_count() or 1
+        self.n_workers = n_workers
+        self.serializer = serializer
+
+    def __repr__(self):
+        return "{cls}(n_workers={n_workers}, serializer={serializer}, " \
+               "stdout={stdout}, fail_fast={fail_fast})" \
+               "".format(cls=self.__class__.__name__,
+                         n_workers=repr(self.n_workers),
+                         serializer=repr(self.serializer),
+                         stdout=repr(self.stdout),
+                         fail_fast=repr(self.fail_fast))
+
+    def create_session(self, experiment):
+        return PoolSession(self, self.n_workers).init(len(experiment),
+                                                      experiment.storage)
 
 
 class BashEnvironment(Environment):
@@ -402,17 +1017,42 @@ class BashEnvironment(Environment):
     def is_usable(cls):
         return True
 
-    def __init__(self, serializer=Serializer(), fail_fast=True):
+    def __init__(self, serializer=Serializer(), fail_fast=True,
+                 workers=None):
         super(BashEnvironment, self).__init__(fail_fast)
         # Since Serializer is totally stateless, it can be shared among
         # several instances
         self.serializer = serializer
+        # If not None, the number of `Worker` processes running the
+        # computations instead of one process per computation
+        self.workers = workers
 
     def __repr__(self):
-        return "{cls}(serializer={serializer}, fail_fast={fail_fast})" \
+        return "{cls}(serializer={serializer}, fail_fast={fail_fast}, " \
+               "workers={workers})" \
                "".format(cls=self.__class__.__name__,
                          fail_fast=repr(self.fail_fast),
-                         serializer=repr(self.serializer))
+                         serializer=repr(self.serializer),
+                         workers=repr(self.workers))
+
+    def create_session(self, experiment):
+        if self.workers is None:
+            return super().create_session(experiment)
+        return QueueSession(self, self.workers).init(len(experiment),
+                                                     experiment.storage)
+
+    def start_workers(self, queue, n_workers, storage, comp_names):
+        """Start `n_workers` processes running the computations of the
+        `queue` (the `comp_names`)"""
+        prefix = os.path.basename(queue.folder)
+        for i in range(n_workers):
+            worker = Worker(queue.folder)
+            log_file = storage.get_log_prefix(prefix, "-worker{}.txt"
+                                                      "".format(i))
+            # The child process has its own copy of the file descriptor
+            with open(log_file, "w") as file_handle:
+                subprocess.Popen(worker.script(), stderr=file_handle,
+                                 stdout=file_handle)
 
     def issue(self, lazy_computation):
         job_command = self.serializer.serialize_and_script(lazy_computation)
@@ -429,6 +1069,81 @@ class BashEnvironment(Environment):
 
 
 class SlurmEnvironment(Environment):
+    """
+    SlurmEnvironment
+    ================
+    An `Environment` which submits the computations to Slurm.
+
+    Constructor Parameters
+    ----------------------
+    serializer: :class:`Serializer` (default: Serializer())
+        The serializer used to transfer the computations to the nodes
+    time: str (default: "1:00:00")
+        The maximum time of each job
+    memory: int (default: 4000)
+        The maximum memory (in MB) of each job
+    partition: str or None (default: None)
+        The partition on which to launch the jobs
+    n_proc: int or None (default: None)
+        The number of CPUs per job
+    gpu: int or None (default: None)
+        The number of GPUs per job
+    shell_script: str (default: "#!/bin/bash")
+        The shebang of the submitted scripts
+    fail_fast: boolean (default: True)
+    other_flags: list of str or None (default: None)
+        Other flags for `sbatch`
+    other_options: mapping str -> str or None (default: None)
+        Other options for `sbatch`
+    array: boolean (default: False)
+        Whether to submit the computations as job arrays rather than one job
+        per computation. The computations sharing the same (customized)
+        environment parameters are submitted together
+    max_array_size: int (default: 1000)
+        The maximum number of computations per job array
+    pack: int or None (default: None)
+        If not None, the number of computations to run in a single job (the
+        computations sharing the same environment parameters are packed
+        together). The `time` is then that of the whole pack. Each
+        computation still has its own log file. Takes precedence over
+        `array`
+    pack_parallel: boolean (default: False)
+        Whether to run `n_proc` computations of a pack at the same time
+        rather than one after the other
+    workers: int or None (default: None)
+        If not None, the computations are put in a queue and this number of
+        jobs are submitted, each running a :class:`Worker` which takes
+        computations from the queue until it is empty. The `time` is then
+        that of a worker and the customizations are not applied
+    submitters: int or None (default: None)
+        If not None, the number of `sbatch` submissions in flight at the
+        same time when submitting one job per computation. Otherwise, the
+        jobs are submitted one after the other
+    submit_retries: int (default: 3)
+        The number of times a submission is retried when `sbatch` fails
+        for a transient reason (e.g. a socket time out)
+    submit_backoff: float (default: 1.)
+        The number of seconds to wait before the first retry. The delay
+        doubles at each retry
+    """
+    # `sbatch` errors after which the submission is worth retrying
+    __TRANSIENT_ERRORS__ = ("socket timed out",
+                            "temporarily unavailable",
+                            "temporarily unable",
+                            "unable to contact slurm controller",
+                            "transient")
+    # Prefix of the name of the jobs referring to several computations. It is
+    # followed by the path of the manifest listing their names
+    __MANIFEST_PREFIX__ = "ct@"
+    # Manifests younger than that (in seconds) are never removed, since
+    # their job might not be submitted yet
+    __MANIFEST_GRACE__ = 600.
+
+    # Process-wide cache of the `squeue` snapshots: user -> (time, snapshot).
+    # Snapshots older than `squeue_ttl` seconds are refreshed
+    squeue_ttl = 10.
+    _squeue_cache = {}
+    _squeue_lock = threading.Lock()
 
     @classmethod
     def is_usable(cls):
@@ -436,8 +1151,48 @@ class SlurmEnvironment(Environment):
 
     @classmethod
     def list_up_jobs(cls, user=None):
+        snapshot = cls._squeue_snapshot(user)
+        if snapshot is None:
+            return None
+        return [comp_name for comp_name, _, _ in snapshot]
+
+    @classmethod
+    def list_job_states(cls, user=None):
+        """
+        Return a mapping comp_name -> (state, elapsed time) of the jobs in
+        the hands of Slurm (e.g. ("PENDING", "0:00") or
+        ("RUNNING", "1:02:03")), or None if `squeue` is not available.
+        This relies on the same snapshot as :meth:`list_up_jobs`
+        """
+        snapshot = cls._squeue_snapshot(user)
+        if snapshot is None:
+            return None
+        return {comp_name: (state, elapsed)
+                for comp_name, state, elapsed in snapshot}
+
+    @classmethod
+    def invalidate_squeue_cache(cls):
+        with cls._squeue_lock:
+            cls._squeue_cache.clear()
+
+    @classmethod
+    def _squeue_snapshot(cls, user=None):
+        """Return the list of (comp_name, state, elapsed time) of the jobs
+        of the user, as cached for the last `squeue_ttl` seconds"""
+        with cls._squeue_lock:
+            now = monotonic()
+            cached = cls._squeue_cache.get(user)
+            if cached is not None and now - cached[0] < cls.squeue_ttl:
+                return cached[1]
+            lines = cls._call_squeue(user)
+            snapshot = None if lines is None else cls._parse_squeue(lines)
+            cls._squeue_cache[user] = (now, snapshot)
+            return snapshot
+
+    @classmethod
+    def _call_squeue(cls, user=None):
         # Taken from clusterlib (https://github.com/clusterlib/clusterlib)
-        command = ["squeue", "--noheader", "-o", "%j"]
+        command = ["squeue", "--noheader", "--array", "-o", "%K|%T|%M|%j"]
         if user is not None:
             command.extend(["-u", user])
 
@@ -449,10 +1204,94 @@ class SlurmEnvironment(Environment):
             # OSError is raised if the program is not installed
             return None
 
+    @classmethod
+    def _parse_squeue(cls, lines):
+        """Return the list of (comp_name, state, elapsed time) from the lines
+        "<array task id>|<state>|<elapsed time>|<job name>" of `squeue`"""
+        snapshot = []
+        manifests = {}
+        for line in lines:
+            try:
+                task_id, state, elapsed, job_name = line.strip().split("|", 3)
+            except ValueError:
+                continue
+            if not job_name.startswith(cls.__MANIFEST_PREFIX__):
+                snapshot.append((job_name, state, elapsed))
+                continue
+            path = job_name[len(cls.__MANIFEST_PREFIX__):]
+            if path not in manifests:
+                manifests[path] = cls._read_manifest(path)
+            comp_names = manifests[path]
+            if task_id.isdigit() and int(task_id) < len(comp_names):
+                snapshot.append((comp_names[int(task_id)], state, elapsed))
+            else:
+                # Not expanded: all the computations are considered up
+                snapshot.extend((comp_name, state, elapsed)
+                                for comp_name in comp_names)
+        return snapshot
+
+    @classmethod
+    def _read_manifest(cls, path):
+        try:
+            with open(path) as hdl:
+                return hdl.read().splitlines()
+        except (IOError, OSError):
+            return []
+
+    @classmethod
+    def _write_manifest(cls, storage, comp_names, folder=None):
+        """Write the manifest of `comp_names` in `folder` (by default, the
+        mess folder of the `storage`) and return its path"""
+        fname = "{}-{}.manifest".format(comp_names[0], str(epoch()))
+        if folder is None:
+            path = storage.get_messy_path(fname)
+        else:
+            path = os.path.join(folder, fname)
+        with open(path, "w") as hdl:
+            hdl.write("\n".join(comp_names))
+            hdl.write("\n")
+        return path
+
+    @classmethod
+    def clean_mess(cls, storage):
+        """Remove the manifests of the `storage` which no job refers to
+        anymore, together with the payloads of their tasks (those of the
+        tasks which did not run to their end) or the queue of their workers
+        (that of the workers which did not run to their end)"""
+        lines = cls._call_squeue()
+        if lines is None:
+            # The jobs which are over cannot be told apart
+            return
+        alive = set()
+        for line in lines:
+            job_name = line.strip().split("|", 3)[-1]
+            if job_name.startswith(cls.__MANIFEST_PREFIX__):
+                alive.add(job_name[len(cls.__MANIFEST_PREFIX__):])
+        limit = epoch() - cls.__MANIFEST_GRACE__
+        for path in glob.glob(storage.get_messy_path("*.manifest")) + \
+                glob.glob(storage.get_messy_path("queue-*/*.manifest")):
+            try:
+                if path in alive or os.path.getmtime(path) > limit:
+                    continue
+                folder = os.path.dirname(path)
+                if folder != storage.get_messy_path():
+                    shutil.rmtree(folder, ignore_errors=True)
+                    continue
+                payload_prefix = os.path.splitext(path)[0]
+                for payload in glob.glob("{}.*.payload"
+                                         "".format(glob.escape(payload_prefix))):
+                    os.remove(payload)
+                os.remove(path)
+            except OSError:
+                # Removed concurrently
+                pass
+
     def __init__(self, serializer=Serializer(), time="1:00:00", memory=4000,
                  partition=None, n_proc=None, gpu=None,
                  shell_script="#!/bin/bash", fail_fast=True, other_flags=None,
-                 other_options=None):
+                 other_options=None, array=False, max_array_size=1000,
+                 pack=None, pack_parallel=False, workers=None,
+                 submitters=None, submit_retries=3, submit_backoff=1.):
         super(SlurmEnvironment, self).__init__(fail_fast)
         self.serializer = serializer
         self.time = time
@@ -463,12 +1302,25 @@ class SlurmEnvironment(Environment):
         self.gpu = gpu
         self.other_flags = [] if other_flags is None else other_flags
         self.other_options = {} if other_options is None else other_options
+        self.array = array
+        self.max_array_size = max_array_size
+        self.pack = pack
+        self.pack_parallel = pack_parallel
+        self.workers = workers
+        self.submitters = submitters
+        self.submit_retries = submit_retries
+        self.submit_backoff = submit_backoff
 
     def __repr__(self):
         return "{cls}(serializer={serializer}, time={time}, memory={memory}, " \
                "partition={partition}, n_proc={n_proc}, gpu={gpu}," \
                " shell_script={shell}, fail_fast={fail_fast}, " \
-               "other_flags={other_flags}, other_options={other_options})" \
+               "other_flags={other_flags}, other_options={other_options}, " \
+               "array={array}, max_array_size={max_array_size}, " \
+               "pack={pack}, pack_parallel={pack_parallel}, " \
+               "workers={workers}, submitters={submitters}, " \
+               "submit_retries={submit_retries}, " \
+               "submit_backoff={submit_backoff})" \
                "".format(cls=self.__class__.__name__,
                          serializer=repr(self.serializer),
                          time=repr(self.time),
@@ -479,25 +1331,46 @@ class SlurmEnvironment(Environment):
                          shell=self.shell_script,
                          fail_fast=repr(self.fail_fast),
                          other_flags=repr(self.other_flags),
-                         other_options=repr(self.other_options))
-
-    def issue(self, lazy_computation):
-        # Making Slurm command
-        comp_name = lazy_computation.comp_name
-        log_folder = lazy_computation.storage.get_log_folder()
-        log_prefix = os.path.join(log_folder, comp_name)
+                         other_options=repr(self.other_options),
+                         array=repr(self.array),
+                         max_array_size=repr(self.max_array_size),
+                         pack=repr(self.pack),
+                         pack_parallel=repr(self.pack_parallel),
+                         workers=repr(self.workers),
+                         submitters=repr(self.submitters),
+                         submit_retries=repr(self.submit_retries),
+                         submit_backoff=repr(self.submit_backoff))
 
-        env_params = {"time": self.time, "memory": self.memory,
-                      "partition": self.partition, "n_proc": self.n_proc,
-                      "gpu": self.gpu, "other_flags": self.other_flags,
-                      "other_options": self.other_options}
-
-        env_params = self._customize(lazy_computation, env_params)
-
-        slurm_cmd = ["sbatch", "--job-name={}".format(comp_name),
+    def create_session(self, experiment):
+        self.clean_mess(experiment.storage)
+        if self.workers is not None:
+            return QueueSession(self, self.workers).init(len(experiment),
+                                                         experiment.storage)
+        if self.pack is not None:
+            return PackSession(self, self.pack).init(len(experiment),
+                                                     experiment.storage)
+        if not self.array:
+            if self.submitters is not None:
+                return ExecutorSession(self, self.submitters).init(
+                    len(experiment), experiment.storage)
+            return super().create_session(experiment)
+        return ArraySession(self, self.max_array_size).init(len(experiment),
+                                                            experiment.storage)
+
+    def _default_env_params(self):
+        return {"time": self.time, "memory": self.memory,
+                "partition": self.partition, "n_proc": self.n_proc,
+                "gpu": self.gpu, "other_flags": self.other_flags,
+                "other_options": self.other_options}
+
+    def _env_params(self, lazy_computation):
+        return self._customize(lazy_computation, self._default_env_params())
+
+    def _sbatch_command(self, env_params, job_name, output):
+        slurm_cmd = ["sbatch", "--job-name={}".format(job_name),
                      "--time={}".format(env_params["time"]),
                      "--mem={}".format(env_params["memory"]),
-                     "--output={}.%j.txt".format(log_prefix),
+                     "--output={}".format(output),
                      ]
 
         if self.partition is not None:
@@ -513,13 +1386,173 @@ class SlurmEnvironment(Environment):
 
         for flag, value in env_params["other_options"].items():
             slurm_cmd.append("{}={}".format(flag, value))
+        return slurm_cmd
 
-        # Making computation command
+    def _command(self, lazy_computation):
+        """Return the shell command running the computation"""
         cmd_as_tuple = self.serializer.serialize_and_script(lazy_computation)
-        str_cmd = " ".join([escape(s) for s in cmd_as_tuple])
+        return " ".join([escape(s) for s in cmd_as_tuple])
+
+    def issue(self, lazy_computation):
+        # Making Slurm command
+        comp_name = lazy_computation.comp_name
+        log_folder = lazy_computation.storage.get_log_folder()
+        log_prefix = os.path.join(log_folder, comp_name)
+
+        env_params = self._env_params(lazy_computation)
+        slurm_cmd = self._sbatch_command(env_params, comp_name,
+                                         "{}.%j.txt".format(log_prefix))
+
+        # Making computation command
         whole_cmd = "{shell}\n{cmd}".format(shell=self.shell_script,
-                                            cmd=str_cmd)
+                                            cmd=self._command(lazy_computation))
+        self._submit(slurm_cmd, whole_cmd)
+
+    def issue_array(self, lazy_computations, env_params):
+        """
+        Launch the given computations as a single job array
 
+        Parameters
+        ----------
+        lazy_computations: list of lazyfied `Computation`
+            The computations to launch. The ith computation is run by the
+            task of index i
+        env_params: mapping
+            The environment parameters shared by the computations
+        """
+        storage = lazy_computations[0].storage
+        comp_names = [x.comp_name for x in lazy_computations]
+        # The manifest is used by `list_up_jobs` to map the tasks back to
+        # the computations, and by the tasks to find their computation
+        manifest = self._write_manifest(storage, comp_names)
+        # The computations are saved apart so that the size of the script
+        # does not depend on the number of tasks
+        payload_prefix = os.path.splitext(manifest)[0]
+        for i, lazy_computation in enumerate(lazy_computations):
+            self.serializer.save_payload(lazy_computation,
+                                         "{}.{}.payload".format(payload_prefix,
+                                                                i))
+
+        cmd = " ".join([escape(s) for s in self.serializer.payload_script()])
+        log_folder = storage.get_log_folder()
+        lines = [
+            self.shell_script,
+            'CT_COMP_NAME=$(sed -n "$((SLURM_ARRAY_TASK_ID + 1))p" {})'
+            ''.format(escape(manifest)),
+            'exec > {}/"$CT_COMP_NAME"."$SLURM_ARRAY_JOB_ID"_'
+            '"$SLURM_ARRAY_TASK_ID".txt 2>&1'.format(escape(log_folder)),
+            '{} {}."$SLURM_ARRAY_TASK_ID".payload'
+            ''.format(cmd, escape(payload_prefix)),
+            # The payload is not needed anymore (the manifest might still
+            # be, it is removed by `clean_mess`)
+            'CT_STATUS=$?',
+            'rm -f {}."$SLURM_ARRAY_TASK_ID".payload'
+            ''.format(escape(payload_prefix)),
+            'exit $CT_STATUS',
+        ]
+
+        # What happens before the redirection is not lost
+        output = os.path.join(log_folder, "array.%A_%a.txt")
+        slurm_cmd = self._sbatch_command(env_params,
+                                         self.__MANIFEST_PREFIX__ + manifest,
+                                         output)
+        slurm_cmd.append("--array=0-{}".format(len(lazy_computations) - 1))
+        self._submit(slurm_cmd, "\n".join(lines))
+
+    def issue_pack(self, lazy_computations, env_params):
+        """
+        Launch the given computations in a single job
+
+        Parameters
+        ----------
+        lazy_computations: list of lazyfied `Computation`
+            The computations to launch
+        env_params: mapping
+            The environment parameters shared by the computations
+        """
+        storage = lazy_computations[0].storage
+        comp_names = [x.comp_name for x in lazy_computations]
+        manifest = self._write_manifest(storage, comp_names)
+
+        n_lanes = 1
+        if self.pack_parallel and env_params["n_proc"] is not None:
+            n_lanes = max(1, min(int(env_params["n_proc"]),
+                                 len(lazy_computations)))
+        lanes = [[] for _ in range(n_lanes)]
+        for i, lazy_computation in enumerate(lazy_computations):
+            log_prefix = storage.get_log_prefix(lazy_computation.comp_name)
+            lanes[i % n_lanes].append('{cmd} > {log}."$SLURM_JOB_ID".txt 2>&1'
+                                      "".format(cmd=self._command(
+                                                    lazy_computation),
+                                                log=escape(log_prefix)))
+        lines = [self.shell_script]
+        if n_lanes == 1:
+            lines.extend(lanes[0])
+        else:
+            for lane in lanes:
+                lines.append("(")
+                lines.extend("   {}".format(x) for x in lane)
+                lines.append(") &")
+            lines.append("wait")
+
+        log_prefix = storage.get_log_prefix(comp_names[0])
+        slurm_cmd = self._sbatch_command(env_params,
+                                         self.__MANIFEST_PREFIX__ + manifest,
+                                         "{}-pack.%j.txt".format(log_prefix))
+        self._submit(slurm_cmd, "\n".join(lines))
+
+    def start_workers(self, queue, n_workers, storage, comp_names):
+        """
+        Submit `n_workers` jobs running the computations of the `queue`
+
+        The jobs refer to the manifest of the `comp_names` so that the
+        computations are considered up as long as a worker is
+        """
+        # The queue is removed with the manifest (see `clean_mess`)
+        manifest = self._write_manifest(storage, comp_names, queue.folder)
+        log_prefix = storage.get_log_prefix(os.path.basename(queue.folder))
+        slurm_cmd = self._sbatch_command(self._default_env_params(),
+                                         self.__MANIFEST_PREFIX__ + manifest,
+                                         "{}-worker.%j.txt".format(log_prefix))
+        cmd = " ".join([escape(s) for s in Worker(queue.folder).script()])
+        whole_cmd = "{shell}\n{cmd}".format(shell=self.shell_script, cmd=cmd)
+        for i in range(n_workers):
+            try:
+                self._submit(slurm_cmd, whole_cmd)
+            except Exception as exception:
+                if i == 0:
+                    raise
+                # The submitted workers will run all the computations anyway
+                logging.getLogger("clustertools").warning(
+                    "Only {}/{} workers could be submitted. Reason: {}"
+                    "".format(i, n_workers, repr(exception)))
+                return
+
+    @classmethod
+    def _is_transient(cls, error):
+        """Whether the `sbatch` error is worth retrying"""
+        message = str(error.stderr).lower()
+        return any(x in message for x in cls.__TRANSIENT_ERRORS__)
+
+    def _submit(self, slurm_cmd, whole_cmd):
+        logger = logging.getLogger("clustertools")
+        delay = self.submit_backoff
+        for attempt in range(self.submit_retries + 1):
+            try:
+                self._call_sbatch(slurm_cmd, whole_cmd)
+                break
+            except subprocess.CalledProcessError as error:
+                if attempt == self.submit_retries or \
+                        not self._is_transient(error):
+                    raise
+                logger.warning("Submission failed ({}), retrying in {}s"
+                               "".format(error.stderr.strip(), delay))
+                sleep(delay)
+                delay *= 2
+        # The new job is not in the cached snapshot
+        self.invalidate_squeue_cache()
+
+    def _call_sbatch(self, slurm_cmd, whole_cmd):
         logger = logging.getLogger("clustertools")
         logger.debug(slurm_cmd)
         logger.debug(whole_cmd)
@@ -552,4 +1585,5 @@ __CT_ENVIRONMENTS__ = (
     ("slurm", SlurmEnvironment),
     ("insitu", InSituEnvironment),
     ("bash", BashEnvironment),
+    ("pool", PoolEnvironment),
 )  # Note that order matters as it defines preference
\ No newline at end of file
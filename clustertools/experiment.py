@@ -10,21 +10,37 @@ Experiment names should always elligible file names.
 """
 
 import sys
+import copy
 from abc import ABCMeta, abstractmethod
 
 
 import logging
+import threading
 from functools import partial
 
 from clustertools.util import SigHandler
-from .storage import PickleStorage, __PARAMETERS__, __RESULTS__
-from .state import LaunchableState, RunningState, Monitor
+from .storage import PickleStorage, ArrayHandle, __PARAMETERS__, __RESULTS__
+from .state import LaunchableState, RunningState, WorkingState, Monitor
 
 
 __author__ = "Begon Jean-Michel <jm.begon@gmail.com>"
 __copyright__ = "3-clause BSD License"
 
 
+def _copy_mutable(value):
+    """Return a copy of `value` if it is an array or a mutable container
+    (shallow copy), `value` itself otherwise"""
+    if isinstance(value, (list, dict, set, bytearray)):
+        return copy.copy(value)
+    try:
+        import numpy as np
+    except ImportError:
+        return value
+    if isinstance(value, np.ndarray):
+        return value.copy()
+    return value
+
+
 class Result(dict):
     """
     ``Result``
@@ -75,6 +91,28 @@ class Computation(object):
     storage_factory: callable str -> cls:`Storage`
         A factory which takes as input the experiment name and returns
         a cls:`Storage` instance
+    resume: bool (default: False)
+        Whether to resume from the last saved result when relaunched after
+        being partially run (i.e. reset from a partial or incomplete state).
+        In that case, the `result` given to :meth:`run` is preloaded with the
+        last saved result and `self.checkpoint` is the last checkpoint saved
+        with :meth:`save_result` (None if starting from scratch). The
+        checkpoint is removed once the computation completes
+    progress_interval: float (default: 0.)
+        If positive, the progress notified by :meth:`notify_progress` is
+        saved in the background at most every `progress_interval` seconds
+        rather than at each notification. The latest progress is always
+        saved when the computation ends or gets interrupted
+    progress_delta: float (default: 0.)
+        The minimum change of progress since the last saved one for a
+        notification to be worth saving
+    async_save: bool (default: False)
+        If True, :meth:`save_result` only takes a snapshot of the result
+        which is written by a background thread, so that :meth:`run` does not
+        wait for the I/O. Only the latest snapshot waiting to be written is
+        kept. The state (critical/partial) reflects what is actually written.
+        The arrays, lists, dicts, sets and bytearrays of the result and the
+        checkpoint are copied in the snapshot (the containers shallowly)
     """
     __metaclass__ = ABCMeta
 
@@ -83,7 +121,8 @@ class Computation(object):
         return partial(cls, **kwargs)
 
     def __init__(self, exp_name, comp_name, context="n/a",
-                 storage_factory=PickleStorage):
+                 storage_factory=PickleStorage, resume=False,
+                 progress_interval=0., progress_delta=0., async_save=False):
         if storage_factory is None:
             storage_factory = PickleStorage
         if context is None:
@@ -95,36 +134,257 @@ class Computation(object):
         self.current_state = LaunchableState(self.comp_name)
         self.result = None
         self.parameters = {}
+        self.resume = resume
+        self.checkpoint = None
+        self.progress_interval = progress_interval
+        self.progress_delta = progress_delta
+        self.async_save = async_save
+        # The versions of the current state and of the last saved one
+        self._state_version = 0
+        self._published_version = 0
+        self._saved_progress = 0.
+        self._pending_progress = None
+        self._init_threading()
 
     def __repr__(self):
         return "{cls}(exp_name={exp_name}, comp_name={comp_name}, " \
                "context={context}, " \
-               "storage_factory={storage_factory}).lazyfiy(**{parameters})" \
+               "storage_factory={storage_factory}, " \
+               "resume={resume}).lazyfiy(**{parameters})" \
                "".format(cls=self.__class__.__name__,
                          exp_name=repr(self.exp_name),
                          comp_name=repr(self.comp_name),
                          context=repr(self.context),
                          storage_factory=self.storage.__class__.__name__,
+                         resume=repr(self.resume),
                          parameters=repr(self.parameters))
 
     @abstractmethod
     def run(self, result, **parameters):
         pass
 
-    def notify_progress(self, progress):
-        self.current_state = self.storage.update_state(self.current_state.update_progress(progress))
+    # The state is shared with the progress flusher and the result writer
+    # threads. `_lock` only guards the attributes in memory and is never held
+    # during I/O. The state files are written under `_publish_lock`, which
+    # is reentrant so that the interrupt handler can write from the main
+    # thread whatever the main thread was doing
+
+    # Only relevant while running
+    __THREADING_ATTRIBUTES__ = ("_lock", "_publish_lock", "_flusher",
+                                "_writer", "_pending_save", "_writer_error")
+
+    def _init_threading(self):
+        self._lock = threading.RLock()
+        self._publish_lock = threading.RLock()
+        self._flusher = None
+        self._writer = None
+        self._pending_save = None
+        self._writer_error = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in self.__THREADING_ATTRIBUTES__:
+            state.pop(name, None)
+        return state
 
-    def save_result(self, result=None):
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_threading()
+
+    def _update_state(self, transition):
+        """Set the current state to `transition(current_state)` and save
+        it"""
+        with self._lock:
+            self.current_state = transition(self.current_state)
+            self._state_version += 1
+        self._publish_state()
+
+    def _publish_state(self):
+        """Save the current state unless a more recent one already was"""
+        with self._lock:
+            state = self.current_state
+            version = self._state_version
+        with self._publish_lock:
+            if version <= self._published_version:
+                return
+            self.storage.update_state(state)
+            self._published_version = version
+
+    def notify_progress(self, progress):
+        with self._lock:
+            self._pending_progress = progress
+            if self._flusher is not None:
+                # Coalesced: saved by the flusher
+                return
+        self._flush_progress(force=progress >= 1.)
+
+    def _take_progress(self, force=False):
+        """Apply the pending progress to the current state (in memory)
+        unless it is too close to the last saved one (and `force` is False).
+        Return whether the state changed"""
+        with self._lock:
+            progress = self._pending_progress
+            if progress is None:
+                return False
+            self._pending_progress = None
+            if not force and \
+                    abs(progress - self._saved_progress) < self.progress_delta:
+                return False
+            if not isinstance(self.current_state, WorkingState):
+                return False
+            self.current_state = self.current_state.update_progress(progress)
+            self._state_version += 1
+            self._saved_progress = progress
+            return True
+
+    def _flush_progress(self, force=False):
+        """Save the pending progress (see :meth:`_take_progress`)"""
+        if self._take_progress(force):
+            self._publish_state()
+
+    def _start_flusher(self):
+        if self.progress_interval <= 0:
+            return
+        stop = threading.Event()
+
+        def flush():
+            while not stop.wait(self.progress_interval):
+                self._flush_progress()
+
+        thread = threading.Thread(target=flush, daemon=True,
+                                  name="{}-progress".format(self.comp_name))
+        self._flusher = thread, stop
+        thread.start()
+
+    def _stop_flusher(self, wait=True):
+        """Stop the flusher (if any). If `wait`, wait for it to end and save
+        the latest progress. Otherwise, the latest progress is only applied
+        to the current state"""
+        flusher = self._flusher
+        if flusher is not None:
+            thread, stop = flusher
+            stop.set()
+            if wait and thread is not threading.current_thread():
+                thread.join()
+            self._flusher = None
+        if wait:
+            self._flush_progress(force=True)
+        else:
+            self._take_progress(force=True)
+
+    def save_result(self, result=None, checkpoint=None):
+        """
+        Save the (partial) result
+
+        Parameters
+        ----------
+        result: :class:`Result` or None (default: None)
+            The result to save. None for `self.result`
+        checkpoint: object or None (default: None)
+            Whatever is needed to resume the computation from this point (see
+            the `resume` constructor parameter). It is saved together with the
+            result. None to keep the last one
+        """
         if result is not None:
             self.result = result
-
-        self.current_state = self.storage.update_state(self.current_state.to_critical())
-        self.storage.save_result(self.comp_name, self.parameters, self.result,
-                                 self.context)
-        self.current_state = self.storage.update_state(self.current_state.to_partial())
+        if checkpoint is not None:
+            self.checkpoint = checkpoint
+
+        writer = self._writer
+        if writer is None:
+            self._write_result(self.result, self.checkpoint)
+            return
+
+        self._raise_writer_error()
+        # The values modified in place afterwards must not be written
+        snapshot = Result()
+        for name, value in self.result.items():
+            snapshot[name] = _copy_mutable(value)
+        checkpoint = _copy_mutable(self.checkpoint)
+        condition = writer[1]
+        with condition:
+            # Replaces the previous snapshot if not written yet
+            self._pending_save = snapshot, checkpoint
+            condition.notify()
+
+    def _write_result(self, result, checkpoint=None):
+        self._update_state(lambda s: s.to_critical())
+        self.storage.save_result(self.comp_name, self.parameters,
+                                 result, self.context, checkpoint)
+        self._update_state(lambda s: s.to_partial())
+
+    def _start_writer(self):
+        if not self.async_save:
+            return
+        condition = threading.Condition()
+        stop = threading.Event()
+        self._pending_save = None
+        self._writer_error = None
+
+        def write():
+            while True:
+                with condition:
+                    while self._pending_save is None and not stop.is_set():
+                        condition.wait()
+                    if self._pending_save is None:
+                        return
+                    pending, self._pending_save = self._pending_save, None
+                try:
+                    self._write_result(*pending)
+                except Exception as exception:
+                    self._writer_error = exception
+                    return
+
+        thread = threading.Thread(target=write, daemon=True,
+                                  name="{}-writer".format(self.comp_name))
+        self._writer = thread, condition, stop
+        thread.start()
+
+    def _stop_writer(self, reraise=True, wait=True):
+        """Write the pending snapshot (if any) and stop the writer. If not
+        `wait`, the writer is only told to stop"""
+        writer = self._writer
+        if writer is not None:
+            thread, condition, stop = writer
+            stop.set()
+            if wait:
+                with condition:
+                    condition.notify()
+                if thread is not threading.current_thread():
+                    thread.join()
+            self._writer = None
+        if reraise:
+            self._raise_writer_error()
+
+    def _raise_writer_error(self):
+        error = self._writer_error
+        if error is not None:
+            self._writer_error = None
+            raise error
+
+    def _load_last_save(self):
+        """Preload the last saved result and checkpoint, if any"""
+        previous = self.storage.load_result(self.comp_name)
+        if len(previous) == 0:
+            return
+        self.result = Result()
+        for name, value in previous.items():
+            if isinstance(value, ArrayHandle):
+                # The file will be replaced by the next save
+                value = value.load(mmap_mode=None)
+            self.result[name] = value
+        self.result.repr = repr(self)
+        self.checkpoint = self.storage.load_checkpoint(self.comp_name)
+        logging.getLogger("clustertools").info(
+            "Resuming '{}' from its last saved result".format(self.comp_name))
 
     def _interrupt_handler(self, exception):
-        self.storage.update_state(self.current_state.is_not_up())
+        # Runs in the main thread, possibly in the middle of a save. Hence,
+        # it must not wait for the other threads, which might be waiting for
+        # the main thread
+        self._stop_flusher(wait=False)
+        self._stop_writer(reraise=False, wait=False)
+        self._update_state(lambda s: s.is_not_up())
         logging.getLogger("clustertools").warning("Job got interrupted: {}"
                                                   "".format(repr(exception)),
                                                   exc_info=exception)
@@ -133,16 +393,30 @@ class Computation(object):
         actual_parameters = {k: v for k, v in self.parameters.items()}
         actual_parameters.update(parameters)
         with SigHandler(self._interrupt_handler):
-            self.current_state = self.storage.update_state(RunningState(self.comp_name))
+            resuming = self.resume and self.current_state.is_resumable()
+            self._state_version = self._published_version = 0
+            self._update_state(lambda s: RunningState(self.comp_name))
+            self._saved_progress = 0.
+            if self.result is None and resuming:
+                self._load_last_save()
             if self.result is None:
                 self.result = Result(repr=repr(self))
+            self._start_flusher()
+            self._start_writer()
             try:
                 self.run(self.result, **actual_parameters)
                 self.notify_progress(1.)
+                self._stop_flusher()
+                self._stop_writer()
+                # The checkpoint would be stale if the computation were
+                # relaunched
+                self.checkpoint = None
                 self.save_result(self.result)
-                self.current_state = self.storage.update_state(self.current_state.to_completed())
+                self._update_state(lambda s: s.to_completed())
             except Exception as exception:
-                self.storage.update_state(self.current_state.abort(exception))
+                self._stop_flusher()
+                self._stop_writer(reraise=False)
+                self._update_state(lambda s: s.abort(exception))
                 raise
         return self.result
 
@@ -185,28 +459,29 @@ class Experiment(object):
         storage = self.monitor.storage
         storage.init()
         self.storage.save_parameter_set(self.parameter_set)
-        unlaunchable = self.monitor.unlaunchable_comp_names()
 
         storage_factory = self.storage_factory
 
         i = 0
-        for j, param_dict in self.parameter_set:
-            if j < start:
-                continue
+        for j, param_dict in self.parameter_set.iter_from(start):
             if i >= capacity:
                 break
             if auto_refresh:
-                self.monitor.refresh()
-                unlaunchable = self.monitor.unlaunchable_comp_names()
+                # Only the states saved since the last refresh are reloaded
+                self.monitor.refresh(incremental=True)
 
             label = Experiment.name_computation(self.exp_name, j)
-            if label in unlaunchable:
+            if not self.monitor.is_launchable(label):
                 continue
 
             computation = self.comp_factory(exp_name=self.exp_name,
                                             comp_name=label,
                                             context=context,
                                             storage_factory=storage_factory)
+            state = self.monitor.get_state(label)
+            if state is not None:
+                # Tells whether to resume (see `Computation`)
+                computation.current_state = state
 
             yield computation.lazyfy(**param_dict)
 
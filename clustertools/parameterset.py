@@ -1,4 +1,5 @@
 from abc import ABCMeta, abstractmethod
+from bisect import bisect_right
 from itertools import product as cartesian_product
 from collections import defaultdict
 
@@ -6,6 +7,31 @@ from clustertools.storage import PickleStorage
 from .util import sort_per_type
 
 
+def _decode(domains, index):
+    """Return the positions in each of the `domains` of the `index`th
+    tuple of their cartesian product (the last domain varies the fastest)"""
+    positions = [0] * len(domains)
+    for i in range(len(domains) - 1, -1, -1):
+        index, positions[i] = divmod(index, len(domains[i]))
+    return positions
+
+
+def _product_from(domains, positions):
+    """Same as the cartesian product of the `domains` but starting from the
+    tuple at the given `positions`"""
+    if len(domains) == 0:
+        yield ()
+        return
+    last = len(domains) - 1
+    for level in range(last, -1, -1):
+        first = positions[level] + (0 if level == last else 1)
+        pools = [[domains[i][positions[i]]] for i in range(level)]
+        pools.append(domains[level][first:])
+        pools.extend(domains[level + 1:])
+        for param_tuple in cartesian_product(*pools):
+            yield param_tuple
+
+
 class AbstractParameterSet(object, metaclass=ABCMeta):
     """
     `AbstractParameterSet`
@@ -42,6 +68,16 @@ class AbstractParameterSet(object, metaclass=ABCMeta):
         """
         pass
 
+    def iter_from(self, start):
+        """
+        Same as iterating over the set but only yields the parameter tuples
+        whose index is at least `start`. Subclasses should not go through
+        the skipped tuples
+        """
+        for i, param_dict in self:
+            if i >= start:
+                yield i, param_dict
+
     def get_indices_with(self, **kwargs):
         """
         Yields indices of parameter tuples containing the parameter-values given
@@ -67,6 +103,14 @@ class AbstractParameterSet(object, metaclass=ABCMeta):
 
         raise KeyError("Index %d out of range" % index)
 
+    def _get_version(self):
+        """
+        Return an object which changes whenever the parameter tuples of the
+        set do, or None if the set cannot tell (see
+        `ConstrainedParameterSet`)
+        """
+        return None
+
 
 class ExplicitParameterSet(AbstractParameterSet):
     """
@@ -102,8 +146,13 @@ class ExplicitParameterSet(AbstractParameterSet):
             A parameter tuple
         """
         self.queue.append(kwargs)
+        self._version = self._get_version() + 1
         return self
 
+    def _get_version(self):
+        # Old pickles do not have the counter
+        return getattr(self, "_version", 0)
+
     def __len__(self):
         return len(self.queue)
 
@@ -111,6 +160,10 @@ class ExplicitParameterSet(AbstractParameterSet):
         for i, params in enumerate(self.queue):
             yield i, params
 
+    def iter_from(self, start):
+        for i in range(max(start, 0), len(self.queue)):
+            yield i, self.queue[i]
+
 
 class CartesianParameterSet(AbstractParameterSet):
     """
@@ -146,6 +199,7 @@ class CartesianParameterSet(AbstractParameterSet):
         self.parameter_names = set()
         for partial_domain in self.param_map_seq:
             self.parameter_names.update(partial_domain.keys())
+        self._segments_cache = None
         # If Hashability is a problem, we could allow for the choice of the
         # defaultdict type (for list, for instance). It would not garantee
         # against colliding domain values, however
@@ -184,6 +238,7 @@ class CartesianParameterSet(AbstractParameterSet):
                                      % str(param_name))
                 self.parameter_names.add(param_name)
             parameter_mapping[param_name].add(param_singleton)
+        self._invalidate()
         return self
 
     def add_parameters(self, **kwargs):
@@ -230,9 +285,36 @@ class CartesianParameterSet(AbstractParameterSet):
             parameter_mapping[param_name].add(param_singleton)
 
         self.param_map_seq.append(defaultdict(set))
+        self._invalidate()
         return self
 
-    def _iter(self):
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The segments can be recomputed
+        state.pop("_segments_cache", None)
+        return state
+
+    def _segments(self):
+        """
+        Return
+        ------
+        parameter_names: list of str
+            The sorted parameter names
+        segments: list of (int, list of lists)
+            The consecutive blocks of tuples, in order. Each block is a pair
+            (j, domains) where j is the index of the corresponding partial
+            domain (see `param_map_seq`) and where the tuples of the block
+            are the cartesian product of `domains` (in the order of
+            `parameter_names`)
+        offsets: list of int
+            offsets[k] is the index of the first tuple of the kth block.
+            The last element is the total number of tuples
+        """
+        # Old pickles do not have the cache
+        cache = getattr(self, "_segments_cache", None)
+        if cache is not None:
+            return cache
+
         # Note: using list and sorting is necessary for reproducibility reasons
         parameter_names = list(self.parameter_names)
         parameter_names.sort()
@@ -242,9 +324,7 @@ class CartesianParameterSet(AbstractParameterSet):
             ls = list(param_map[name])
             ls = sort_per_type(ls)
             domains.append(ls)
-
-        for param_tuple in cartesian_product(*domains):
-            yield 0, {k: t for k, t in zip(parameter_names, param_tuple)}
+        segments = [(0, [list(x) for x in domains])]
 
         # Invariant: domain is up to date regarding self.param_map_seq[:i]
         # and all the tuples of the domain have been yielded
@@ -260,19 +340,91 @@ class CartesianParameterSet(AbstractParameterSet):
                     # too heavy, even though it is inefficient
 
                     new_values.sort()
-                    dom_tmp = domains[i]  # Store to restore
-                    domains[i] = new_values
-                    for param_tuple in cartesian_product(*domains):
-                        yield j, {k: t for k, t in
-                                  zip(parameter_names, param_tuple)}
-                    # Restore the full domain
-                    dom_tmp.extend(new_values)
-                    domains[i] = dom_tmp
+                    block = [list(x) for x in domains]
+                    block[i] = new_values
+                    segments.append((j, block))
+                    # Enlarge the full domain
+                    domains[i] = domains[i] + new_values
+
+        offsets = [0]
+        for _, block in segments:
+            size = 1
+            for domain in block:
+                size *= len(domain)
+            offsets.append(offsets[-1] + size)
+
+        self._segments_cache = parameter_names, segments, offsets
+        return self._segments_cache
+
+    def _invalidate(self):
+        self._segments_cache = None
+        self._version = self._get_version() + 1
+
+    def _get_version(self):
+        # Old pickles do not have the counter
+        return getattr(self, "_version", 0)
+
+    def _iter(self):
+        parameter_names, segments, _ = self._segments()
+        for j, domains in segments:
+            for param_tuple in cartesian_product(*domains):
+                yield j, {k: t for k, t in zip(parameter_names, param_tuple)}
 
     def __iter__(self):
         for i, (j, param_dict) in enumerate(self._iter()):
             yield i, param_dict
 
+    def __getitem__(self, index):
+        parameter_names, segments, offsets = self._segments()
+        if not 0 <= index < offsets[-1]:
+            raise KeyError("Index %d out of range" % index)
+        k = bisect_right(offsets, index) - 1
+        _, domains = segments[k]
+        # Mixed-radix decoding
+        positions = _decode(domains, index - offsets[k])
+        return {name: domain[position] for name, domain, position
+                in zip(parameter_names, domains, positions)}
+
+    def iter_from(self, start):
+        parameter_names, segments, offsets = self._segments()
+        start = max(start, 0)
+        if start >= offsets[-1]:
+            return
+        k = bisect_right(offsets, start) - 1
+        index = start
+        for (_, domains), offset in zip(segments[k:], offsets[k:]):
+            if index == offset:
+                tuples = cartesian_product(*domains)
+            else:
+                tuples = _product_from(domains,
+                                       _decode(domains, index - offset))
+            for param_tuple in tuples:
+                yield index, {k: t for k, t in zip(parameter_names,
+                                                   param_tuple)}
+                index += 1
+
+    def get_indices_with(self, **kwargs):
+        parameter_names, segments, offsets = self._segments()
+        for name in kwargs.keys():
+            if name not in self.parameter_names:
+                raise KeyError(name)
+        for (_, domains), offset in zip(segments, offsets):
+            # Positions of the admissible values in each domain
+            positions = []
+            for name, domain in zip(parameter_names, domains):
+                if name in kwargs:
+                    positions.append([i for i, v in enumerate(domain)
+                                      if v in kwargs[name]])
+                else:
+                    positions.append(range(len(domain)))
+            # Strides of the mixed-radix representation
+            strides = [1] * len(domains)
+            for i in range(len(domains) - 2, -1, -1):
+                strides[i] = strides[i + 1] * len(domains[i + 1])
+            for position_tuple in cartesian_product(*positions):
+                yield offset + sum(p * s for p, s in zip(position_tuple,
+                                                         strides))
+
 
 class CartesianMixer(AbstractParameterSet):
     def __init__(self, *param_sets):
@@ -291,10 +443,27 @@ class CartesianMixer(AbstractParameterSet):
                 d.update(param_dict)
             yield i, d
 
+    def iter_from(self, start):
+        start = max(start, 0)
+        if start >= len(self):
+            return
+        param_lists = [list(param_set) for param_set in self.param_sets]
+        positions = _decode(param_lists, start)
+        for i, tup in enumerate(_product_from(param_lists, positions), start):
+            d = {}
+            for _, param_dict in tup:
+                d.update(param_dict)
+            yield i, d
+
     def __repr__(self):
         return "{}({})".format(self.__class__.__name__,
                                repr(self.param_sets))
 
+    def _get_version(self):
+        versions = tuple(param_set._get_version()
+                         for param_set in self.param_sets)
+        return None if None in versions else versions
+
 
 class ParameterSet(CartesianParameterSet):
     pass
@@ -306,6 +475,12 @@ class ConstrainedParameterSet(AbstractParameterSet):
     =========================
     A `ConstrainedParameterSet` can skip some of the computation if some
     constraint requirements are not fulfilled
+
+    The constraints are evaluated at most once per parameter tuple: the
+    outcomes are memoized until the underlying set changes or constraints
+    are added. Only iterating over the set and its length are affected by
+    the constraints; the indexing and `get_indices_with` are those of the
+    underlying set.
     """
     def __init__(self, param_set, filters=None):
         if filters is None:
@@ -329,22 +504,67 @@ class ConstrainedParameterSet(AbstractParameterSet):
         for k, v in kwargs.items():
             self.filters[k].append(v)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # The verdicts can be recomputed
+        state.pop("_verdicts", None)
+        state.pop("_signature", None)
+        return state
+
+    def _satisfies(self, param_dict):
+        for constraints in self.filters.values():
+            for constraint in constraints:
+                if not constraint(**param_dict):
+                    return False
+        return True
+
+    def _get_version(self):
+        version = self.param_set._get_version()
+        if version is None:
+            return None
+        return version, sum(len(x) for x in self.filters.values())
+
+    def _get_verdicts(self):
+        """
+        Return the memo of the constraint evaluations: a bytearray whose ith
+        byte is 0 if the ith tuple has not been checked yet, 1 if it
+        satisfies the constraints and 2 otherwise. The memo is reset when
+        the underlying set or the constraints change. If the underlying set
+        cannot tell whether it changed, the memo is not kept.
+        """
+        signature = self._get_version()
+        # Old pickles do not have the memo
+        if signature is None or \
+                getattr(self, "_signature", None) != signature:
+            self._signature = signature
+            self._verdicts = bytearray(len(self.param_set))
+        return self._verdicts
+
+    def _check(self, verdicts, index, param_dict):
+        """Return whether the `index`th tuple, `param_dict`, satisfies the
+        constraints"""
+        if 0 <= index < len(verdicts) and verdicts[index] != 0:
+            return verdicts[index] == 1
+        accepted = self._satisfies(param_dict)
+        if 0 <= index < len(verdicts):
+            verdicts[index] = 1 if accepted else 2
+        return accepted
+
     def __iter__(self):
-        for i, param_dict in self.param_set:
-            yield_it = True
-            for constraints in self.filters.values():
-                for constraint in constraints:
-                    if not constraint(**param_dict):
-                        yield_it = False
-                        break
-            if yield_it:
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        verdicts = self._get_verdicts()
+        for i, param_dict in self.param_set.iter_from(start):
+            if self._check(verdicts, i, param_dict):
                 yield i, param_dict
 
     def __len__(self):
-        n = 0
-        for _ in self:
-            n += 1
-        return n
+        verdicts = self._get_verdicts()
+        if 0 in verdicts:
+            for i, param_dict in self.param_set:
+                self._check(verdicts, i, param_dict)
+        return verdicts.count(1)
 
     def get_indices_with(self, **kwargs):
         for x in self.param_set.get_indices_with(**kwargs):
@@ -375,6 +595,10 @@ class PrioritizedParamSet(AbstractParameterSet):
     from the remaining once, then all those with p1=3 from the remaining ones,
     then all with p2=c from the remaining onces, then all the remaining. The
     intra-ordering is dictated by the decorated.
+
+    If the decorated set is a `CartesianParameterSet`, the tuples are
+    enumerated directly bucket by bucket (one bucket per priority level).
+    Otherwise, the whole set is sorted before yielding the first tuple.
     """
 
     def __init__(self, param_set, priorities=None):
@@ -402,9 +626,53 @@ class PrioritizedParamSet(AbstractParameterSet):
                 priority += 2**(self.n_priorities-p-1)
         return priority
 
+    def _buckets(self):
+        """
+        Return the list of buckets, by decreasing priority, of the
+        underlying `CartesianParameterSet`. A bucket is a mapping
+        param_name -> set of values suitable for `get_indices_with`
+        """
+        parameter_names = self.param_set.parameter_names
+        weights = defaultdict(dict)  # param_name -> {value -> weight}
+        for (param_name, param_value), p in self.priorities.items():
+            if param_name in parameter_names:
+                weights[param_name][param_value] = 2**(self.n_priorities-p-1)
+
+        choices = []
+        for param_name, value_weights in weights.items():
+            domain = set()
+            for param_map in self.param_set.param_map_seq:
+                domain.update(param_map.get(param_name, ()))
+            others = {x for x in domain if x not in value_weights}
+            options = [(param_name, weight, {value})
+                       for value, weight in value_weights.items()]
+            options.append((param_name, 0, others))
+            choices.append(options)
+
+        # The weights are distinct powers of 2: each bucket has its own
+        # priority
+        buckets = []
+        for combination in cartesian_product(*choices):
+            priority = sum(weight for _, weight, _ in combination)
+            buckets.append((priority, {param_name: values for param_name, _,
+                                       values in combination}))
+        buckets.sort(key=lambda t: t[0], reverse=True)
+        return [bucket for _, bucket in buckets]
+
     def __iter__(self):
+        return self.iter_from(0)
+
+    def iter_from(self, start):
+        if isinstance(self.param_set, CartesianParameterSet):
+            # Stream the tuples bucket by bucket
+            for bucket in self._buckets():
+                for i in self.param_set.get_indices_with(**bucket):
+                    if i >= start:
+                        yield i, self.param_set[i]
+            return
+
         prioratized_params = [(self.get_priority(param), i, param)
-                              for i, param in self.param_set]
+                              for i, param in self.param_set if i >= start]
 
         prioratized_params.sort(key=lambda t: t[0], reverse=True)
         for _, i, param_dict in prioratized_params:
@@ -420,6 +688,10 @@ class PrioritizedParamSet(AbstractParameterSet):
     def __getitem__(self, index):
         return self.param_set[index]
 
+    def _get_version(self):
+        # The priorities only change the order
+        return self.param_set._get_version()
+
 
 def build_parameter_set(exp_name, storage_factory=PickleStorage):
     storage = storage_factory(experiment_name=exp_name)
@@ -7,7 +7,7 @@ from abc import ABCMeta, abstractmethod
 from functools import partial
 
 from .environment import SlurmEnvironment, BashEnvironment, Serializer, \
-    InSituEnvironment, FileSerializer, DebugEnvironment
+    InSituEnvironment, FileSerializer, DebugEnvironment, PoolEnvironment
 
 __author__ = "Begon Jean-Michel <jm.begon@gmail.com>"
 __copyright__ = "3-clause BSD License"
@@ -24,6 +24,17 @@ def positive_int(string):
     return rtn
 
 
+def non_negative_int(string):
+    try:
+        rtn = int(string)
+        if rtn < 0:
+            raise TypeError()
+    except:
+        raise TypeError("Expecting non-negative integer, got '{}' instead."
+                        "".format(string))
+    return rtn
+
+
 def time_string(string):
     """Expecting "HH:MM:SS" format"""
     try:
@@ -139,14 +150,25 @@ class AbstractParser(object, metaclass=ABCMeta):
         self.parser.add_argument(*args, **kwargs)
 
 
+def add_workers_argument(parser):
+    parser.add_argument("--workers", "-w", default=None,
+                        type=or_none(positive_int),
+                        help="If set, the number of long-lived workers "
+                             "running the computations one after the other "
+                             "(default: None; for one process per "
+                             "computation)")
+
+
 class BashParser(AbstractParser):
     def __init__(self, parser=None, serializer_factory=Serializer):
         super().__init__(parser)
         self.serializer_factory = serializer_factory
+        add_workers_argument(self)
 
     def create_environment_(self, namespace, other_args):
         environment = BashEnvironment(self.serializer_factory(),
-                                      namespace.no_fail_fast)
+                                      namespace.no_fail_fast,
+                                      workers=namespace.workers)
 
         return environment
 
@@ -179,6 +201,32 @@ class SlurmParser(AbstractParser):
         self.add_argument("--gpu", default=None, type=or_none(int),
                           help="Request GPUs. Do not specify it for no GPU "
                                "(default: None)")
+        self.add_argument("--array", action="store_true", default=False,
+                          help="Submit the computations as job arrays "
+                               "(default: one job per computation)")
+        self.add_argument("--max_array_size", default=1000,
+                          type=positive_int,
+                          help="The maximum number of computations per job "
+                               "array (default: 1000)")
+        self.add_argument("--pack", default=None, type=or_none(positive_int),
+                          help="If set, the number of computations to run "
+                               "in a single job (default: None; for one job "
+                               "per computation)")
+        self.add_argument("--pack_parallel", action="store_true",
+                          default=False,
+                          help="Run n_proc computations of a pack at the "
+                               "same time (default: one after the other)")
+        add_workers_argument(self)
+        self.add_argument("--submitters", default=None,
+                          type=or_none(positive_int),
+                          help="If set, the number of concurrent job "
+                               "submissions (default: None; for one at a "
+                               "time)")
+        self.add_argument("--submit_retries", default=3,
+                          type=non_negative_int,
+                          help="The number of retries of a submission "
+                               "which failed for a transient reason "
+                               "(default: 3; 0 for none)")
 
     def parse_unknown_args(self, unknown):
         args, kwargs = [], {}
@@ -205,7 +253,14 @@ class SlurmParser(AbstractParser):
                                 shell_script=namespace.shell,
                                 fail_fast=namespace.no_fail_fast,
                                 other_flags=flags,
-                                other_options=options)
+                                other_options=options,
+                                array=namespace.array,
+                                max_array_size=namespace.max_array_size,
+                                pack=namespace.pack,
+                                pack_parallel=namespace.pack_parallel,
+                                workers=namespace.workers,
+                                submitters=namespace.submitters,
+                                submit_retries=namespace.submit_retries)
 
 
 class ClusterParser(SlurmParser):
@@ -240,6 +295,27 @@ class InSituParser(AbstractParser):
                                  fail_fast=namespace.no_fail_fast)
 
 
+class PoolParser(AbstractParser):
+    def __init__(self, parser=None, serializer_factory=Serializer):
+        super().__init__(parser)
+        self.serializer_factory = serializer_factory
+        self.add_argument("--n_workers", "-w", default=None,
+                          type=or_none(positive_int),
+                          help="The number of computations to run in "
+                               "parallel (default: None; for the number of "
+                               "CPUs)")
+        self.add_argument("--stdout", action="store_true", default=False,
+                          help="Whether to print the log of the experiment "
+                               "(not of clustertools) directly in the standard "
+                               "output (default: False)")
+
+    def create_environment_(self, namespace, other_args):
+        return PoolEnvironment(n_workers=namespace.n_workers,
+                               serializer=self.serializer_factory(),
+                               stdout=namespace.stdout,
+                               fail_fast=namespace.no_fail_fast)
+
+
 class CTParser(AbstractParser):
     def __init__(self, serializer_factory=FileSerializer,
                  description="Clustertool launcher"):
@@ -284,6 +360,18 @@ class CTParser(AbstractParser):
             create_environment=bash_ct_parser.create_environment
         )
 
+        # Pool
+        pool_parser = subparser.add_parser(
+            "pool",
+            description="This will produce an environment in which the "
+                        "computations will be run in parallel by a pool of "
+                        "worker processes on this machine."
+        )
+        pool_ct_parser = PoolParser(pool_parser)
+        pool_parser.set_defaults(
+            create_environment=pool_ct_parser.create_environment
+        )
+
         # Slurm
         slurm_parser = subparser.add_parser(
             "slurm",
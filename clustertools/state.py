@@ -116,6 +116,11 @@ class State(object):
     def get_name(self):
         pass
 
+    def is_resumable(self):
+        """Whether a computation relaunched from this state is to resume from
+        its last saved result"""
+        return False
+
     def reset(self):
         return LaunchableState.from_(self)
 
@@ -135,6 +140,12 @@ class State(object):
 
 # --------------------------------------------------------------- Waiting states
 class PendingState(State):
+    @classmethod
+    def from_(cls, state):
+        new_state = super().from_(state)
+        new_state.resumable = state.is_resumable()
+        return new_state
+
     def get_name(self):
         return __PENDING__
 
@@ -144,12 +155,27 @@ class PendingState(State):
     def is_not_up(self):
         return LaunchableState.from_(self)
 
+    def is_resumable(self):
+        # Older states do not have the field
+        return getattr(self, "resumable", False)
+
 
 # --------------------------------------------------------------- Stopped states
 class LaunchableState(State):
+    @classmethod
+    def from_(cls, state):
+        new_state = super().from_(state)
+        # Remember whether it was reset from an unfinished computation
+        new_state.resumable = state.is_resumable()
+        return new_state
+
     def get_name(self):
         return __LAUNCHABLE__
 
+    def is_resumable(self):
+        # Older states do not have the field
+        return getattr(self, "resumable", False)
+
     def to_pending(self):
         return PendingState.from_(self)
 
@@ -188,6 +214,9 @@ class IncompleteState(State):
     def get_name(self):
         return __INCOMPLETE__
 
+    def is_resumable(self):
+        return True
+
 
 # --------------------------------------------------------------- Working states
 class WorkingState(State):
@@ -259,6 +288,9 @@ class PartialState(WorkingState):
     def is_not_up(self):
         return IncompleteState.from_(self)
 
+    def is_resumable(self):
+        return True
+
 
 class ManualInterruption(Exception):
     pass
@@ -290,21 +322,80 @@ class Monitor(object):
         self.user = getpass.getuser() if user is None else user
         self.storage = storage_factory(experiment_name=self.exp_name)
         self.environment_cls = get_default_environment(environment_cls)
+        self._clear()
         self.refresh()
 
-    def refresh(self):
-        up_jobs = self.environment_cls.list_up_jobs(self.user)
-        states = self.storage.load_states()
-        if up_jobs is None:
-            self.states = states
-            return
-
+    def _clear(self):
         self.states = []
-        queued = frozenset(up_jobs)
+        self._watermark = None
+        self._stored = {}  # comp_name -> state as saved in the storage
+        self._positions = {}  # comp_name -> index in self.states
+        self._unlaunchable = set()
+        self._live = set()  # comp_names which might not be up any longer
+
+    def refresh(self, incremental=False):
+        """
+        Reload the states of the computations
+
+        Parameters
+        ----------
+        incremental: bool (default: False)
+            Whether to only reload the states saved since the last refresh
+            (if the storage supports it) instead of all of them
+        """
+        up_jobs = self.environment_cls.list_up_jobs(self.user)
+        queued = None if up_jobs is None else frozenset(up_jobs)
+
+        if not incremental or self._watermark is None:
+            self._clear()
+        states, self._watermark = self.storage.load_states_since(
+            self._watermark)
+        comp_names = self._merge(states)
+        if queued is not None:
+            # The states which are not saved again when their job is killed
+            comp_names.update(self._live)
+        for comp_name in comp_names:
+            self._derive(comp_name, queued)
+
+    def _merge(self, states):
+        """Store the given states and return the names of the computations
+        whose state changed. The storage is responsible for ordering the
+        states: the ones it returns supersede the ones it returned before"""
+        changed = set()
         for state in states:
-            if state.comp_name not in queued:
-                state = state.is_not_up()  # The change is not in place
+            if not isinstance(state, State):
+                continue
+            self._stored[state.comp_name] = state
+            changed.add(state.comp_name)
+        return changed
+
+    def _derive(self, comp_name, queued=None):
+        """Update the current state of the given computation from its saved
+        state and the jobs `queued` in the environment (if known)"""
+        stored = self._stored[comp_name]
+        if isinstance(stored, (PendingState, WorkingState)):
+            self._live.add(comp_name)
+        else:
+            self._live.discard(comp_name)
+        state = stored
+        if queued is not None and comp_name not in queued:
+            state = stored.is_not_up()  # The change is not in place
+
+        index = self._positions.get(comp_name)
+        if index is None:
+            self._positions[comp_name] = len(self.states)
             self.states.append(state)
+        else:
+            self.states[index] = state
+        if isinstance(state, LaunchableState):
+            self._unlaunchable.discard(comp_name)
+        else:
+            self._unlaunchable.add(comp_name)
+
+    def _set_states(self, indices, new_states):
+        for index, new_state in zip(indices, new_states):
+            self._stored[new_state.comp_name] = new_state
+            self._derive(new_state.comp_name)
 
     def __repr__(self):
         return "{}(exp_name={}, user={}, storage_factory={}, " \
@@ -347,10 +438,17 @@ class Monitor(object):
 
     def unlaunchable_comp_names(self):
         """Return a set of computation names which are not to be launched"""
-        launchables = self.launchable_computations()
-        return frozenset(
-            self._filter(predicate=lambda s: s.comp_name not in launchables,
-                         extract=lambda i, s: s.comp_name))
+        return frozenset(self._unlaunchable)
+
+    def is_launchable(self, comp_name):
+        """Whether the given computation is to be launched"""
+        return comp_name not in self._unlaunchable
+
+    def get_state(self, comp_name):
+        """Return the current state of the given computation (None if it has
+        no saved state)"""
+        index = self._positions.get(comp_name)
+        return None if index is None else self.states[index]
 
     def partition_by_state(self):
         by_state = defaultdict(list)
@@ -369,11 +467,11 @@ class Monitor(object):
     def to_launchables(self, indices=None):
         if indices is None:
             indices = range(len(self.states))
-        for index in indices:
-            state = self.states[index]
-            new_state = self.storage.update_state(state.reset())
-            # In case of error, do not update locally
-            self.states[index] = new_state
+        indices = list(indices)
+        new_states = self.storage.update_states([self.states[index].reset()
+                                                 for index in indices])
+        # In case of error, do not update locally
+        self._set_states(indices, new_states)
 
     def to_launchable(self, comp_name):
         index = self._indices(predicate=(lambda s: s.comp_name == comp_name))[0]
@@ -394,9 +492,8 @@ class Monitor(object):
     def abort(self, exception=ManualInterruption("Monitor interruption"),
               from_state=State, predicate=lambda x: True):
         indices = self._indices(from_state, predicate)
-        for index in indices:
-            state = self.states[index]
-            new_state = AbortedState.from_(state, exception)
-            self.storage.update_state(new_state)
-            # In case of error, do not update locally
-            self.states[index] = new_state
+        new_states = [AbortedState.from_(self.states[index], exception)
+                      for index in indices]
+        self.storage.update_states(new_states)
+        # In case of error, do not update locally
+        self._set_states(indices, new_states)
@@ -6,12 +6,18 @@ Module :mod:`database` contains helper function for manipulating the databases
 
 import os
 import sys
+import time
 from abc import ABCMeta, abstractmethod
 import glob
 import collections
 from datetime import datetime
 import shutil
 import logging
+import sqlite3
+from contextlib import contextmanager
+from functools import partial
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 try:
     import cPickle as pickle
 except ImportError:
@@ -29,6 +35,7 @@ __EXP_NAME__ = "Experiment"
 __PARAMETERS__ = "Parameters"
 __RESULTS__ = "Results"
 __CONTEXT__ = "Context"
+__CHECKPOINT__ = "Checkpoint"
 
 
 class Architecture(object):
@@ -94,6 +101,84 @@ class Architecture(object):
                            exc_info=error)
 
 
+def _project(r_dict, metrics):
+    """Keep only the given metrics (all of them if None) in the R-dict"""
+    if metrics is None:
+        return r_dict
+    for proxy in r_dict.values():
+        results = proxy[__RESULTS__]
+        proxy[__RESULTS__] = {k: results[k] for k in metrics if k in results}
+    return r_dict
+
+
+class ArrayHandle(object):
+    """
+    ``ArrayHandle``
+    ===============
+    Placeholder for a large array (or bytes) of a result which is stored in
+    its own .npy file rather than with the rest of the result. The array is
+    only read when accessed, through :meth:`load` or `numpy.asarray`
+
+    Constructor parameters
+    ----------------------
+    fname: str
+        The path of the file, relative to the experiment folder
+    shape: tuple of int
+        The shape of the array
+    dtype: str
+        The dtype of the array
+    is_bytes: boolean (default: False)
+        Whether the value was a bytes object (stored as an array of uint8)
+    folder: str or None (default: None)
+        The experiment folder. It is set by the storage on loading
+    """
+    def __init__(self, fname, shape, dtype, is_bytes=False, folder=None):
+        self.fname = fname
+        self.shape = shape
+        self.dtype = dtype
+        self.is_bytes = is_bytes
+        self.folder = folder
+
+    def __repr__(self):
+        return "{cls}(fname={fname}, shape={shape}, dtype={dtype}, " \
+               "is_bytes={is_bytes})" \
+               "".format(cls=self.__class__.__name__,
+                         fname=repr(self.fname),
+                         shape=repr(self.shape),
+                         dtype=repr(self.dtype),
+                         is_bytes=repr(self.is_bytes))
+
+    @property
+    def path(self):
+        return os.path.join(self.folder, self.fname)
+
+    def load(self, mmap_mode="r"):
+        """
+        Load the value
+
+        Parameters
+        ----------
+        mmap_mode: str or None (default: "r")
+            The `numpy.load` memory-map mode. None to read the whole array
+            in memory. Ignored for bytes
+
+        Return
+        ------
+        value: numpy.ndarray (possibly memory-mapped) or bytes
+        """
+        import numpy as np
+        if self.is_bytes:
+            return np.load(self.path).tobytes()
+        return np.load(self.path, mmap_mode=mmap_mode)
+
+    def __array__(self, dtype=None, copy=None):
+        import numpy as np
+        array = self.load()
+        if self.is_bytes:
+            array = np.frombuffer(array, dtype=np.uint8)
+        return array if dtype is None else array.astype(dtype)
+
+
 # ============================== STORAGE MANAGER ============================= #
 
 class Storage(object):
@@ -157,29 +242,62 @@ class Storage(object):
         """Save the given state as current state and returns it"""
         pass
 
+    def update_states(self, states):
+        """Save the given states as current states and returns them. The
+        default implementation saves them one by one, subclasses should
+        save them in a single write"""
+        return [self.update_state(state) for state in states]
+
     @abstractmethod
     def load_states(self):
         """Return a list of state corresponding to self.exp_name"""
         pass
 
+    def load_states_since(self, watermark=None):
+        """Return a pair (states, watermark) where `states` are the states
+        saved since the given `watermark` (all the states if it is None) and
+        `watermark` is to be given to the next call. The states returned
+        supersede the ones returned by the previous calls. The default
+        implementation reloads all the states and returns a None watermark"""
+        return self.load_states(), None
+
     # |---------------------------- Result ---------------------------------> #
     # Results are saved as R-dict, a dictionary where the key correspond to
     # a computation name and the value is another dictionary (the result proxy)
     # whose key-value mapping represent information regarding the results
     # (namely, the experience name, the parameters of the computation, the
-    # context and the actual results)
-    def save_result(self, comp_name, parameters, result, context="n/a"):
+    # context and the actual results). The proxy also holds the checkpoint
+    # of the computation, if any, so that both are written at once
+    def save_result(self, comp_name, parameters, result, context="n/a",
+                    checkpoint=None):
+        """Save the result of the given computation, together with the
+        opaque `checkpoint` needed to resume from it (if not None)"""
         # Create the R-dict (legacy format)
         r_dict = {
             comp_name: {
                 __EXP_NAME__: self.exp_name,
                 __PARAMETERS__: parameters,
                 __CONTEXT__: context,
-                __RESULTS__: dict(result)
+                __RESULTS__: self._externalize(comp_name, dict(result))
             }
         }
+        if checkpoint is not None:
+            r_dict[comp_name][__CHECKPOINT__] = checkpoint
         self._save_r_dict(comp_name, r_dict)
 
+    def _externalize(self, comp_name, results):
+        """Return the metric mapping to store in the R-dict. Storages which
+        keep large values apart replace them by :class:`ArrayHandle`"""
+        return results
+
+    def _bind(self, results):
+        """Bind the :class:`ArrayHandle` of the loaded metrics to this
+        storage"""
+        for value in results.values():
+            if isinstance(value, ArrayHandle):
+                value.folder = self.folder
+        return results
+
     @abstractmethod
     def _save_r_dict(self, comp_name, r_dict):
         """Save the given r_dict singleton corresponding to the given
@@ -193,20 +311,37 @@ class Storage(object):
                 return {}
         except:
             return {}
-        return res[comp_name][__RESULTS__]
+        return self._bind(res[comp_name][__RESULTS__])
 
     @abstractmethod
     def _load_r_dict(self, comp_name):
         """load and return the r_dict singleton of the given computation"""
         pass
 
+    def load_checkpoint(self, comp_name):
+        """Return the checkpoint saved with the last result of the given
+        computation, or None if there is none"""
+        try:
+            return self._load_r_dict(comp_name)[comp_name].get(__CHECKPOINT__)
+        except:
+            return None
+
     @abstractmethod
     def _load_r_dicts(self):
         """load and return the r_dict of all the computations"""
         pass
 
-    def load_params_and_results(self, **default_meta):
+    def _load_projected_r_dicts(self, metrics):
+        """load and return the r_dict of all the computations with only the
+        given metrics (all of them if None). Storages which can avoid
+        reading the other metrics should override it"""
+        return _project(self._load_r_dicts(), metrics)
+
+    def load_params_and_results(self, metrics=None, **default_meta):
         """
+        metrics: iterable of str or None (default: None)
+            The metrics to load (the others are left out). None for all
+            of them
         default_meta: mapping str -> str
             The (potentially) missing metadata
 
@@ -224,8 +359,11 @@ class Storage(object):
         """
         parameters_ls = []
         results_ls = []
-        for result_proxy in self._load_r_dicts().values():
-            results_ls.append(result_proxy[__RESULTS__])
+        if metrics is not None:
+            metrics = list(metrics)
+        r_dicts = self._load_projected_r_dicts(metrics)
+        for result_proxy in r_dicts.values():
+            results_ls.append(self._bind(result_proxy[__RESULTS__]))
             p = result_proxy[__PARAMETERS__]
             for k, v in default_meta.items():
                 if k not in p:
@@ -283,35 +421,178 @@ class Storage(object):
 # ============================== PICKLE MANAGER ============================== #
 class PickleStorage(Storage):
     """Databases are folders. Each record is an individual pickle file.
-    Implements a backup mechanism for results to prevent long writes from
-    being interrupted
+    Results are written to a sibling file which then atomically replaces the
+    previous one, so that an interrupted write never corrupts them
+
+    Constructor parameters
+    ----------------------
+    experiment_name: str
+        The name of the experiment
+    architecture: :class:`Architecture` (default: Architecture())
+        The architecture of the file system
+    n_workers: int (default: 1)
+        The number of workers loading the records concurrently in
+        :meth:`load_states` and :meth:`_load_r_dicts`. With 1, the records
+        are loaded sequentially
+    pool: str (default: "thread")
+        Either "thread" or "process". Threads are suited when loading is
+        dominated by the latency of the (network) filesystem, processes
+        when it is dominated by the unpickling of large records
+    use_index: boolean (default: False)
+        Whether to maintain an on-disk index of the results. The index
+        caches the content of each result file (except its checkpoint) together
+        with its modification time and size in an entry of its own, so that
+        :meth:`_load_r_dicts` only unpickles and indexes the result files
+        which are new or have changed since the last call
+    fsync: str (default: "none")
+        When to flush the results and checkpoints to the disk before
+        considering them written. "none" leaves it to the operating system,
+        "data" flushes the content of the file and "full" also flushes the
+        folder so that the file replacement itself is durable
+    backup: boolean (default: False)
+        Whether to keep the previous generation of each result as a backup
+        (see :meth:`restore_back_up`)
+    array_threshold: int or None (default: None)
+        If not None, the numpy arrays and bytes of at least that many bytes
+        are saved in their own .npy file and replaced in the result by an
+        :class:`ArrayHandle`, so that loading the results does not read them.
+        Object arrays are always kept with the result
     """
+    __FSYNC_POLICIES__ = ("none", "data", "full")
+
+    # Result files modified less than that (in ns) before their index entry
+    # was written might have changed again without their mtime changing
+    __RACY_WINDOW__ = 2 * 10**9
+
+    def __init__(self, experiment_name, architecture=Architecture(),
+                 n_workers=1, pool="thread", use_index=False, fsync="none",
+                 backup=False, array_threshold=None):
+        super(PickleStorage, self).__init__(experiment_name, architecture)
+        if pool not in ("thread", "process"):
+            raise ValueError("Unknown pool '{}'. Expecting 'thread' or "
+                             "'process'.".format(pool))
+        if fsync not in self.__FSYNC_POLICIES__:
+            raise ValueError("Unknown fsync policy '{}'. Expecting one of {}."
+                             "".format(fsync, self.__FSYNC_POLICIES__))
+        self.n_workers = n_workers
+        self.pool = pool
+        self.use_index = use_index
+        self.fsync = fsync
+        self.backup = backup
+        self.array_threshold = array_threshold
+        # comp_name -> name of the last state logged by this instance
+        self._logged = {}
+        # comp_name -> stamp of the states returned by load_states_since
+        self._stamps = None
+        # path -> modification time of the state files and journals as of
+        # the last scan (see load_states_since)
+        self._mtimes = {}
+        self._scanned_at = None
+        # index file name -> (mtime in ns, triplet) of the index entries
+        # read so far (see _load_indexed_r_dicts)
+        self._index_cache = {}
+
+    def __repr__(self):
+        return "{cls}(experiment_name={exp_name}, architecture={architecture}, " \
+               "n_workers={n_workers}, pool={pool}, use_index={use_index}, " \
+               "fsync={fsync}, backup={backup}, " \
+               "array_threshold={array_threshold})" \
+               "".format(cls=self.__class__.__name__,
+                         exp_name=repr(self.exp_name),
+                         architecture=repr(self.architecture),
+                         n_workers=repr(self.n_workers),
+                         pool=repr(self.pool),
+                         use_index=repr(self.use_index),
+                         fsync=repr(self.fsync),
+                         backup=repr(self.backup),
+                         array_threshold=repr(self.array_threshold))
 
     @classmethod
     def _save(cls, stuff, fpath):
         with open(fpath, "wb") as hdl:
             pickle.dump(stuff, hdl, -1)
 
+    def _save_atomically(self, stuff, fpath):
+        """Save `stuff` in a sibling file which then replaces `fpath`, with
+        respect to the fsync policy"""
+        tmp_path = "{}.{}.tmp".format(fpath, os.getpid())
+        with open(tmp_path, "wb") as hdl:
+            pickle.dump(stuff, hdl, -1)
+            if self.fsync != "none":
+                hdl.flush()
+                getattr(os, "fdatasync", os.fsync)(hdl.fileno())
+        os.replace(tmp_path, fpath)
+        if self.fsync == "full":
+            # Make the replacement durable
+            self._fsync_folder(os.path.dirname(fpath))
+
+    @classmethod
+    def _fsync_folder(cls, folder):
+        fd = os.open(folder, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
     @classmethod
     def _raw_load(cls, fpath):
         with open(fpath, "rb") as hdl:
             return pickle.load(hdl)
 
     @classmethod
-    def _load(cls, fpath):
+    def _raw_load_stamped(cls, fpath):
+        with open(fpath, "rb") as hdl:
+            # The files are replaced rather than modified in place
+            return os.fstat(hdl.fileno()).st_mtime_ns, pickle.load(hdl)
+
+    @classmethod
+    def _load(cls, fpath, stamped=False):
         try:
+            if stamped:
+                return cls._raw_load_stamped(fpath)
             rtn = cls._raw_load(fpath)
         except EOFError:
             logger = logging.getLogger("clustertools.storage")
             logger.error("End of file encountered in '{}'".format(fpath))
-            return {}
+            return (None, {}) if stamped else {}
         except Exception as exception:
             logger = logging.getLogger("clustertools.storage")
             logger.exception("Error while loading file '{}'. Reason: {}"
                              "".format(fpath, repr(exception)))
-            return {}
+            return (None, {}) if stamped else {}
         return rtn
 
+    @classmethod
+    def _load_stamped(cls, fpath):
+        """Return the modification time (in ns) of the file and its content
+        ((None, {}) if it cannot be loaded)"""
+        return cls._load(fpath, stamped=True)
+
+    @classmethod
+    def _load_projected(cls, fpath, metrics=None):
+        """Load the R-dict file, dropping the metrics which are not asked
+        for right away"""
+        return _project(cls._load(fpath), metrics)
+
+    def _load_all(self, fpaths, load=None):
+        """Load the given files (with `load`, by default :meth:`_load`),
+        concurrently if several workers are allowed. The order of `fpaths`
+        is preserved"""
+        if load is None:
+            load = self.__class__._load
+        n_workers = min(self.n_workers, len(fpaths))
+        if n_workers <= 1:
+            return [load(fpath) for fpath in fpaths]
+        if self.pool == "process":
+            executor = ProcessPoolExecutor(max_workers=n_workers)
+            # Amortize the inter-process communication
+            chunksize = max(1, len(fpaths) // (4 * n_workers))
+        else:
+            executor = ThreadPoolExecutor(max_workers=n_workers)
+            chunksize = 1
+        with executor:
+            return list(executor.map(load, fpaths, chunksize=chunksize))
+
     @property
     def _parameter_set_path(self):
         return os.path.join(self.folder, "parameter_set.pkl")
@@ -342,30 +623,261 @@ class PickleStorage(Storage):
     def _get_tmp_folder(self):
         return os.path.join(self.folder, "temp")
 
+    def _get_array_folder(self, comp_name):
+        return os.path.join(self.folder, "arrays", comp_name)
+
     # |--------------------------- Notifications ----------------------------> #
 
+    # The states are ordered by the modification times of their files rather
+    # than by their dates, which come from the (possibly skewed) clocks of
+    # the different hosts. A state of a journal is stamped with the
+    # modification time of the journal it was first written in. Individual
+    # state files win ties
+
     def update_state(self, state):
         fpath = os.path.join(self._get_notif_db(), "%s.pkl" % state.comp_name)
-        self._save(state, fpath)
+        tmp_path = "{}.{}.tmp".format(fpath, os.getpid())
+        self._save(state, tmp_path)
+        # Readers never see a partial file and its mtime is that of the state
+        os.replace(tmp_path, fpath)
+        if self._logged.get(state.comp_name) != state.get_name():
+            self._log_changes([("S", state.comp_name)])
+            self._logged[state.comp_name] = state.get_name()
         return state
 
-    def load_states(self):
+    # The changes of state (S: the state file of a computation, J: a
+    # journal) are appended to a change log so that the incremental loading
+    # only reads what changed. The progress updates, which do not change the
+    # state, are not logged. The first line of the log identifies it: the
+    # log is replaced by an empty one once it grows too large
+
+    __MAX_CHANGE_LOG__ = 2**20
+
+    def _get_change_log(self):
+        return os.path.join(self._get_notif_db(), "changes.log")
+
+    def _rotate_changes(self):
+        """Replace the change log by an empty one"""
+        fpath = self._get_change_log()
+        tmp_path = "{}.{}.tmp".format(fpath, os.getpid())
+        with open(tmp_path, "wb") as hdl:
+            hdl.write("#\t{}-{}\n".format(int(time.time() * 1e9),
+                                          os.getpid()).encode("utf-8"))
+        os.replace(tmp_path, fpath)
+
+    def _log_changes(self, records):
+        data = "".join("{}\t{}\n".format(kind, name)
+                       for kind, name in records)
+        try:
+            fd = os.open(self._get_change_log(), os.O_WRONLY | os.O_APPEND)
+        except FileNotFoundError:
+            self._rotate_changes()
+            fd = os.open(self._get_change_log(), os.O_WRONLY | os.O_APPEND)
+        try:
+            # A single write so that concurrent records do not interleave
+            # (on a local file system)
+            os.write(fd, data.encode("utf-8"))
+            size = os.lseek(fd, 0, os.SEEK_CUR)
+        finally:
+            os.close(fd)
+        if size > self.__MAX_CHANGE_LOG__:
+            self._rotate_changes()
+
+    def _change_log_position(self):
+        """Return the watermark (header, offset) of the end of the change
+        log. The header is None if there is no log yet"""
+        try:
+            with open(self._get_change_log(), "rb") as hdl:
+                header = hdl.readline()
+                return header, hdl.seek(0, os.SEEK_END)
+        except FileNotFoundError:
+            return None, 0
+
+    def _read_changes(self, watermark):
+        """Return the records logged since the `watermark` and the watermark
+        of the first record not read yet. The records are None if the log
+        was replaced since then"""
+        header, offset = watermark
+        try:
+            with open(self._get_change_log(), "rb") as hdl:
+                if hdl.readline() != header:
+                    return None, watermark
+                hdl.seek(offset)
+                data = hdl.read()
+        except FileNotFoundError:
+            return (None if header is not None else []), watermark
+        # Only the complete records
+        end = data.rfind(b"\n") + 1
+        records = []
+        for line in data[:end].decode("utf-8", "replace").splitlines():
+            record = line.split("\t", 1)
+            if len(record) == 2:
+                records.append(record)
+        return records, (header, offset + end)
+
+    def _get_journals(self):
+        return sorted(glob.glob(os.path.join(self._get_notif_db(),
+                                             "*.journal")))
+
+    @classmethod
+    def _stamped_entries(cls, journal, mtime):
+        """Return the list of (stamp, state) of the loaded `journal` whose
+        modification time is `mtime`"""
+        return [(mtime if stamp is None else stamp, state)
+                for stamp, state in journal]
+
+    def update_states(self, states):
+        """Save the given states in a single journal file (instead of one
+        file per state). The previous journals are compacted into the new
+        one"""
+        states = list(states)
+        if len(states) == 0:
+            return states
+        journals = self._get_journals()
+        latest = {}
+        for mtime, loaded in self._load_all(journals, self._load_stamped):
+            if isinstance(loaded, list):
+                self._merge_states(latest, self._stamped_entries(loaded, mtime),
+                                   priority=0)
+        for state in states:
+            latest.pop(state.comp_name, None)
+        # The former states keep their stamp, the new ones will get the
+        # modification time of the new journal
+        entries = [(key[0], state) for key, state in latest.values()]
+        entries.extend((None, state) for state in states)
+
+        fpath = os.path.join(self._get_notif_db(), "{:020d}-{}.journal"
+                             "".format(int(time.time() * 1e9), os.getpid()))
+        tmp_path = "{}.tmp".format(fpath)
+        self._save(entries, tmp_path)
+        os.replace(tmp_path, fpath)
+        self._log_changes([("J", os.path.basename(fpath))])
+        for journal in journals:
+            try:
+                os.remove(journal)
+            except OSError:
+                # Already compacted by someone else
+                pass
+        return states
+
+    @classmethod
+    def _merge_states(cls, latest, entries, priority):
+        """Update the mapping comp_name -> ((stamp, priority), state) `latest`
+        with the given (stamp, state) entries, keeping the most recent state
+        of each computation. Return the names of the computations whose
+        state changed"""
         from .state import State
-        res = []
-        for fpath in glob.glob(os.path.join(self._get_notif_db(), "*.pkl")):
-            loaded = self._load(fpath)
+        changed = set()
+        for stamp, state in entries:
+            if not isinstance(state, State):
+                continue
+            key = stamp, priority
+            current = latest.get(state.comp_name)
+            if current is None or current[0] < key:
+                latest[state.comp_name] = key, state
+                changed.add(state.comp_name)
+        return changed
+
+    def _load_stamped_states(self, fpaths, journals):
+        """Load the given state files and journals. Return the mapping
+        comp_name -> ((stamp, priority), state) of the latest states and the
+        list of the loaded objects which are not states"""
+        from .state import State
+        loadeds = self._load_all(fpaths + journals, self._load_stamped)
+        latest = {}
+        others = []
+        for mtime, loaded in loadeds[:len(fpaths)]:
+            if isinstance(loaded, State):
+                self._merge_states(latest, [(mtime, loaded)], priority=1)
+                continue
             try:
-                if isinstance(loaded, State) or len(loaded) > 0:
-                    res.append(loaded)
+                if len(loaded) > 0:
+                    others.append(loaded)
             except (AttributeError, TypeError, ValueError):
                 # If `loaded` has no length (should be a type error)
                 pass
-        return res
+        for mtime, loaded in loadeds[len(fpaths):]:
+            if isinstance(loaded, list):
+                self._merge_states(latest, self._stamped_entries(loaded, mtime),
+                                   priority=0)
+        return latest, others
 
-    # |---------------------------- Results -----------------------------> #
+    def load_states(self):
+        fpaths = glob.glob(os.path.join(self._get_notif_db(), "*.pkl"))
+        latest, others = self._load_stamped_states(fpaths, self._get_journals())
+        return [state for _, state in latest.values()] + others
+
+    # The change log might miss some changes (the progress updates, but also
+    # records lost by a network file system). Hence, the notification folder
+    # is rescanned every so often (in seconds), loading the files whose
+    # modification time changed since the previous scan
+    __RESCAN_INTERVAL__ = 60.
+
+    def load_states_since(self, watermark=None):
+        """The watermark is a position in the change log. Only the state files
+        and journals logged since then are loaded (see also
+        `__RESCAN_INTERVAL__`)"""
+        if watermark is None or self._stamps is None:
+            self._stamps, self._mtimes = {}, {}
+            return self._scan_states()
+        if time.monotonic() - self._scanned_at >= self.__RESCAN_INTERVAL__:
+            return self._scan_states()
+        records, new_watermark = self._read_changes(watermark)
+        if records is None:
+            # The records since the watermark are gone
+            return self._scan_states()
+        notif_db = self._get_notif_db()
+        fpaths, journals = set(), set()
+        for kind, name in records:
+            if kind == "S":
+                fpaths.add(os.path.join(notif_db, "%s.pkl" % name))
+            elif kind == "J":
+                journals.add(os.path.join(notif_db, name))
+        # The compacted journals are part of the subsequent ones
+        return self._newer_states(sorted(fpaths), sorted(journals)), \
+            new_watermark
+
+    def _scan_states(self):
+        """Load the state files and journals modified since the last scan.
+        Return the states which supersede the known ones and the watermark of
+        the change log before the scan"""
+        watermark = self._change_log_position()
+        mtimes = {}
+        try:
+            entries = list(os.scandir(self._get_notif_db()))
+        except FileNotFoundError:
+            entries = []
+        for entry in entries:
+            if entry.name.endswith(".pkl") or entry.name.endswith(".journal"):
+                try:
+                    mtimes[entry.path] = entry.stat().st_mtime_ns
+                except OSError:
+                    # Removed in the meantime (e.g. a compacted journal)
+                    pass
+        changed = sorted(fpath for fpath, mtime in mtimes.items()
+                         if self._mtimes.get(fpath) != mtime)
+        self._mtimes = mtimes
+        self._scanned_at = time.monotonic()
+        fpaths = [fpath for fpath in changed if fpath.endswith(".pkl")]
+        journals = [fpath for fpath in changed if fpath.endswith(".journal")]
+        return self._newer_states(fpaths, journals), watermark
+
+    def _newer_states(self, fpaths, journals):
+        """Load the given state files and journals and return the states
+        which supersede the ones returned so far"""
+        fpaths = [fpath for fpath in fpaths if os.path.exists(fpath)]
+        journals = [journal for journal in journals
+                    if os.path.exists(journal)]
+        latest, _ = self._load_stamped_states(fpaths, journals)
+        states = []
+        for comp_name, (key, state) in latest.items():
+            known = self._stamps.get(comp_name)
+            if known is None or known < key:
+                self._stamps[comp_name] = key
+                states.append(state)
+        return states
 
-    def _tmp_path(self, comp_name):
-        return os.path.join(self._get_tmp_folder(), "%s.pkl" % comp_name)
+    # |---------------------------- Results -----------------------------> #
 
     def _bc_path(self, comp_name):
         return os.path.join(self._get_tmp_folder(), "%s.bc.pkl" % comp_name)
@@ -373,23 +885,104 @@ class PickleStorage(Storage):
     def _result_path(self, comp_name):
         return os.path.join(self._get_result_db(), "%s.pkl" % comp_name)
 
-    def _save_r_dict(self, comp_name, r_dict):
-        # Build paths
-        tmp_path = self._tmp_path(comp_name)
-        bc_path = self._bc_path(comp_name)
+    def _back_up(self, comp_name):
+        """Keep the current result of the computation as its backup"""
         fpath = self._result_path(comp_name)
-        # Write to disk in temp
-        self._save(r_dict, tmp_path)
-        # Back up old results
-        if os.path.exists(fpath):
-            shutil.move(fpath, bc_path)
-        # Place new file at the right place
-        shutil.move(tmp_path, fpath)
+        if not os.path.exists(fpath):
+            return
+        bc_path = self._bc_path(comp_name)
+        tmp_path = "{}.{}.tmp".format(bc_path, os.getpid())
+        try:
+            # The result file is not moved: it is replaced atomically later on
+            os.link(fpath, tmp_path)
+        except OSError:
+            # The file system does not support hard links
+            shutil.copyfile(fpath, tmp_path)
+        os.replace(tmp_path, bc_path)
+
+    def _is_large(self, value):
+        if isinstance(value, (bytes, bytearray)):
+            return len(value) >= self.array_threshold
+        numpy = sys.modules.get("numpy")
+        # No need to import numpy if it is not used by the computation
+        return numpy is not None and isinstance(value, numpy.ndarray) and \
+            value.dtype != object and value.nbytes >= self.array_threshold
+
+    def _save_array(self, array, fpath):
+        import numpy as np
+        with open(fpath, "wb") as hdl:
+            np.save(hdl, array, allow_pickle=False)
+            if self.fsync != "none":
+                hdl.flush()
+                getattr(os, "fdatasync", os.fsync)(hdl.fileno())
+
+    # Each save writes its arrays in new files, so that the result (and its
+    # backup) keeps referencing the previous files until it is replaced. The
+    # files which are no longer referenced are removed afterwards
+
+    def _externalize(self, comp_name, results):
+        if self.array_threshold is None:
+            return results
+        import numpy as np
+        folder = self._get_array_folder(comp_name)
+        version = "{}-{}".format(int(time.time() * 1e9), os.getpid())
+        written = False
+        for name, value in list(results.items()):
+            if not self._is_large(value):
+                continue
+            if not os.path.exists(folder):
+                os.makedirs(folder)
+            is_bytes = not isinstance(value, np.ndarray)
+            if is_bytes:
+                value = np.frombuffer(value, dtype=np.uint8)
+            # The metric name cannot escape the folder
+            fname = "{}.{}.npy".format(quote(str(name), safe="")[:64], version)
+            self._save_array(value, os.path.join(folder, fname))
+            written = True
+            results[name] = ArrayHandle(
+                os.path.relpath(os.path.join(folder, fname), self.folder),
+                value.shape, str(value.dtype), is_bytes, self.folder)
+        if written and self.fsync == "full":
+            self._fsync_folder(folder)
+        return results
+
+    @classmethod
+    def _array_fnames(cls, r_dict):
+        """Return the names of the array files referenced by the R-dict"""
+        fnames = set()
+        for proxy in r_dict.values():
+            for value in proxy.get(__RESULTS__, {}).values():
+                if isinstance(value, ArrayHandle):
+                    fnames.add(os.path.basename(value.fname))
+        return fnames
+
+    def _collect_arrays(self, comp_name, r_dict):
+        """Remove the array files of the computation which are referenced
+        neither by its R-dict nor by its backup"""
+        folder = self._get_array_folder(comp_name)
+        if not os.path.exists(folder):
+            return
+        kept = self._array_fnames(r_dict)
+        bc_path = self._bc_path(comp_name)
+        if self.backup and os.path.exists(bc_path):
+            kept.update(self._array_fnames(self._load(bc_path)))
+        for fname in os.listdir(folder):
+            if fname.endswith(".npy") and fname not in kept:
+                try:
+                    os.remove(os.path.join(folder, fname))
+                except OSError:
+                    pass
+
+    def _save_r_dict(self, comp_name, r_dict):
+        if self.backup:
+            self._back_up(comp_name)
+        self._save_atomically(r_dict, self._result_path(comp_name))
+        self._collect_arrays(comp_name, r_dict)
 
     def restore_back_up(self, comp_name):
         bc_path = self._bc_path(comp_name)
         fpath = self._result_path(comp_name)
-        shutil.move(bc_path, fpath)
+        os.replace(bc_path, fpath)
 
     def _load_r_dict(self, comp_name):
         fpath = self._result_path(comp_name)
@@ -399,8 +992,376 @@ class PickleStorage(Storage):
 
     def _load_r_dicts(self):
         """load and return all the proxy results"""
+        return self._load_projected_r_dicts(None)
+
+    def _load_projected_r_dicts(self, metrics):
+        if self.use_index:
+            # The index holds all the metrics
+            return _project(self._load_indexed_r_dicts(), metrics)
+        r_dict = {}
+        fpaths = glob.glob(os.path.join(self._get_result_db(), "*.pkl"))
+        load = None
+        if metrics is not None:
+            load = partial(self.__class__._load_projected, metrics=metrics)
+        for loaded in self._load_all(fpaths, load):
+            r_dict.update(loaded)
+        return r_dict
+
+    # |------------------------- Result index ---------------------------> #
+    # The index holds one file per computation with the triplet
+    # (mtime in ns, size, r_dict) of its result file, so that only the
+    # entries of new or modified results are (re)written. Entries already
+    # read by this instance are kept in memory and re-read only when their
+    # file changes
+
+    def _get_index_folder(self):
+        return os.path.join(self.folder, "results_index")
+
+    def _read_index_entry(self, entry):
+        """Return the triplet held by the index file `entry` (an
+        :class:`os.DirEntry`) if it can be trusted, None otherwise"""
+        try:
+            mtime_ns = entry.stat().st_mtime_ns
+            cached = self._index_cache.get(entry.name)
+            if cached is None or cached[0] != mtime_ns:
+                with open(entry.path, "rb") as hdl:
+                    cached = mtime_ns, pickle.load(hdl)
+                self._index_cache[entry.name] = cached
+        except Exception:
+            # Removed, or being replaced: the result file is loaded instead
+            self._index_cache.pop(entry.name, None)
+            return None
+        triplet = cached[1]
+        # Result files modified shortly before the entry was written might
+        # have changed again since without their mtime changing
+        if triplet[0] >= mtime_ns - self.__class__.__RACY_WINDOW__:
+            return None
+        return triplet
+
+    def _write_index_entry(self, fname, triplet):
+        fpath = os.path.join(self._get_index_folder(), fname)
+        tmp_path = "{}.{}.tmp".format(fpath, os.getpid())
+        try:
+            self._save(triplet, tmp_path)
+            # Readers see either the former or the new entry, never a
+            # partial one
+            os.replace(tmp_path, fpath)
+        except OSError as exception:
+            logger = logging.getLogger("clustertools.storage")
+            logger.warning("Could not index '{}'. Reason: {}"
+                           "".format(fname, repr(exception)))
+
+    def _load_indexed_r_dicts(self):
+        try:
+            results = list(os.scandir(self._get_result_db()))
+        except FileNotFoundError:
+            return {}
+        index_folder = self._get_index_folder()
+        os.makedirs(index_folder, exist_ok=True)
+        index = {entry.name: entry for entry in os.scandir(index_folder)
+                 if entry.name.endswith(".pkl")}
+
+        r_dict = {}
+        to_load = []
+        for entry in results:
+            if entry.name.startswith(".") or not entry.name.endswith(".pkl"):
+                continue
+            stat = entry.stat()
+            key = stat.st_mtime_ns, stat.st_size
+            triplet = None
+            if entry.name in index:
+                triplet = self._read_index_entry(index.pop(entry.name))
+            if triplet is not None and triplet[:2] == key:
+                r_dict.update(triplet[2])
+            else:
+                to_load.append((entry.name, entry.path, key))
+
+        loaded_ls = self._load_all([fpath for _, fpath, _ in to_load])
+        for (fname, _, key), loaded in zip(to_load, loaded_ls):
+            if len(loaded) == 0:
+                # Unreadable files are not indexed so that they are retried
+                continue
+            r_dict.update(loaded)
+            # Checkpoints are only needed to resume the computation
+            indexed = {comp_name: {k: v for k, v in proxy.items()
+                                   if k != __CHECKPOINT__}
+                       for comp_name, proxy in loaded.items()}
+            self._write_index_entry(fname, key + (indexed,))
+
+        # Drop the entries of the removed results
+        for fname, entry in index.items():
+            self._index_cache.pop(fname, None)
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+        return r_dict
+
+
+
+# ============================== SQLITE MANAGER ============================== #
+class SQLiteStorage(Storage):
+    """
+    ``SQLiteStorage``
+    =================
+    Both databases are tables of a single SQLite file per experiment. States
+    and results are indexed by computation name (states are also indexed by
+    state name), so that loading all the states or all the results of an
+    experiment is a single sequential read instead of one file per
+    computation.
+
+    Constructor parameters
+    ----------------------
+    experiment_name: str
+        The name of the experiment
+    architecture: :class:`Architecture` (default: Architecture())
+        The architecture of the file system
+    journal_mode: str (default: "WAL")
+        The SQLite journal mode of the database. The WAL mode relies on
+        shared memory and should only be used if all the processes accessing
+        the database run on the same host or if the filesystem supports it.
+        Use "DELETE" (the SQLite default) otherwise.
+    timeout: float (default: 60.)
+        The number of seconds to wait for a lock on the database before
+        raising an error
+    """
+
+    __SCHEMA__ = """
+    CREATE TABLE IF NOT EXISTS states (
+        comp_name TEXT PRIMARY KEY,
+        state_name TEXT NOT NULL,
+        state BLOB NOT NULL,
+        stamp INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS states_by_name ON states (state_name);
+    CREATE TABLE IF NOT EXISTS results (
+        comp_name TEXT PRIMARY KEY,
+        exp_name TEXT,
+        parameters BLOB,
+        context BLOB,
+        checkpoint BLOB
+    );
+    CREATE TABLE IF NOT EXISTS metrics (
+        comp_name TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        value BLOB,
+        PRIMARY KEY (comp_name, metric)
+    );
+    CREATE TABLE IF NOT EXISTS parameter_set (
+        id INTEGER PRIMARY KEY CHECK (id = 0),
+        parameter_set BLOB NOT NULL
+    );
+    """
+
+    def __init__(self, experiment_name, architecture=Architecture(),
+                 journal_mode="WAL", timeout=60.):
+        super(SQLiteStorage, self).__init__(experiment_name, architecture)
+        self.journal_mode = journal_mode
+        self.timeout = timeout
+        self._schema_ready = False
+
+    def __repr__(self):
+        return "{cls}(experiment_name={exp_name}, architecture={architecture}, " \
+               "journal_mode={journal_mode}, timeout={timeout})" \
+               "".format(cls=self.__class__.__name__,
+                         exp_name=repr(self.exp_name),
+                         architecture=repr(self.architecture),
+                         journal_mode=repr(self.journal_mode),
+                         timeout=repr(self.timeout))
+
+    @property
+    def _db_path(self):
+        return os.path.join(self.folder, "storage.db")
+
+    @classmethod
+    def _dumps(cls, stuff):
+        return sqlite3.Binary(pickle.dumps(stuff, -1))
+
+    @classmethod
+    def _loads(cls, blob):
+        return pickle.loads(blob)
+
+    @contextmanager
+    def _connect(self, create=True):
+        """Yield a connection to the database within a transaction, or None
+        if `create` is False and the database does not exist yet"""
+        if not create and not os.path.exists(self._db_path):
+            yield None
+            return
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        connection = sqlite3.connect(self._db_path, timeout=self.timeout)
+        try:
+            if not self._schema_ready:
+                connection.execute("PRAGMA journal_mode={}"
+                                   "".format(self.journal_mode))
+                connection.executescript(self.__SCHEMA__)
+                self._migrate(connection)
+                self._schema_ready = True
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @classmethod
+    def _migrate(cls, connection):
+        """Bring the tables of a database created by a previous version up
+        to date"""
+        columns = [row[1] for row in
+                   connection.execute("PRAGMA table_info(states)")]
+        if "stamp" not in columns:
+            connection.execute("ALTER TABLE states ADD COLUMN "
+                               "stamp INTEGER NOT NULL DEFAULT 0")
+        connection.execute("CREATE INDEX IF NOT EXISTS states_by_stamp "
+                           "ON states (stamp)")
+        columns = [row[1] for row in
+                   connection.execute("PRAGMA table_info(results)")]
+        if "checkpoint" not in columns:
+            connection.execute("ALTER TABLE results ADD COLUMN "
+                               "checkpoint BLOB")
+
+    def init(self):
+        super(SQLiteStorage, self).init()
+        with self._connect():
+            pass
+        return self
+
+    def save_parameter_set(self, parameter_set):
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO parameter_set "
+                               "(id, parameter_set) VALUES (0, ?)",
+                               (self._dumps(parameter_set),))
+
+    def load_parameter_set(self):
+        with self._connect(create=False) as connection:
+            row = None
+            if connection is not None:
+                row = connection.execute("SELECT parameter_set FROM "
+                                         "parameter_set WHERE id = 0"
+                                         "").fetchone()
+        if row is None:
+            raise FileNotFoundError("No parameter set in '{}'. Make sure to "
+                                    "run the experiment script at least once "
+                                    "to save the parameters."
+                                    "".format(self._db_path))
+        return self._loads(row[0])
+
+    # |--------------------------- Notifications ----------------------------> #
+
+    # Each write stamps the state with a number greater than all the previous
+    # ones so that the states saved since a given stamp can be selected
+    __INSERT_STATE__ = "INSERT OR REPLACE INTO states " \
+                       "(comp_name, state_name, state, stamp) " \
+                       "VALUES (?, ?, ?, " \
+                       "(SELECT IFNULL(MAX(stamp), 0) + 1 FROM states))"
+
+    def update_state(self, state):
+        with self._connect() as connection:
+            connection.execute(self.__INSERT_STATE__,
+                               (state.comp_name, state.get_name(),
+                                self._dumps(state)))
+        return state
+
+    def update_states(self, states):
+        states = list(states)
+        with self._connect() as connection:
+            connection.executemany(self.__INSERT_STATE__,
+                                   [(state.comp_name, state.get_name(),
+                                     self._dumps(state)) for state in states])
+        return states
+
+    def load_states(self):
+        with self._connect(create=False) as connection:
+            if connection is None:
+                return []
+            rows = connection.execute("SELECT state FROM states").fetchall()
+        return [self._loads(blob) for blob, in rows]
+
+    def load_states_since(self, watermark=None):
+        """The watermark is the greatest stamp read so far"""
+        with self._connect(create=False) as connection:
+            if connection is None:
+                return [], watermark
+            rows = connection.execute("SELECT state, stamp FROM states "
+                                      "WHERE stamp > ?",
+                                      (-1 if watermark is None
+                                       else watermark,)).fetchall()
+        latest = max([stamp for _, stamp in rows],
+                     default=0 if watermark is None else watermark)
+        return [self._loads(blob) for blob, _ in rows], latest
+
+    # |---------------------------- Results -----------------------------> #
+
+    def _save_r_dict(self, comp_name, r_dict):
+        proxy = r_dict[comp_name]
+        metrics = [(comp_name, name, self._dumps(value))
+                   for name, value in proxy[__RESULTS__].items()]
+        checkpoint = proxy.get(__CHECKPOINT__)
+        if checkpoint is not None:
+            checkpoint = self._dumps(checkpoint)
+        with self._connect() as connection:
+            connection.execute("INSERT OR REPLACE INTO results "
+                               "(comp_name, exp_name, parameters, context, "
+                               "checkpoint) VALUES (?, ?, ?, ?, ?)",
+                               (comp_name, proxy[__EXP_NAME__],
+                                self._dumps(proxy[__PARAMETERS__]),
+                                self._dumps(proxy[__CONTEXT__]),
+                                checkpoint))
+            connection.execute("DELETE FROM metrics WHERE comp_name = ?",
+                               (comp_name,))
+            connection.executemany("INSERT INTO metrics "
+                                   "(comp_name, metric, value) "
+                                   "VALUES (?, ?, ?)", metrics)
+
+    def _select_r_dict(self, connection, where="", args=(), metrics=None):
         r_dict = {}
-        for fpath in glob.glob(os.path.join(self._get_result_db(), "*.pkl")):
-            r_dict.update(self._load(fpath))
+        for comp_name, exp_name, parameters, context in connection.execute(
+                "SELECT comp_name, exp_name, parameters, context "
+                "FROM results {}".format(where), args):
+            r_dict[comp_name] = {
+                __EXP_NAME__: exp_name,
+                __PARAMETERS__: self._loads(parameters),
+                __CONTEXT__: self._loads(context),
+                __RESULTS__: {}
+            }
+        if metrics is not None:
+            # Only the requested metrics are read
+            where = "{} {} metric IN ({})".format(
+                where, "AND" if where else "WHERE",
+                ", ".join("?" * len(metrics)))
+            args = tuple(args) + tuple(metrics)
+        for comp_name, metric, value in connection.execute(
+                "SELECT comp_name, metric, value FROM metrics {}"
+                "".format(where), args):
+            proxy = r_dict.get(comp_name)
+            if proxy is not None:
+                proxy[__RESULTS__][metric] = self._loads(value)
         return r_dict
 
+    def _load_r_dict(self, comp_name):
+        with self._connect(create=False) as connection:
+            if connection is None:
+                return {}
+            return self._select_r_dict(connection, "WHERE comp_name = ?",
+                                       (comp_name,))
+
+    def load_checkpoint(self, comp_name):
+        with self._connect(create=False) as connection:
+            row = None
+            if connection is not None:
+                # The metrics are not read
+                row = connection.execute("SELECT checkpoint FROM results "
+                                         "WHERE comp_name = ?",
+                                         (comp_name,)).fetchone()
+        if row is None or row[0] is None:
+            return None
+        return self._loads(row[0])
+
+    def _load_r_dicts(self):
+        return self._load_projected_r_dicts(None)
+
+    def _load_projected_r_dicts(self, metrics):
+        with self._connect(create=False) as connection:
+            if connection is None:
+                return {}
+            return self._select_r_dict(connection, metrics=metrics)
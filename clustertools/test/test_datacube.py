@@ -1,10 +1,15 @@
 # -*- coding: utf-8 -*-
 from unittest import SkipTest
+import os
+import shutil
+import tempfile
+from itertools import product
 
 from nose.tools import assert_dict_equal, assert_not_in, assert_equal, \
     assert_not_equal, assert_in, assert_true, assert_raises
 
-from clustertools.datacube import Datacube, Hasher, build_datacube
+from clustertools.datacube import Datacube, ArrayDatacube, Hasher, \
+    build_datacube
 
 __author__ = "Begon Jean-Michel <jm.begon@gmail.com>"
 __copyright__ = "3-clause BSD License"
@@ -190,13 +195,14 @@ def some_meta():
     return exp_name, metadata, parameters, domain, metrics, res
 
 
-def build_cube(exp_name, res, autopacking=False):
+def build_cube(exp_name, res, autopacking=False, datacube_factory=Datacube):
     parameterss = []
     resultss = []
     for d in res.values():
         parameterss.append(d["Parameters"])
         resultss.append(d["Results"])
-    return Datacube(parameterss, resultss, exp_name, autopacking=autopacking)
+    return datacube_factory(parameterss, resultss, exp_name,
+                            autopacking=autopacking)
 
 
 def test_info():
@@ -598,3 +604,183 @@ def test_autopacking():
     cube2 = cube(x="1")
     assert_equal(cube2("f1"), 15)
 
+
+
+def test_array_cube_same_as_list_cube():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    for builder in (basic, alldiff, some_ood, some_meta):
+        name, metadata, params, dom, metrics, d = builder()
+        cube = build_cube(name, d)
+        a_cube = build_cube(name, d, datacube_factory=ArrayDatacube)
+        assert_dict_equal(a_cube.domain, cube.domain)
+        assert_dict_equal(a_cube.metadata, cube.metadata)
+        assert_equal(a_cube.parameters, cube.parameters)
+        assert_equal(a_cube.metrics, cube.metrics)
+        assert_equal(a_cube.shape, cube.shape)
+        assert_equal(a_cube.data.shape, cube.shape)
+        assert_equal(sorted(a_cube.items()), sorted(cube.items()))
+        assert_equal(a_cube.out_of_domain(), cube.out_of_domain())
+        for index in product(*[range(x) for x in cube.shape]):
+            assert_equal(a_cube[index], cube[index])
+
+
+def test_array_cube_slicing():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    name, metadata, params, dom, metrics, d = alldiff()
+    cube = build_cube(name, d)
+    a_cube = build_cube(name, d, datacube_factory=ArrayDatacube)
+    for index in [(slice(None), 0, Ellipsis), (slice(None), slice(0, 2)),
+                  (slice(None), [0, 2]), (Ellipsis, 0), (1, [2, 0], "f2"),
+                  (slice(None), slice(None), ["f2", 0])]:
+        cube2, a_cube2 = cube[index], a_cube[index]
+        assert_dict_equal(a_cube2.domain, cube2.domain)
+        assert_dict_equal(a_cube2.metadata, cube2.metadata)
+        assert_equal(a_cube2.parameters, cube2.parameters)
+        assert_equal(a_cube2.metrics, cube2.metrics)
+        assert_equal(a_cube2.shape, cube2.shape)
+        assert_equal(a_cube2.data.shape, cube2.shape)
+        assert_equal(list(a_cube2.items()), list(cube2.items()))
+
+    # Basic slicing does not copy the values
+    assert_true(np.shares_memory(a_cube[:, 0:2].data, a_cube.data))
+    assert_equal(a_cube(w="6", x="2", metric="f2"), 62)
+    assert_equal(a_cube(w="6")(x="2")("f2"), 62)
+
+
+def test_array_cube_numpyfy():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    name, metadata, params, dom, metrics, d = alldiff()
+    cube = build_cube(name, d)
+    a_cube = build_cube(name, d, datacube_factory=ArrayDatacube)
+    numpified = a_cube.numpyfy(False)
+    assert_true(np.array_equal(numpified, cube.numpyfy(False)))
+    # The values are already a float array: no copy
+    assert_true(numpified is a_cube.data)
+    assert_true(np.array_equal(a_cube[0, 0].numpyfy(False), [15, 51]))
+    assert_equal(a_cube[..., 0].numpyfy().shape, (2, 3))
+
+    name, metadata, params, dom, metrics, d = some_ood()
+    a_cube = build_cube(name, d, datacube_factory=ArrayDatacube)
+    assert_equal(a_cube[0, 1, 0], None)
+    assert_equal(np.isnan(a_cube.numpyfy()).sum(), 2)
+
+
+def test_array_cube_objects():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    name, metadata, params, dom, metrics, d = some_ood()
+    d["Computation-alldiff-0"]["Results"]["f1"] = "a string"
+    cube = build_cube(name, d)
+    a_cube = build_cube(name, d, datacube_factory=ArrayDatacube)
+    assert_equal(a_cube.data.dtype, object)
+    assert_equal(a_cube[0, 0, 0], "a string")
+    assert_equal(a_cube[0, 1, 0], None)
+    assert_equal(sorted(a_cube.items(), key=str),
+                 sorted(cube.items(), key=str))
+    assert_true(a_cube == build_cube(name, d, datacube_factory=ArrayDatacube))
+
+
+def test_array_cube_reorder():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    name, metadata, params, dom, metrics, d = alldiff()
+    a_cube = build_cube(name, d, datacube_factory=ArrayDatacube)
+    view = a_cube[:, 0:2]
+    a_cube.reorder_parameters("x", "w")
+    assert_equal(a_cube.parameters, ["x", "w"])
+    assert_equal(a_cube.shape, (3, 2, 2))
+    assert_equal(a_cube(x="2", w="6", metric="f1"), 26)
+    assert_equal(a_cube[1, 1, 0], 26)
+    # Views are left untouched
+    assert_equal(view.parameters, ["w", "x"])
+    assert_equal(view[1, 1, 0], 26)
+
+
+def test_array_cube_from_columns():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    name, metadata, params, dom, metrics, d = some_ood()
+    a_cube = build_cube(name, d, datacube_factory=ArrayDatacube)
+    rows = list(d.values())
+    parameters = {p: [r["Parameters"][p] for r in rows]
+                  for p in ["w", "x", "z"]}
+    results = {m: [r["Results"][m] for r in rows] for m in ["f1", "f2"]}
+    assert_true(a_cube == ArrayDatacube.from_columns(parameters, results, name))
+
+    # NumPy columns, with NaN as missing values
+    parameters = {k: np.array(v) for k, v in parameters.items()}
+    results = {k: np.array([np.nan if x is None else x for x in v])
+               for k, v in results.items()}
+    cube = ArrayDatacube.from_columns(parameters, results, name)
+    assert_true(a_cube == cube)
+    assert_dict_equal(cube.domain, dom)
+    assert_dict_equal(cube.metadata, metadata)
+    assert_equal(cube(w="6", x="3", metric="f2"), 63)
+    assert_equal(cube.out_of_domain(), a_cube.out_of_domain())
+
+    assert_raises(ValueError, ArrayDatacube.from_columns, {"w": [1, 2]},
+                  {"f1": [1]})
+    assert_raises(ValueError, ArrayDatacube.from_columns, {}, {},
+                  force=False)
+    assert_equal(ArrayDatacube.from_columns({}, {}).size(), 0)
+
+
+def test_array_cube_save_load():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    folder = tempfile.mkdtemp()
+    try:
+        path = os.path.join(folder, "cube.ctc")
+        name, metadata, params, dom, metrics, d = some_ood()
+        a_cube = build_cube(name, d, datacube_factory=ArrayDatacube)
+        a_cube.save(path)
+
+        for mmap_mode in ("r", None):
+            cube = ArrayDatacube.load(path, mmap_mode=mmap_mode)
+            assert_true(cube == a_cube)
+            assert_equal(cube.shape, a_cube.shape)
+            assert_equal(cube(w="6", x="3", metric="f2"), 63)
+            assert_equal(cube(w="5", x="2", metric="f2"), None)
+            assert_equal(cube.out_of_domain(), a_cube.out_of_domain())
+            assert_true(np.array_equal(cube(x="3").numpyfy(),
+                                       a_cube(x="3").numpyfy()))
+        # Slices remain memory-mapped
+        cube = ArrayDatacube.load(path)
+        assert_true(isinstance(cube[:, 0:2].data, np.memmap))
+        del cube
+
+        # Transposed views are saved in their own order
+        a_cube.reorder_parameters("x")
+        a_cube[:, [1, 0]].save(path)
+        cube = ArrayDatacube.load(path)
+        assert_equal(cube.parameters, ["x", "w"])
+        assert_equal(cube(x="3", w="6", metric="f1"), 36)
+        assert_equal(cube[0, 0, 0], 16)
+        del cube
+
+        d["Computation-alldiff-0"]["Results"]["f1"] = "a string"
+        a_cube = build_cube(name, d, datacube_factory=ArrayDatacube)
+        assert_raises(ValueError, a_cube.save, path)
+
+        with open(path, "wb") as hdl:
+            hdl.write(b"Not a cube")
+        assert_raises(ValueError, ArrayDatacube.load, path)
+    finally:
+        shutil.rmtree(folder)
@@ -1,17 +1,28 @@
 # -*- coding: utf-8 -*-
+import glob
+import os
 import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
 from functools import partial
 
 from nose.tools import assert_equal, assert_in, assert_less, assert_raises, \
     with_setup, assert_true, assert_false
 from nose.tools import assert_is_instance
 from nose.tools import assert_is_none
+from nose.tools import assert_not_in
 
-from clustertools import ParameterSet, Experiment
+from clustertools import ParameterSet, Experiment, Computation
 from clustertools.environment import InSituEnvironment, \
     BashEnvironment, SlurmEnvironment, Serializer, FileSerializer, \
-    DebugEnvironment
+    DebugEnvironment, PoolEnvironment, ComputationQueue, Worker, \
+    DedupSerializer
 from clustertools.storage import PickleStorage
+from clustertools.state import PendingState, CompletedState, PartialState, \
+    Monitor
 
 from .util_test import purge, prep, pickle_prep, pickle_purge, \
     __EXP_NAME__, IntrospectStorage, TestComputation, with_setup_, \
@@ -70,7 +81,7 @@ def test_in_situ_autorefresh():
 
 def test_context_is_str():
     for env_cls in DebugEnvironment, InSituEnvironment, BashEnvironment, \
-                   SlurmEnvironment:
+                   SlurmEnvironment, PoolEnvironment:
         env = env_cls()
         assert_is_instance(env.context(), str)
 
@@ -123,6 +134,39 @@ def test_in_situ_environment():
         in_situ_env(environment)
 
 
+def test_pool_environment():
+    for environment in PoolEnvironment(n_workers=2), \
+                       PoolEnvironment(n_workers=1, stdout=True):
+        in_situ_env(environment)
+
+
+class FailingComputation(Computation):
+    def run(self, result, x1, x2, **ignored):
+        if x1 == 1:
+            raise ValueError("Failing on purpose")
+        result["mult"] = x1 * x2
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_pool_environment_failure():
+    parameter_set = ParameterSet()
+    parameter_set.add_parameters(x1=range(3), x2=range(3))
+    experiment = Experiment(__EXP_NAME__, parameter_set, FailingComputation,
+                            PickleStorage)
+    environment = PoolEnvironment(n_workers=2, fail_fast=False)
+    assert_equal(environment.run(experiment), 3)
+    monitor = Monitor(__EXP_NAME__)
+    assert_equal(len(monitor.aborted_computations()), 3)
+    assert_equal(monitor.count_by_state()["COMPLETED"], 6)
+
+    # Fail fast: nothing is left pending
+    monitor.aborted_to_launchable()
+    environment = PoolEnvironment(n_workers=1)
+    assert_raises(ValueError, partial(environment.run, experiment))
+    monitor.refresh()
+    assert_equal(len(monitor.computation_names(PendingState)), 0)
+
+
 @with_setup_(pickle_prep, pickle_purge)
 def environment_integration(environment):
     # Can only test whether the computation was issued correctly
@@ -141,7 +185,7 @@ def environment_integration(environment):
 
 
 def test_bash_environment():
-    for serializer in FileSerializer(), Serializer():
+    for serializer in FileSerializer(), Serializer(), DedupSerializer():
         environment = BashEnvironment(serializer)
         environment_integration(environment)
 
@@ -153,6 +197,349 @@ def test_slurm_environment():
     # TODO how to test the code is run by slurm/sge ?
 
 
+class RecordingSlurmEnvironment(SlurmEnvironment):
+    """Record the submissions instead of calling sbatch"""
+    @classmethod
+    def is_usable(cls):
+        return True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.submissions = []
+
+    def _submit(self, slurm_cmd, whole_cmd):
+        self.submissions.append((slurm_cmd, whole_cmd))
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_slurm_array():
+    parameter_set = ParameterSet()
+    parameter_set.add_parameters(x1=range(3), x2=range(3))
+    experiment = Experiment(__EXP_NAME__, parameter_set, TestComputation,
+                            PickleStorage)
+    environment = RecordingSlurmEnvironment(array=True, max_array_size=4)
+    environment.add_customization({"x1": 0}, time="2:00:00")
+    assert_equal(environment.run(experiment), 0)
+
+    # x1=0: 3 computations, x1>0: 4 + 2 computations
+    assert_equal(len(environment.submissions), 3)
+    arrays = {}
+    scripts = []
+    for slurm_cmd, script in environment.submissions:
+        array = [x for x in slurm_cmd if x.startswith("--array=")]
+        assert_equal(len(array), 1)
+        job_name = [x for x in slurm_cmd if x.startswith("--job-name=")][0]
+        manifest = job_name[len("--job-name=ct@"):]
+        comp_names = SlurmEnvironment._read_manifest(manifest)
+        arrays[array[0]] = comp_names
+        # The script does not embed the computations
+        assert_equal(len(script.splitlines()), 7)
+        for comp_name in comp_names[1:]:  # The first one names the manifest
+            assert_not_in(comp_name, script)
+        output = [x for x in slurm_cmd if x.startswith("--output=")][0]
+        assert_true(output.endswith("array.%A_%a.txt"))
+        scripts.append((script, comp_names))
+        if "--time=2:00:00" in slurm_cmd:
+            assert_equal(comp_names, [Experiment.name_computation(
+                __EXP_NAME__, i) for i in range(3)])
+
+        # The tasks are mapped back to the computations
+        lines = ["{}|PENDING|0:00|ct@{}".format(i, manifest)
+                 for i in range(len(comp_names))]
+        assert_equal([x for x, _, _ in SlurmEnvironment._parse_squeue(lines)],
+                     comp_names)
+
+    assert_equal(sorted(arrays.keys()), ["--array=0-1", "--array=0-2",
+                                         "--array=0-3"])
+    monitor = experiment.monitor
+    monitor.refresh()
+    assert_equal(len(monitor.computation_names(PendingState)), 9)
+
+    # Running a task as Slurm would
+    script, comp_names = scripts[0]
+    env = dict(os.environ, SLURM_ARRAY_JOB_ID="42", SLURM_ARRAY_TASK_ID="1")
+    subprocess.check_call(["bash", "-c", script], env=env)
+    storage = experiment.storage
+    assert_equal(len(storage.load_result(comp_names[1])), 2)
+    log_files = glob.glob(os.path.join(storage.get_log_folder(), "*.42_*"))
+    assert_equal([os.path.basename(x) for x in log_files],
+                 ["{}.42_1.txt".format(comp_names[1])])
+    # The task removed its payload
+    payloads = glob.glob(storage.get_messy_path("*.payload"))
+    assert_equal(len(payloads), 8)
+
+    # The manifests of the jobs which are over are removed with the
+    # payloads of their remaining tasks
+    manifests = glob.glob(storage.get_messy_path("*.manifest"))
+    assert_equal(len(manifests), 3)
+
+    SqueueSlurmEnvironment.alive = manifests[:1]
+    SqueueSlurmEnvironment().create_session(experiment)
+    assert_equal(glob.glob(storage.get_messy_path("*.manifest")),
+                 manifests[:1])
+    prefix = os.path.splitext(manifests[0])[0]
+    assert_equal(set(glob.glob(storage.get_messy_path("*.payload"))),
+                 {x for x in payloads if x.startswith(prefix + ".")})
+
+
+class SqueueSlurmEnvironment(RecordingSlurmEnvironment):
+    """Only the jobs of the `alive` manifests are in the hands of Slurm"""
+    __MANIFEST_GRACE__ = 0
+    alive = []
+
+    @classmethod
+    def _call_squeue(cls, user=None):
+        return ["0|RUNNING|0:01|ct@{}".format(x) for x in cls.alive] + \
+               ["3|PENDING|0:00|other_job"]
+
+
+class FlakySlurmEnvironment(SlurmEnvironment):
+    """Simulate sbatch: the first submission of each job times out and the
+    computations with x1 == 2 and x2 == 2 are rejected"""
+    @classmethod
+    def is_usable(cls):
+        return True
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.attempted = set()
+        self.submitted = []
+
+    def _call_sbatch(self, slurm_cmd, whole_cmd):
+        job_name = [x for x in slurm_cmd if x.startswith("--job-name=")][0]
+        with self.lock:
+            first = job_name not in self.attempted
+            self.attempted.add(job_name)
+        if first:
+            raise subprocess.CalledProcessError(
+                1, slurm_cmd, stderr="sbatch: error: Socket timed out")
+        if job_name.endswith("-8"):
+            raise subprocess.CalledProcessError(
+                1, slurm_cmd, stderr="sbatch: error: Invalid account")
+        with self.lock:
+            self.submitted.append(job_name[len("--job-name="):])
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_slurm_async_submission():
+    parameter_set = ParameterSet()
+    parameter_set.add_parameters(x1=range(3), x2=range(3))
+    experiment = Experiment(__EXP_NAME__, parameter_set, TestComputation,
+                            PickleStorage)
+    environment = FlakySlurmEnvironment(submitters=4, submit_backoff=0,
+                                        fail_fast=False)
+    assert_equal(environment.run(experiment), 1)
+    assert_equal(len(environment.submitted), 8)
+
+    monitor = experiment.monitor
+    monitor.refresh()
+    assert_equal(len(monitor.computation_names(PendingState)), 8)
+    assert_equal(monitor.aborted_computations(),
+                 {Experiment.name_computation(__EXP_NAME__, 8)})
+
+    # No retry
+    monitor.reset()
+    environment = FlakySlurmEnvironment(submitters=4, submit_retries=0,
+                                        fail_fast=False)
+    assert_less(0, environment.run(experiment))
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_slurm_pack():
+    parameter_set = ParameterSet()
+    parameter_set.add_parameters(x1=range(3), x2=range(3))
+    experiment = Experiment(__EXP_NAME__, parameter_set, TestComputation,
+                            PickleStorage)
+    environment = RecordingSlurmEnvironment(pack=4)
+    assert_equal(environment.run(experiment), 0)
+
+    # 4 + 4 + 1 computations, run one after the other
+    assert_equal(len(environment.submissions), 3)
+    all_comp_names = []
+    for slurm_cmd, script in environment.submissions:
+        assert_equal([x for x in slurm_cmd if x.startswith("--array")], [])
+        job_name = [x for x in slurm_cmd if x.startswith("--job-name=")][0]
+        comp_names = SlurmEnvironment._read_manifest(
+            job_name[len("--job-name=ct@"):])
+        assert_equal(len(script.splitlines()), len(comp_names) + 1)
+        for comp_name in comp_names:
+            assert_in('{}."$SLURM_JOB_ID".txt 2>&1'.format(comp_name), script)
+        all_comp_names.extend(comp_names)
+    assert_equal(all_comp_names, [Experiment.name_computation(__EXP_NAME__, i)
+                                  for i in range(9)])
+    monitor = experiment.monitor
+    monitor.refresh()
+    assert_equal(len(monitor.computation_names(PendingState)), 9)
+
+    # Parallel lanes
+    monitor.reset()
+    environment = RecordingSlurmEnvironment(pack=9, pack_parallel=True,
+                                            n_proc=4)
+    assert_equal(environment.run(experiment), 0)
+    assert_equal(len(environment.submissions), 1)
+    script = environment.submissions[0][1]
+    assert_equal(script.count(") &"), 4)
+    assert_true(script.endswith("wait"))
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_slurm_workers():
+    parameter_set = ParameterSet()
+    parameter_set.add_parameters(x1=range(3), x2=range(3))
+    experiment = Experiment(__EXP_NAME__, parameter_set, TestComputation,
+                            PickleStorage)
+    environment = RecordingSlurmEnvironment(workers=2)
+    assert_equal(environment.run(experiment), 0)
+
+    assert_equal(len(environment.submissions), 2)
+    slurm_cmd, script = environment.submissions[0]
+    job_name = [x for x in slurm_cmd if x.startswith("--job-name=")][0]
+    manifest = job_name[len("--job-name=ct@"):]
+    assert_equal(len(SlurmEnvironment._read_manifest(manifest)), 9)
+    assert_in("Worker", script)
+    monitor = experiment.monitor
+    monitor.refresh()
+    assert_equal(len(monitor.computation_names(PendingState)), 9)
+
+    # The queue is kept as long as the workers are up
+    folder = glob.glob(experiment.storage.get_messy_path("queue-*"))[0]
+    assert_equal(os.path.dirname(manifest), folder)
+    SqueueSlurmEnvironment.alive = [manifest]
+    SqueueSlurmEnvironment().clean_mess(experiment.storage)
+    assert_true(os.path.exists(folder))
+
+    # Play the part of the workers, which remove the queue once it is done
+    assert_equal(Worker(folder)(), 9)
+    assert_false(os.path.exists(folder))
+    monitor.refresh()
+    assert_equal(len(monitor.computation_names(CompletedState)), 9)
+    parameters_ls, result_ls = experiment.storage.load_params_and_results()
+    for parameters, result in zip(parameters_ls, result_ls):
+        assert_equal(parameters["x1"] * parameters["x2"], result["mult"])
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_computation_queue():
+    storage = PickleStorage(__EXP_NAME__).init()
+    queue = ComputationQueue(storage.get_messy_path("queue"))
+    for i in range(3):
+        queue.put(TestComputation(comp_name="comp_{}".format(i)).lazyfy(
+            x1=i, x2=i))
+    assert_equal(len(queue), 3)
+
+    claimed = queue.claim()
+    assert_equal(len(queue), 2)
+    assert_equal(queue.load(claimed).comp_name, "comp_0")
+    # Cannot be claimed twice
+    running = queue.claim()
+    assert_equal(queue.load(running).comp_name, "comp_1")
+    queue.release(claimed)
+    claimed = queue.claim()
+    assert_is_none(queue.claim())
+
+    # The computations of the dead workers are released when collecting
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    os.rename(claimed, "{}.{}-{}".format(claimed.rsplit(".", 1)[0],
+                                         socket.gethostname(), dead.pid))
+    # But not those of the running ones
+    assert_false(queue.collect())
+    assert_equal(os.listdir(queue.folder), [os.path.basename(running)])
+    queue.release(running)
+    assert_true(queue.collect())
+    assert_false(os.path.exists(queue.folder))
+
+    # The queue of the workers which are not up anymore is removed
+    queue = ComputationQueue(storage.get_messy_path("queue-0"))
+    queue.put(TestComputation().lazyfy(x1=1, x2=1))
+    SlurmEnvironment._write_manifest(storage, ["comp"], queue.folder)
+    SqueueSlurmEnvironment.alive = []
+    SqueueSlurmEnvironment.clean_mess(storage)
+    assert_false(os.path.exists(queue.folder))
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_bash_workers():
+    parameter_set = ParameterSet()
+    parameter_set.add_parameters(x1=range(3), x2=range(3))
+    experiment = Experiment(__EXP_NAME__, parameter_set, TestComputation,
+                            PickleStorage)
+    environment = BashEnvironment(workers=2)
+    assert_equal(environment.run(experiment), 0)
+
+    monitor = experiment.monitor
+    for _ in range(300):
+        monitor.refresh()
+        if len(monitor.computation_names(CompletedState)) == 9:
+            break
+        time.sleep(.1)
+    assert_equal(len(monitor.computation_names(CompletedState)), 9)
+    log_files = glob.glob(experiment.storage.get_log_prefix("queue-*"))
+    assert_equal(len(log_files), 2)
+
+
+def test_parse_squeue():
+    lines = ["N/A|RUNNING|1:02|Computation-Exp-1",
+             "N/A|PENDING|0:00|Computation-Exp-2",
+             "3|PENDING|0:00|ct@/does/not/exist"]
+    assert_equal(SlurmEnvironment._parse_squeue(lines),
+                 [("Computation-Exp-1", "RUNNING", "1:02"),
+                  ("Computation-Exp-2", "PENDING", "0:00")])
+
+
+class CountingSlurmEnvironment(SlurmEnvironment):
+    n_calls = 0
+
+    @classmethod
+    def _call_squeue(cls, user=None):
+        cls.n_calls += 1
+        return ["N/A|RUNNING|1:02|Computation-Exp-1",
+                "N/A|PENDING|0:00|Computation-Exp-2"]
+
+
+def test_squeue_cache():
+    user = "ClustertoolsTestUser"
+    env_cls = CountingSlurmEnvironment
+    try:
+        env_cls.invalidate_squeue_cache()
+        for _ in range(5):
+            assert_equal(env_cls.list_up_jobs(user),
+                         ["Computation-Exp-1", "Computation-Exp-2"])
+        assert_equal(env_cls.list_job_states(user),
+                     {"Computation-Exp-1": ("RUNNING", "1:02"),
+                      "Computation-Exp-2": ("PENDING", "0:00")})
+        assert_equal(env_cls.n_calls, 1)
+
+        env_cls.invalidate_squeue_cache()
+        env_cls.list_up_jobs(user)
+        assert_equal(env_cls.n_calls, 2)
+
+        env_cls.squeue_ttl = 0
+        env_cls.list_up_jobs(user)
+        env_cls.list_up_jobs(user)
+        assert_equal(env_cls.n_calls, 4)
+    finally:
+        env_cls.invalidate_squeue_cache()
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_slurm_array_failure():
+    class FailingSlurmEnvironment(RecordingSlurmEnvironment):
+        def _submit(self, slurm_cmd, whole_cmd):
+            raise OSError("sbatch: error")
+
+    parameter_set = ParameterSet()
+    parameter_set.add_parameters(x1=range(3), x2=range(3))
+    experiment = Experiment(__EXP_NAME__, parameter_set, TestComputation,
+                            PickleStorage)
+    environment = FailingSlurmEnvironment(array=True, fail_fast=False)
+    assert_equal(environment.run(experiment), 9)
+    monitor = experiment.monitor
+    monitor.refresh()
+    assert_equal(len(monitor.aborted_computations()), 9)
+
+
 # ------------------------------------------------------------------- Serializer
 @with_setup_(prep, purge)
 def serializer_evaluation(serializer):
@@ -173,6 +560,47 @@ def test_file_serializer():
     serializer_evaluation(FileSerializer())
 
 
+def test_dedup_serializer():
+    serializer_evaluation(DedupSerializer())
+
+
+class CountingDedupSerializer(DedupSerializer):
+    def __init__(self):
+        super().__init__()
+        self.n_stores = 0
+
+    def _store(self, storage, payload):
+        self.n_stores += 1
+        return super()._store(storage, payload)
+
+
+@with_setup(prep, purge)
+def test_dedup_serializer_sharing():
+    serializer = CountingDedupSerializer()
+    storage = TestComputation().storage
+    computations = [TestComputation(comp_name="comp_{}".format(i))
+                    for i in range(5)]
+    computations[0].current_state = PartialState("comp_0").reset()
+    serializeds = [serializer.serialize(computation.lazyfy(x1=i, x2=3))
+                   for i, computation in enumerate(computations)]
+    # The class and the common attributes, which are dumped only once
+    assert_equal(len(glob.glob(storage.get_messy_path("*.blob"))), 2)
+    assert_equal(serializer.n_stores, 2)
+    for i, serialized in enumerate(serializeds):
+        computation = serializer.deserialize(serialized)
+        assert_equal(computation.comp_name, "comp_{}".format(i))
+        assert_equal(computation.current_state.comp_name,
+                     "comp_{}".format(i))
+        assert_equal(computation.current_state.is_resumable(), i == 0)
+        assert_equal(computation().mult, 3 * i)
+
+    # Different attributes are dumped on their own
+    computation = TestComputation(comp_name="comp_5", context="other")
+    serializer.deserialize(serializer.serialize(computation))
+    assert_equal(serializer.n_stores, 3)
+    assert_equal(len(glob.glob(storage.get_messy_path("*.blob"))), 3)
+
+
 # ---------------------------------------------------------------- Customization
 @with_setup(prep, purge)
 def test_customization1():
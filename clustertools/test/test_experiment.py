@@ -1,11 +1,17 @@
 # -*- coding: utf-8 -*-
+import pickle
+import signal
+import subprocess
+import sys
+import threading
+import time
 from functools import partial
 
 from nose.tools import assert_equal, assert_in, assert_less, assert_raises, \
     with_setup, assert_true
 from nose.tools import assert_false
 
-from clustertools import ParameterSet, Result, Experiment
+from clustertools import ParameterSet, Result, Experiment, Computation
 from clustertools.state import RunningState, CompletedState, AbortedState, \
     CriticalState, PartialState, LaunchableState
 from clustertools.storage import PickleStorage
@@ -93,6 +99,299 @@ def test_interrupted_computation():
     assert_true(isinstance(state_history[1], LaunchableState))
 
 
+class CountingComputation(Computation):
+    """Count up to `n`, saving a checkpoint at each step. Fail at `fail_at`
+    unless resuming"""
+    def run(self, result, n, fail_at=None, **ignored):
+        start = 0 if self.checkpoint is None else self.checkpoint + 1
+        for i in range(start, n):
+            if i == fail_at and start == 0:
+                raise ValueError("Preempted")
+            result["steps"] = result.get("steps", []) + [i]
+            self.save_result(checkpoint=i)
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_resume_computation():
+    def create(from_state=None, **kwargs):
+        computation = CountingComputation(__EXP_NAME__, "counting",
+                                          storage_factory=PickleStorage,
+                                          **kwargs)
+        if from_state is not None:
+            # As yielded by the experiment after a reset
+            computation.current_state = from_state.reset()
+        return computation.lazyfy(n=5, fail_at=3)
+
+    assert_raises(ValueError, create(resume=True))
+    storage = PickleStorage(__EXP_NAME__)
+    assert_equal(storage.load_checkpoint("counting"), 2)
+    # Not resuming: starting from scratch
+    assert_raises(ValueError, create())
+    # Neither after an abortion
+    aborted = AbortedState("counting", ValueError("Preempted"))
+    assert_raises(ValueError, create(aborted, resume=True))
+
+    result = create(PartialState("counting"), resume=True)()
+    assert_equal(result["steps"], [0, 1, 2, 3, 4])
+    assert_equal(storage.load_result("counting")["steps"], [0, 1, 2, 3, 4])
+    # The checkpoint is removed once completed
+    assert_equal(storage.load_checkpoint("counting"), None)
+
+    # Rerunning a completed computation starts from scratch
+    completed = CompletedState("counting")
+    assert_raises(ValueError, create(completed, resume=True))
+
+
+class InterruptedPickleStorage(PickleStorage):
+    """Get interrupted while saving the `interrupt_at`-th result"""
+    interrupt_at = None
+    n_saves = 0
+
+    def _save_r_dict(self, comp_name, r_dict):
+        InterruptedPickleStorage.n_saves += 1
+        if InterruptedPickleStorage.n_saves == self.interrupt_at:
+            raise KeyboardInterrupt()
+        super(InterruptedPickleStorage, self)._save_r_dict(comp_name, r_dict)
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_resume_after_interrupted_save():
+    def create():
+        return CountingComputation(__EXP_NAME__, "counting",
+                                   storage_factory=InterruptedPickleStorage,
+                                   resume=True).lazyfy(n=5)
+
+    InterruptedPickleStorage.n_saves = 0
+    InterruptedPickleStorage.interrupt_at = 3
+    computation = create()
+    assert_raises(KeyboardInterrupt, computation)
+    state = computation.current_state
+    assert_true(state.is_resumable())
+    # The result and its checkpoint never diverge
+    storage = PickleStorage(__EXP_NAME__)
+    assert_equal(storage.load_result("counting")["steps"], [0, 1])
+    assert_equal(storage.load_checkpoint("counting"), 1)
+
+    InterruptedPickleStorage.interrupt_at = None
+    computation = create()
+    computation.current_state = state.reset()
+    assert_equal(computation()["steps"], [0, 1, 2, 3, 4])
+
+
+class ArrayCountingComputation(Computation):
+    """Accumulate `n` values in an array. Get interrupted at `stop_at`
+    unless resuming"""
+    def run(self, result, n, stop_at=None, **ignored):
+        import numpy as np
+        start = 0 if self.checkpoint is None else self.checkpoint + 1
+        for i in range(start, n):
+            if i == stop_at and start == 0:
+                raise KeyboardInterrupt()
+            if i == 0:
+                # Not modified afterwards
+                result["first"] = np.full(256, 42.)
+            previous = result.get("values", np.zeros(0))
+            result["values"] = np.concatenate([previous, np.full(256, i)])
+            self.save_result(checkpoint=i)
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_resume_with_array_handles():
+    import numpy as np
+    storage_factory = partial(PickleStorage, array_threshold=1024)
+
+    def create():
+        computation = ArrayCountingComputation(
+            __EXP_NAME__, "array_counting", storage_factory=storage_factory,
+            resume=True)
+        return computation.lazyfy(n=4, stop_at=2)
+
+    computation = create()
+    assert_raises(KeyboardInterrupt, computation)
+    state = computation.current_state.is_not_up()
+    assert_true(state.is_resumable())
+
+    computation = create()
+    computation.current_state = state.reset().to_pending()
+    result = computation()
+    expected = np.repeat(np.arange(4), 256)
+    # Resumed as actual arrays, not as handles to files of the previous run
+    assert_true(isinstance(result["first"], np.ndarray))
+    assert_true(np.array_equal(result["values"], expected))
+    storage = storage_factory(__EXP_NAME__)
+    saved = storage.load_result("array_counting")
+    assert_true(np.array_equal(saved["values"], expected))
+    assert_true(np.array_equal(saved["first"], np.full(256, 42.)))
+
+
+class ProgressingComputation(Computation):
+    def __init__(self, **kwargs):
+        super(ProgressingComputation, self).__init__(
+            __EXP_NAME__, "progressing", storage_factory=IntrospectStorage,
+            **kwargs)
+
+    def run(self, result, n):
+        for i in range(n):
+            self.notify_progress(i / float(n))
+
+
+def _progresses(computation):
+    states = computation.storage.state_history[computation.comp_name]
+    return [s.progress for s in states if isinstance(s, RunningState)]
+
+
+@with_setup(prep, purge)
+def test_coalesced_progress():
+    # Rate limited: only the latest progress is saved
+    computation = ProgressingComputation(progress_interval=60.)
+    computation(n=1000)
+    assert_equal(_progresses(computation), [0., 1.])
+    assert_true(isinstance(computation.current_state, CompletedState))
+
+    # Minimum delta
+    computation = ProgressingComputation(progress_delta=.1)
+    computation(n=1000)
+    progresses = _progresses(computation)
+    assert_less(len(progresses), 15)
+    assert_equal(progresses[-1], 1.)
+    for previous, current in zip(progresses[1:], progresses[2:]):
+        assert_true(current - previous >= .1 or current == 1.)
+
+
+__INTERRUPTED_SAVE__ = """
+import sys
+import time
+from clustertools import Computation
+from clustertools.storage import PickleStorage
+
+class SlowStorage(PickleStorage):
+    def _save_r_dict(self, comp_name, r_dict):
+        print("saving", flush=True)
+        time.sleep(60)
+
+class SlowComputation(Computation):
+    def run(self, result):
+        for i in range(100):
+            self.notify_progress(i / 100.)
+        self.save_result()
+
+SlowComputation(sys.argv[1], "slow", storage_factory=SlowStorage,
+                progress_interval=.01).lazyfy()()
+"""
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_signal_during_save():
+    process = subprocess.Popen([sys.executable, "-c", __INTERRUPTED_SAVE__,
+                                __EXP_NAME__], stdout=subprocess.PIPE)
+    try:
+        assert_equal(process.stdout.readline().strip(), b"saving")
+        time.sleep(.1)  # Let the flusher try to save the progress
+        process.send_signal(signal.SIGTERM)
+        assert_equal(process.wait(timeout=30), -signal.SIGTERM)
+    finally:
+        process.kill()
+        process.stdout.close()
+    states = PickleStorage(__EXP_NAME__).load_states()
+    assert_equal([s.comp_name for s in states], ["slow"])
+    assert_false(isinstance(states[0], (RunningState, CriticalState)))
+
+
+class SavingComputation(Computation):
+    def __init__(self, **kwargs):
+        super(SavingComputation, self).__init__(
+            __EXP_NAME__, "saving", storage_factory=IntrospectStorage,
+            **kwargs)
+
+    def run(self, result, n):
+        result.steps = []
+        for i in range(n):
+            result.steps.append(i)
+            self.save_result()
+
+
+@with_setup(prep, purge)
+def test_async_save():
+    computation = SavingComputation(async_save=True)
+    result = computation(n=50)
+    storage = computation.storage
+    assert_equal(result["steps"], list(range(50)))
+    assert_equal(storage.load_result("saving")["steps"], list(range(50)))
+
+    # Snapshots: each save holds the steps as they were when requested
+    saved = [r_dict["saving"]["Results"]["steps"]
+             for r_dict in storage.result_history["saving"]]
+    assert_true(1 <= len(saved) <= 51)
+    for steps in saved:
+        assert_equal(steps, list(range(len(steps))))
+
+    # Each write is bracketed by critical and partial states
+    states = storage.state_history["saving"]
+    critical = [s for s in states if isinstance(s, CriticalState)]
+    partial = [s for s in states if isinstance(s, PartialState)]
+    assert_equal(len(critical), len(saved))
+    assert_equal(len(partial), len(saved))
+    assert_true(isinstance(states[-1], CompletedState))
+
+
+class BlockingStorage(IntrospectStorage):
+    """Block the result writes until `release` is set"""
+    def __init__(self, experiment_name, **kwargs):
+        super(BlockingStorage, self).__init__(experiment_name, **kwargs)
+        self.saving = threading.Event()
+        self.release = threading.Event()
+
+    def _save_r_dict(self, comp_name, r_dict):
+        self.saving.set()
+        self.release.wait(30)
+        super(BlockingStorage, self)._save_r_dict(comp_name, r_dict)
+
+
+class ProgressWhileSavingComputation(Computation):
+    def run(self, result):
+        import numpy as np
+        result.weights = np.zeros(3)
+        self.save_result()
+        # Not part of the snapshot
+        result.weights[:] = 1
+        assert_true(self.storage.saving.wait(30))
+        for i in range(10):
+            self.notify_progress(i / 10.)
+        # The progress is saved while the result is being written
+        result.progress = self.storage.state_history[self.comp_name][-1]\
+            .progress
+        result.n_saved = len(self.storage.result_history[self.comp_name])
+        self.storage.release.set()
+
+
+@with_setup(prep, purge)
+def test_async_save_does_not_block():
+    import numpy as np
+    computation = ProgressWhileSavingComputation(
+        __EXP_NAME__, "slow", storage_factory=BlockingStorage,
+        async_save=True)
+    result = computation()
+    assert_equal(result["progress"], .9)
+    assert_equal(result["n_saved"], 0)
+    assert_true(isinstance(computation.current_state, CompletedState))
+    saved = [r_dict["slow"]["Results"]["weights"] for r_dict in
+             computation.storage.result_history["slow"]]
+    assert_true(np.array_equal(saved[0], np.zeros(3)))
+    assert_true(np.array_equal(saved[-1], np.ones(3)))
+
+
+@with_setup(prep, purge)
+def test_pickled_computation():
+    computation = TestComputation().lazyfy(x1=2, x2=3)
+    state = computation.__getstate__()
+    assert_false(any(name in state for name in ("_lock", "_publish_lock",
+                                                "_flusher", "_writer")))
+    # The locks are recreated
+    computation = pickle.loads(pickle.dumps(computation))
+    assert_equal(computation()["mult"], 6)
+    assert_true(isinstance(computation.current_state, CompletedState))
+
+
 @with_setup(prep, purge)
 def test_has_parameters():
     computation = TestComputation()
@@ -122,6 +421,22 @@ def test_experiment():
     assert_equal(len(list(experiment.yield_computations(capacity=6))), 6)
 
 
+@with_setup(pickle_prep, pickle_purge)
+def test_yield_resumable_computations():
+    parameter_set = ParameterSet()
+    parameter_set.add_parameters(x1=range(2))
+    experiment = Experiment(__EXP_NAME__, parameter_set, TestComputation)
+    comp_names = [Experiment.name_computation(__EXP_NAME__, i)
+                  for i in range(2)]
+    experiment.storage.update_states([PartialState(comp_names[0]).reset(),
+                                      CompletedState(comp_names[1]).reset()])
+    computations = list(experiment.yield_computations())
+    assert_equal([c.comp_name for c in computations], comp_names)
+    # Only the one which was partially run is to resume
+    assert_true(computations[0].current_state.is_resumable())
+    assert_false(computations[1].current_state.is_resumable())
+
+
 @with_setup_(partial(pickle_prep, exp_name="{}_1".format(__EXP_NAME__)),
              partial(pickle_purge, exp_name="{}_1".format(__EXP_NAME__)))
 def do_auto_refresh(auto_refresh):
@@ -1,3 +1,5 @@
+import itertools
+
 from nose.tools import assert_equal, assert_in, assert_less, assert_raises, \
     with_setup, assert_true
 
@@ -6,7 +8,7 @@ from clustertools import ParameterSet, ConstrainedParameterSet, \
 
 
 # --------------------------------------------------------- ExplicitParameterSet
-from clustertools.parameterset import CartesianMixer
+from clustertools.parameterset import CartesianMixer, AbstractParameterSet
 
 
 def test_explicit_paramset():
@@ -126,6 +128,75 @@ def test_paramset_get_indices_with():
     assert_equal(len(list(ps.get_indices_with(p1={4}))), 0)
 
 
+def test_paramset_arithmetic_indexing():
+    ps = ParameterSet()
+    ps.add_parameters(p1=[1, 2], p2=["a", "b"], p4=[0.1, 0.2, 0.3])
+    ps.add_separator(p3="param")
+    ps.add_parameters(p1=3, p2="c")
+    ps.add_separator()
+    ps.add_parameters(p2=["d", "e"], p4=0.4)
+
+    expected = list(ps)
+    assert_equal(len(expected), len(ps))
+    for i, param_dict in expected:
+        assert_equal(ps[i], param_dict)
+        assert_equal(AbstractParameterSet.__getitem__(ps, i), param_dict)
+    assert_raises(KeyError, ps.__getitem__, len(ps))
+    assert_raises(KeyError, ps.__getitem__, -1)
+
+    for query in ({"p1": {3}}, {"p2": {"a", "e"}, "p4": {0.4, 0.1}},
+                  {"p1": {1, 3}, "p2": {"c"}}, {"p1": {4}}, {}):
+        assert_equal(list(ps.get_indices_with(**query)),
+                     list(AbstractParameterSet.get_indices_with(ps, **query)))
+    assert_raises(KeyError, list, ps.get_indices_with(p5={1}))
+
+    # The cached segments follow the modifications
+    ps.add_parameters(p1=4)
+    assert_equal(len(list(ps)), len(ps))
+    assert_equal(ps[len(ps) - 1]["p1"], 4)
+
+
+def test_paramset_large_getitem():
+    ps = ParameterSet()
+    ps.add_parameters(**{"p{}".format(i): range(10) for i in range(7)})
+    index = 1234567
+    assert_equal(ps[index], {"p{}".format(i): int(d) for i, d in
+                             enumerate(str(index))})
+    indices = ps.get_indices_with(p0={1}, p1={2}, p2={3}, p3={4}, p4={5},
+                                  p5={6})
+    assert_equal(list(indices), list(range(1234560, 1234570)))
+
+
+def test_paramset_iter_from():
+    ps = ParameterSet()
+    ps.add_parameters(p1=[1, 2, 3], p2=["a", "b"])
+    ps.add_separator(p3="param")
+    ps.add_parameters(p1=4)
+    ps.add_parameters(p3="ppp")
+    ps1 = ExplicitParameterSet()
+    ps1.add_parameter_tuple(p4=1)
+    ps1.add_parameter_tuple(p4=2)
+    cps = ConstrainedParameterSet(ps)
+    cps.add_constraints(c=lambda p1, p2, **kw: p1 != 2 or p2 != "a")
+    pps = PrioritizedParamSet(ps)
+    pps.prioritize("p2", "b")
+    param_sets = [ps, ps1, CartesianMixer(ps, ps1), cps, pps]
+    for param_set in param_sets:
+        everything = list(param_set)
+        for start in range(len(param_set) + 2):
+            expected = [(i, p) for i, p in everything if i >= start]
+            assert_equal(list(param_set.iter_from(start)), expected)
+
+
+def test_paramset_large_iter_from():
+    ps = ParameterSet()
+    ps.add_parameters(**{"p{}".format(i): range(10) for i in range(7)})
+    first = list(itertools.islice(ps.iter_from(1234567), 4))
+    assert_equal([i for i, _ in first], list(range(1234567, 1234571)))
+    for i, param_dict in first:
+        assert_equal(param_dict, ps[i])
+
+
 # ---------------------------------------------------------------- Cartesian mix
 def test_cartesianmix():
     ps = ParameterSet()
@@ -177,6 +248,46 @@ def test_constrainparamset():
         assert_in(param_dict, expected)
 
 
+def test_constrainparamset_memo():
+    n_calls = [0]
+
+    def constraint(p1, p2):
+        n_calls[0] += 1
+        return p2 == "a" or p1 % 2 == 0
+
+    ps = ParameterSet()
+    ps.add_parameters(p1=[1, 2, 3], p2=["a", "b"])
+    cps = ConstrainedParameterSet(ps)
+    cps.add_constraints(c1=constraint)
+
+    # The constraint is evaluated once per tuple
+    assert_equal(len(cps), 4)
+    indices = [i for i, _ in cps]
+    assert_equal(len(cps), 4)
+    assert_equal(n_calls[0], 6)
+    assert_equal(indices, [0, 2, 3, 4])
+    assert_equal(n_calls[0], 6)
+    # The indexing is that of the underlying set
+    assert_equal(cps[1], {"p1": 1, "p2": "b"})
+    assert_equal(list(cps.get_indices_with(p2={"b"})), [1, 3, 5])
+
+    # Adding a constraint or changing the set resets the memo
+    cps.add_constraints(c2=lambda p1, p2: p1 < 3)
+    assert_equal(len(cps), 3)
+    ps.add_parameters(p1=0)
+    assert_equal(len(cps), 5)
+
+    # Even if the size of the set does not change
+    ps = ParameterSet()
+    ps.add_parameters(p1=[1, 2, 3, 4])
+    cps = ConstrainedParameterSet(ps)
+    cps.add_constraints(c1=lambda p1, p2=0: p1 + p2 > 2)
+    assert_equal(len(cps), 2)
+    ps.add_parameters(p2=1)
+    assert_equal(len(cps), 3)
+    assert_equal([i for i, _ in cps], [1, 2, 3])
+
+
 # ---------------------------------------------------------- PrioritizedParamSet
 def test_prioritized_paramset():
     ps = ParameterSet()
@@ -209,4 +320,33 @@ def test_prioritized_paramset():
         (9, {"p1": 4, "p2": "a"}),   # 0 = 0 2^0 + 0 2^1 + 0 2^2 + 0 2^ 3
     ]
     result = list(pps)
-    assert_equal(result, expected)
\ No newline at end of file
+    assert_equal(result, expected)
+
+def test_prioritized_paramset_streaming():
+    ps = ParameterSet()
+    ps.add_parameters(p1=[1, 2, 3, 4], p2=["a", "b", "c"], p3=[0, 1])
+    ps.add_separator(p4=True)
+    ps.add_parameters(p1=5, p4=False)
+
+    pps = PrioritizedParamSet(ps)
+    pps.prioritize("p2", "b")
+    pps.prioritize("p1", 2)
+    pps.prioritize("p4", False)
+    pps.prioritize("p1", 5)
+    pps.prioritize("p2", "z")  # Not in the domain
+    pps.prioritize("p5", 1)  # Not a parameter
+
+    # Same as sorting the whole set
+    sorted_params = [(pps.get_priority(param), i, param) for i, param in ps]
+    sorted_params.sort(key=lambda t: t[0], reverse=True)
+    assert_equal(list(pps), [(i, param) for _, i, param in sorted_params])
+    assert_equal(len(list(pps)), len(ps))
+
+    # The first tuples come without going through the whole set
+    ps = ParameterSet()
+    ps.add_parameters(**{"p{}".format(i): range(10) for i in range(8)})
+    pps = PrioritizedParamSet(ps)
+    pps.prioritize("p7", 3)
+    index, param_dict = next(iter(pps))
+    assert_equal(index, 3)
+    assert_equal(param_dict["p7"], 3)
@@ -9,7 +9,7 @@ from clustertools.test.util_test import TestComputation, __EXP_NAME__, prep, \
     purge
 from nose.tools import assert_equal, assert_raises, with_setup
 from nose.tools import assert_is_none
-from nose.tools import assert_true
+from nose.tools import assert_true, assert_false
 
 from clustertools import ParameterSet
 from clustertools.parser import *
@@ -36,6 +36,13 @@ def test_positive_int():
     assert_raises(TypeError, positive_int, "aaa")
 
 
+def test_non_negative_int():
+    assert_equal(0, non_negative_int("0"))
+    assert_equal(5, non_negative_int("5"))
+    assert_raises(TypeError, non_negative_int, "-2")
+    assert_raises(TypeError, non_negative_int, "aaa")
+
+
 def test_time_string():
     assert_equal("1:00:00", time_string("1:00:00"))
     assert_raises(TypeError, time_string, "aaa")
@@ -60,9 +67,11 @@ def test_universal_parser():
 # ============================================================== Bash|BaseParser
 def test_bash_parser_create_env():
     parser = BashParser()
-    namespace = Namespace(capacity=2, no_fail_fast=True, start=0)
+    namespace = Namespace(capacity=2, no_fail_fast=True, start=0,
+                          workers=3)
     env = parser.create_environment(namespace, [])
     assert_true(isinstance(env, BashEnvironment))
+    assert_equal(env.workers, 3)
     assert_equal(get_default(env.run, "capacity"), 2)
     assert_equal(get_default(env.run, "start"), 0)
 
@@ -84,7 +93,10 @@ def test_slurm_parser_create_env():
     parser = SlurmParser()
     namespace = Namespace(capacity=22, no_fail_fast=True, start=10,
                           time="24:00:00", memory="4000", shell="#!bin/bash",
-                          partition=None, n_proc=None, gpu=None)
+                          partition=None, n_proc=None, gpu=None,
+                          array=True, max_array_size=500, pack=None,
+                          pack_parallel=False, workers=None,
+                          submitters=8, submit_retries=5)
     env = parser.create_environment(namespace, ["--other-flag",
                                                 "--other-option=opt-value"])
     assert_true(isinstance(env, SlurmEnvironment))
@@ -93,10 +105,20 @@ def test_slurm_parser_create_env():
     assert_is_none(env.partition)
     assert_is_none(env.n_proc)
     assert_is_none(env.gpu)
+    assert_true(env.array)
+    assert_equal(env.max_array_size, 500)
+    assert_is_none(env.pack)
+    assert_is_none(env.workers)
+    assert_equal(env.submitters, 8)
+    assert_equal(env.submit_retries, 5)
 
     assert_equal(env.other_flags, ["--other-flag"])
     assert_equal(env.other_options, {"--other-option": "opt-value"})
 
+    # Submissions can be made without retry
+    no_retry_env, _ = SlurmParser().parse(["--submit_retries", "0"])
+    assert_equal(no_retry_env.submit_retries, 0)
+
     assert_equal(get_default(env.run, "capacity"), 22)
     assert_equal(get_default(env.run, "start"), 10)
 
@@ -131,6 +153,8 @@ def test_cluster_parser():
                                       "--memory", "7231",
                                       "--partition", "luke",
                                       "--n_proc", "5",
+                                      "--pack", "20",
+                                      "--pack_parallel",
                                       "custom1_value",
                                       "custom2_value",
                                       "--other-flag",
@@ -141,6 +165,8 @@ def test_cluster_parser():
     assert_equal(environment.memory, "7231")
     assert_equal(environment.partition, "luke")
     assert_equal(environment.n_proc, 5)
+    assert_equal(environment.pack, 20)
+    assert_true(environment.pack_parallel)
     assert_equal(environment.fail_fast, True)
     assert_equal(environment.other_flags, ["--other-flag"])
     assert_equal(environment.other_options, {"--other-option": "opt-value"})
@@ -256,6 +282,19 @@ def test_ct_parser_insitu():
     assert_equal(get_default(env.run, "start"), 0)
 
 
+def test_ct_parser_pool():
+    parser = CTParser()
+    env, args = parser.parse(["pool", "--n_workers", "3", "--capacity", "2"])
+
+    assert_true(isinstance(env, PoolEnvironment))
+    assert_equal(env.n_workers, 3)
+    assert_false(env.stdout)
+    assert_true(isinstance(env.serializer, Serializer))
+
+    assert_equal(get_default(env.run, "capacity"), 2)
+    assert_equal(get_default(env.run, "start"), 0)
+
+
 def test_ct_parser_bash():
     parser = CTParser()
     parser.add_argument("custom1")
@@ -268,6 +307,7 @@ def test_ct_parser_bash():
     assert_equal(args.custom1, "custom1_value")
     assert_equal(args.custom2, "custom2_value")
     assert_equal(environment.fail_fast, False)
+    assert_is_none(environment.workers)
 
 
 def test_ct_parser_slurm():
@@ -1,4 +1,7 @@
 # -*- coding: utf-8 -*-
+import time
+from datetime import timedelta
+
 from nose.tools import assert_in, assert_not_in
 from nose.tools import assert_equal
 from nose.tools import with_setup
@@ -25,6 +28,18 @@ def test_reset_state():
                      IncompleteState, CriticalState, PartialState:
         state = state_cls("test_comp")
         assert_true(isinstance(state.reset(), LaunchableState))
+
+
+def test_resumable_state():
+    for state_cls in IncompleteState, PartialState:
+        state = state_cls("test_comp").reset()
+        assert_true(state.is_resumable())
+        # Remembered until it runs again
+        assert_true(state.to_pending().is_resumable())
+        assert_true(state.to_pending().is_not_up().is_resumable())
+    for state_cls in PendingState, RunningState, CompletedState, \
+                     CriticalState:
+        assert_false(state_cls("test_comp").reset().is_resumable())
     state = AbortedState("test_comp",
                          exception=ManualInterruption("Test interruption"))
     assert_true(isinstance(state.reset(), LaunchableState))
@@ -92,6 +107,59 @@ def test_monitor_refresh_with_non_empty_list():
     assert_in(wrong_state.comp_name, monitor.computation_names(LaunchableState))
 
 
+class Queue(ListUpJobs):
+    jobs = []
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_monitor_incremental_refresh():
+    Queue.jobs = ["comp_0", "comp_1"]
+    storage = PickleStorage(__EXP_NAME__)
+    storage.update_state(PendingState("comp_0"))
+    storage.update_state(RunningState("comp_1"))
+    monitor = Monitor(__EXP_NAME__, user=Queue.user, environment_cls=Queue)
+    assert_false(monitor.is_launchable("comp_0"))
+    assert_true(monitor.is_launchable("comp_2"))
+
+    # Saved since the last refresh
+    storage.update_state(CompletedState("comp_2"))
+    monitor.refresh(incremental=True)
+    assert_false(monitor.is_launchable("comp_2"))
+    assert_equal(len(monitor), 3)
+
+    # Killed without saving its state
+    Queue.jobs = ["comp_0"]
+    monitor.refresh(incremental=True)
+    assert_true(monitor.is_launchable("comp_1"))
+    assert_equal(monitor.unlaunchable_comp_names(), {"comp_0", "comp_2"})
+
+    monitor.abort(from_state=PendingState)
+    assert_in("comp_0", monitor.aborted_computations())
+    monitor.refresh(incremental=True)
+    assert_equal(monitor.count_by_state(),
+                 Monitor(__EXP_NAME__, user=Queue.user,
+                         environment_cls=Queue).count_by_state())
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_monitor_incremental_refresh_under_clock_skew():
+    Queue.jobs = ["comp_0"]
+    storage = PickleStorage(__EXP_NAME__)
+    monitor = Monitor(__EXP_NAME__, user=Queue.user, environment_cls=Queue)
+    pending = PendingState("comp_0")
+    monitor.storage.update_states([pending])
+    monitor.refresh(incremental=True)
+    assert_in("comp_0", monitor.computation_names(PendingState))
+
+    time.sleep(.05)  # Let the modification time advance
+    # Saved afterwards by a host whose clock is late
+    running = RunningState("comp_0")
+    running.date = pending.date - timedelta(hours=1)
+    storage.update_state(running)
+    monitor.refresh(incremental=True)
+    assert_in("comp_0", monitor.computation_names(RunningState))
+
+
 @with_setup_(pickle_prep, pickle_purge)
 def monitor_refresh(monitor, can_list):
     print(monitor)
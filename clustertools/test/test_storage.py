@@ -1,13 +1,26 @@
 # -*- coding: utf-8 -*-
+import glob
+import os
+import time
+from datetime import timedelta
+from unittest import SkipTest
 
-from nose.tools import assert_in
+from nose.tools import assert_in, assert_not_in
 from nose.tools import assert_equal
 from nose.tools import with_setup
+from nose.tools import assert_false
+from nose.tools import assert_true
+from nose.tools import assert_less
 
-from clustertools.storage import PickleStorage
-from clustertools.state import PendingState, AbortedState, ManualInterruption
+from nose.tools import assert_raises
 
-from .util_test import pickle_prep, pickle_purge, __EXP_NAME__
+from clustertools import ParameterSet, build_datacube
+from clustertools.storage import PickleStorage, SQLiteStorage, ArrayHandle
+from clustertools.state import PendingState, AbortedState, ManualInterruption, \
+    Monitor, LaunchableState, RunningState
+
+from .util_test import pickle_prep, pickle_purge, sqlite_prep, sqlite_purge, \
+    __EXP_NAME__
 
 __author__ = "Begon Jean-Michel <jm.begon@gmail.com>"
 __copyright__ = "3-clause BSD License"
@@ -69,3 +82,422 @@ def test_save_then_load_state():
     assert_in(launchable, loaded)
     assert_in(aborted, loaded)
 
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_batch_state_update():
+    storage = PickleStorage(__EXP_NAME__)
+    for i in range(10):
+        storage.update_state(PendingState("comp_{}".format(i)))
+    notif_db = storage._get_notif_db()
+    n_files = len(os.listdir(notif_db))
+
+    # A single write for the whole batch
+    monitor = Monitor(__EXP_NAME__)
+    monitor.abort(from_state=PendingState)
+    assert_equal(len(os.listdir(notif_db)), n_files + 1)
+    assert_equal(len(monitor.aborted_computations()), 10)
+    assert_equal(len(Monitor(__EXP_NAME__).aborted_computations()), 10)
+
+    # Journals are compacted
+    monitor.aborted_to_launchable(lambda s: s.comp_name != "comp_0")
+    assert_equal(len(glob.glob(os.path.join(notif_db, "*.journal"))), 1)
+    monitor = Monitor(__EXP_NAME__)
+    assert_equal(len(monitor), 10)
+    assert_equal(monitor.aborted_computations(), {"comp_0"})
+    assert_equal(len(monitor.launchable_computations()), 9)
+
+    # Most recent state wins
+    storage.update_state(PendingState("comp_1"))
+    monitor = Monitor(__EXP_NAME__)
+    assert_in("comp_1", monitor.computation_names(PendingState))
+    assert_equal(len(monitor.launchable_computations()), 8)
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_result_backup():
+    assert_raises(ValueError, PickleStorage, __EXP_NAME__, fsync="always")
+    for fsync in "none", "data", "full":
+        storage = PickleStorage(__EXP_NAME__, fsync=fsync, backup=True)
+        storage.save_result("comp", {"p": 1}, {"m": 1})
+        storage.save_result("comp", {"p": 1}, {"m": 2})
+        assert_equal(storage.load_result("comp"), {"m": 2})
+        assert_equal(glob.glob(os.path.join(storage._get_result_db(),
+                                            "*.tmp")), [])
+        storage.restore_back_up("comp")
+        assert_equal(storage.load_result("comp"), {"m": 1})
+
+    # No backup by default
+    storage = PickleStorage(__EXP_NAME__)
+    storage.save_result("other", {"p": 1}, {"m": 1})
+    storage.save_result("other", {"p": 1}, {"m": 2})
+    assert_false(os.path.exists(storage._bc_path("other")))
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_array_handles():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    storage = PickleStorage(__EXP_NAME__, array_threshold=1024)
+    storage.init()
+    big = np.arange(1000, dtype=float).reshape(10, 100)
+    blob = b"x" * 2048
+    storage.save_result("comp", {"p": 1}, {"big": big, "blob": blob,
+                                           "small": np.arange(3),
+                                           "score": .5})
+    result = storage.load_result("comp")
+    assert_equal(result["score"], .5)
+    assert_false(isinstance(result["small"], ArrayHandle))
+    handle = result["big"]
+    assert_true(isinstance(handle, ArrayHandle))
+    assert_equal(handle.shape, (10, 100))
+    assert_true(isinstance(handle.load(), np.memmap))
+    assert_true(np.array_equal(np.asarray(handle), big))
+    assert_equal(result["blob"].load(), blob)
+
+    # Through all the results
+    _, results_ls = storage.load_params_and_results()
+    assert_true(np.array_equal(results_ls[0]["big"].load(mmap_mode=None),
+                               big))
+
+    # Arrays which are no longer part of the result are removed
+    storage.save_result("comp", {"p": 1}, {"big": big[:1, :1]})
+    assert_equal(os.listdir(storage._get_array_folder("comp")), [])
+    assert_equal(storage.load_result("comp")["big"].tolist(), [[0.]])
+
+    # Metric names cannot escape the folder
+    storage.save_result("comp", {"p": 1}, {"../../x/y": big})
+    fnames = os.listdir(storage._get_array_folder("comp"))
+    assert_equal(len(fnames), 1)
+    assert_not_in("/", fnames[0])
+    assert_true(np.array_equal(storage.load_result("comp")["../../x/y"].load(),
+                               big))
+
+
+class FailingPickleStorage(PickleStorage):
+    def _save_atomically(self, stuff, fpath):
+        raise IOError("Disk full")
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_array_handle_generations():
+    try:
+        import numpy as np
+    except ImportError:
+        raise SkipTest("numpy is not installed")
+    storage = PickleStorage(__EXP_NAME__, array_threshold=1024, backup=True)
+    storage.init()
+    first, second = np.zeros(1000), np.ones(1000)
+    storage.save_result("comp", {"p": 1}, {"big": first})
+    storage.save_result("comp", {"p": 1}, {"big": second})
+    # The backup still references the former arrays
+    storage.restore_back_up("comp")
+    assert_true(np.array_equal(storage.load_result("comp")["big"].load(),
+                               first))
+
+    # A failure before the result is replaced does not alter it
+    failing = FailingPickleStorage(__EXP_NAME__, array_threshold=1024)
+    assert_raises(IOError, failing.save_result, "comp", {"p": 1},
+                  {"big": second})
+    assert_true(np.array_equal(storage.load_result("comp")["big"].load(),
+                               first))
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_state_order_under_clock_skew():
+    storage = PickleStorage(__EXP_NAME__)
+    launchable = LaunchableState("comp_0")
+    storage.update_states([launchable])
+    time.sleep(.05)  # Let the modification time advance
+    # Written later by a host whose clock is late
+    running = RunningState("comp_0")
+    running.date = launchable.date - timedelta(hours=1)
+    storage.update_state(running)
+    assert_equal(storage.load_states(), [running])
+
+    # The compacted journal does not make the former state more recent
+    time.sleep(.05)
+    storage.update_states([PendingState("comp_1")])
+    assert_in(running, storage.load_states())
+    assert_equal(storage.load_states_since()[0].count(running), 1)
+    monitor = Monitor(__EXP_NAME__)
+    assert_equal(monitor.computation_names(RunningState), {"comp_0"})
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_load_states_since():
+    storage = CountingPickleStorage(__EXP_NAME__)
+    for i in range(20):
+        storage.update_state(PendingState("comp_{}".format(i)))
+    states, watermark = storage.load_states_since()
+    assert_equal(len(states), 20)
+
+    CountingPickleStorage.n_loads = 0
+    storage.update_state(RunningState("comp_1"))
+    storage.update_states([AbortedState("comp_2", ManualInterruption("Test"))])
+    states, watermark = storage.load_states_since(watermark)
+    assert_equal({state.comp_name for state in states}, {"comp_1", "comp_2"})
+    # Only what changed is read
+    assert_equal(CountingPickleStorage.n_loads, 2)
+    assert_equal(storage.load_states_since(watermark), ([], watermark))
+
+    # The compacted states are not returned again
+    storage.update_states([PendingState("comp_3")])
+    states, watermark = storage.load_states_since(watermark)
+    assert_equal(states, [PendingState("comp_3")])
+    CountingPickleStorage.n_loads = 0
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_change_log_rotation():
+    storage = PickleStorage(__EXP_NAME__)
+    storage.__MAX_CHANGE_LOG__ = 256
+    storage.update_state(PendingState("comp_0"))
+    states, watermark = storage.load_states_since()
+    for i in range(50):
+        storage.update_state(PendingState("comp_{}".format(i)))
+        storage.update_state(RunningState("comp_{}".format(i)))
+    assert_less(os.path.getsize(storage._get_change_log()), 256 + 64)
+    # The records since the watermark were dropped: the folder is rescanned
+    states, watermark = storage.load_states_since(watermark)
+    assert_equal(len(states), 50)
+    assert_true(all(isinstance(state, RunningState) for state in states))
+    assert_equal(storage.load_states_since(watermark), ([], watermark))
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_load_states_since_rescan():
+    storage = PickleStorage(__EXP_NAME__)
+    running = RunningState("comp_0")
+    storage.update_state(running)
+    states, watermark = storage.load_states_since()
+
+    time.sleep(.05)  # Let the modification time advance
+    # Not logged, as any progress update
+    storage.update_state(running.update_progress(.5))
+    # Written by someone whose record got lost
+    writer = PickleStorage(__EXP_NAME__)
+    writer.update_state(PendingState("comp_1"))
+    with open(writer._get_change_log(), "rb") as hdl:
+        header = hdl.readline()
+    with open(writer._get_change_log(), "wb") as hdl:
+        hdl.write(header + b"\n" * (watermark[1] - len(header)))
+
+    states, watermark = storage.load_states_since(watermark)
+    assert_equal(states, [])
+    # Until the folder is rescanned
+    storage.__RESCAN_INTERVAL__ = 0
+    states, watermark = storage.load_states_since(watermark)
+    assert_equal(sorted(state.comp_name for state in states),
+                 ["comp_0", "comp_1"])
+    progress = [state.progress for state in states
+                if state.comp_name == "comp_0"]
+    assert_equal(progress, [.5])
+    assert_equal(storage.load_states_since(watermark), ([], watermark))
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_concurrent_loading():
+    storage = PickleStorage(__EXP_NAME__)
+    for i in range(10):
+        storage.update_state(PendingState("comp_{}".format(i)))
+        storage.save_result("comp_{}".format(i), {"i": i}, {"r": 2 * i})
+    for pool in "thread", "process":
+        storage = PickleStorage(__EXP_NAME__, n_workers=4, pool=pool)
+        assert_equal(len(storage.load_states()), 10)
+        parameters_ls, results_ls = storage.load_params_and_results()
+        assert_equal(len(results_ls), 10)
+        for parameters, result in zip(parameters_ls, results_ls):
+            assert_equal(2 * parameters["i"], result["r"])
+
+    assert_raises(ValueError, PickleStorage, __EXP_NAME__, pool="fork")
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_metric_projection():
+    storage = PickleStorage(__EXP_NAME__)
+    for i in range(4):
+        storage.save_result("comp_{}".format(i), {"i": i},
+                            {"r": 2 * i, "heavy": [i] * 100})
+    for use_index, n_workers, pool in [(False, 1, "thread"),
+                                       (False, 2, "process"),
+                                       (True, 1, "thread")]:
+        storage = PickleStorage(__EXP_NAME__, n_workers=n_workers, pool=pool,
+                                use_index=use_index)
+        parameters_ls, results_ls = storage.load_params_and_results(
+            metrics=["r", "missing"])
+        for parameters, result in zip(parameters_ls, results_ls):
+            assert_equal(result, {"r": 2 * parameters["i"]})
+        _, results_ls = storage.load_params_and_results()
+        assert_equal(len(results_ls[0]), 2)
+
+    cube = build_datacube(__EXP_NAME__, metrics=["r"])
+    assert_equal(cube.metrics, ["r"])
+    assert_equal(cube(i="3")("r"), 6)
+
+
+class CountingPickleStorage(PickleStorage):
+    n_loads = 0
+
+    @classmethod
+    def _load(cls, fpath, **kwargs):
+        cls.n_loads += 1
+        return super()._load(fpath, **kwargs)
+
+
+@with_setup(pickle_prep, pickle_purge)
+def test_result_index():
+    storage = CountingPickleStorage(__EXP_NAME__, use_index=True)
+    for i in range(5):
+        storage.save_result("comp_{}".format(i), {"i": i}, {"r": 2 * i})
+    # Age the files so that they are not considered as being modified
+    past = time.time() - 60
+    for fpath in glob.glob(os.path.join(storage.folder, "results", "*.pkl")):
+        os.utime(fpath, (past, past))
+
+    parameters_ls, results_ls = storage.load_params_and_results()
+    assert_equal(len(results_ls), 5)
+    assert_equal(CountingPickleStorage.n_loads, 5)
+
+    # Nothing has changed: nothing is unpickled
+    CountingPickleStorage.n_loads = 0
+    parameters_ls, results_ls = storage.load_params_and_results()
+    assert_equal(len(results_ls), 5)
+    assert_equal(CountingPickleStorage.n_loads, 0)
+
+    # Nor by another instance, which only reads the index entries
+    storage = CountingPickleStorage(__EXP_NAME__, use_index=True)
+    parameters_ls, results_ls = storage.load_params_and_results()
+    assert_equal(len(results_ls), 5)
+    assert_equal(CountingPickleStorage.n_loads, 0)
+
+    # Only the new/modified results are unpickled and (re)indexed
+    index_folder = os.path.join(storage.folder, "results_index")
+    untouched = os.path.join(index_folder, "comp_2.pkl")
+    inode = os.stat(untouched).st_ino
+    storage.save_result("comp_1", {"i": 1}, {"r": 20})
+    storage.save_result("comp_5", {"i": 5}, {"r": 10})
+    r_dict = storage._load_r_dicts()
+    assert_equal(CountingPickleStorage.n_loads, 2)
+    # Entries are replaced when rewritten
+    assert_equal(os.stat(untouched).st_ino, inode)
+    assert_equal(len(r_dict), 6)
+    assert_equal(r_dict["comp_1"]["Results"], {"r": 20})
+    assert_equal(r_dict["comp_5"]["Results"], {"r": 10})
+
+    # Removed results are dropped
+    os.remove(os.path.join(storage.folder, "results", "comp_0.pkl"))
+    assert_equal(len(storage._load_r_dicts()), 5)
+    assert_false(os.path.exists(os.path.join(index_folder, "comp_0.pkl")))
+
+
+# ------------------------------------------------------------------- SQLite
+@with_setup(sqlite_prep, sqlite_purge)
+def test_sqlite_save_then_load_result_and_params():
+    storage = SQLiteStorage(__EXP_NAME__)
+    p1 = {"a": 1, "b": (2, 3)}
+    r1 = {"r": 10, "t": (11, 12)}
+    p2 = {"a": 7}
+    r2 = {"r": 70, "t": (110, 120)}
+    storage.save_result("test_comp1", p1, r1)
+    storage.save_result("test_comp2", p2, r2)
+    # Overwriting a result drops the former metrics
+    storage.save_result("test_comp2", p2, {"r": 70})
+    r2 = {"r": 70}
+    assert_equal(storage.load_result("test_comp1"), r1)
+    assert_equal(storage.load_result("test_comp2"), r2)
+    assert_equal(storage.load_result("test_comp3"), {})
+    # expectation
+    default_meta = {"b": (20, 30)}
+    p2.update(default_meta)
+    p_expected, r_expected = storage.load_params_and_results(**default_meta)
+    assert_equal(len(p_expected), 2)
+    assert_in(p1, p_expected)
+    assert_in(p2, p_expected)
+    assert_equal(len(r_expected), 2)
+    assert_in(r1, r_expected)
+    assert_in(r2, r_expected)
+
+
+@with_setup(sqlite_prep, sqlite_purge)
+def test_sqlite_save_then_load_state():
+    storage = SQLiteStorage(__EXP_NAME__)
+    pending = PendingState("pending")
+    aborted = AbortedState("aborted", ManualInterruption("Test"))
+    storage.update_state(pending)
+    storage.update_state(aborted)
+    loaded = storage.load_states()
+    assert_equal(len(loaded), 2)
+    assert_in(pending, loaded)
+    assert_in(aborted, loaded)
+    launchable = pending.reset()
+    storage.update_state(launchable)
+    loaded = storage.load_states()
+    assert_equal(len(loaded), 2)
+    assert_in(launchable, loaded)
+    assert_in(aborted, loaded)
+
+    monitor = Monitor(__EXP_NAME__, storage_factory=SQLiteStorage)
+    assert_in(aborted.comp_name, monitor.aborted_computations())
+    monitor.reset()
+    monitor = Monitor(__EXP_NAME__, storage_factory=SQLiteStorage)
+    assert_equal(monitor.launchable_computations(), {"pending", "aborted"})
+
+
+@with_setup(sqlite_prep, sqlite_purge)
+def test_sqlite_load_states_since():
+    storage = SQLiteStorage(__EXP_NAME__)
+    assert_equal(storage.load_states_since()[0], [])
+    storage.update_states([PendingState("comp_0"), PendingState("comp_1")])
+    states, watermark = storage.load_states_since()
+    assert_equal(len(states), 2)
+
+    storage.update_state(PendingState("comp_0").reset())
+    states, watermark = storage.load_states_since(watermark)
+    assert_equal(states, [LaunchableState("comp_0")])
+    assert_equal(storage.load_states_since(watermark), ([], watermark))
+
+
+@with_setup(sqlite_prep, sqlite_purge)
+def test_sqlite_checkpoint():
+    storage = SQLiteStorage(__EXP_NAME__)
+    assert_equal(storage.load_checkpoint("comp"), None)
+    storage.save_result("comp", {"x": 1}, {"loss": 3}, checkpoint={"epoch": 3})
+    storage.save_result("comp", {"x": 1}, {"loss": 4}, checkpoint={"epoch": 4})
+    assert_equal(storage.load_checkpoint("comp"), {"epoch": 4})
+    # The checkpoint is not a metric
+    assert_equal(storage.load_result("comp"), {"loss": 4})
+    storage.save_result("comp", {"x": 1}, {"loss": 5})
+    assert_equal(storage.load_checkpoint("comp"), None)
+
+
+@with_setup(sqlite_prep, sqlite_purge)
+def test_sqlite_metric_projection():
+    storage = SQLiteStorage(__EXP_NAME__)
+    storage.save_result("comp_0", {"i": 0}, {"r": 0, "heavy": [0] * 100})
+    storage.save_result("comp_1", {"i": 1}, {"heavy": [1] * 100})
+    parameters_ls, results_ls = storage.load_params_and_results(metrics=["r"])
+    # Computations lacking the metrics are still there
+    assert_equal(sorted(p["i"] for p in parameters_ls), [0, 1])
+    assert_equal(sorted(results_ls, key=len), [{}, {"r": 0}])
+    assert_equal(storage.load_result("comp_0"), {"r": 0, "heavy": [0] * 100})
+
+
+@with_setup(sqlite_prep, sqlite_purge)
+def test_sqlite_parameter_set():
+    storage = SQLiteStorage(__EXP_NAME__)
+    assert_raises(FileNotFoundError, storage.load_parameter_set)
+    parameter_set = ParameterSet()
+    parameter_set.add_parameters(x1=range(3), x2=range(3))
+    storage.save_parameter_set(parameter_set)
+    loaded = storage.load_parameter_set()
+    assert_equal(list(loaded), list(parameter_set))
+
+
+def test_sqlite_missing_experiment():
+    storage = SQLiteStorage("This_is_a_mock_exp2423R43RFDSBNET")
+    assert_equal(storage.load_states(), [])
+    assert_equal(storage.load_params_and_results(), ([], []))
+    assert_equal(storage.load_result("comp"), {})
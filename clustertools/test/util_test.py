@@ -7,7 +7,8 @@ from nose import with_setup
 
 from clustertools.environment import Environment
 from clustertools.experiment import Computation
-from clustertools.storage import Storage, Architecture, PickleStorage
+from clustertools.storage import Storage, Architecture, PickleStorage, \
+    SQLiteStorage
 
 __author__ = "Begon Jean-Michel <jm.begon@gmail.com>"
 __copyright__ = "3-clause BSD License"
@@ -76,6 +77,14 @@ def pickle_prep(exp_name=__EXP_NAME__):
     prep(exp_name, PickleStorage)
 
 
+def sqlite_purge(exp_name=__EXP_NAME__):
+    purge(exp_name, SQLiteStorage)
+
+
+def sqlite_prep(exp_name=__EXP_NAME__):
+    prep(exp_name, SQLiteStorage)
+
+
 def with_setup_(setup=None, teardown=None):
     """Decorator like `with_setup` of nosetest but which can be applied to any
     function"""
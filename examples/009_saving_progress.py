@@ -9,8 +9,12 @@ instance).
 You just need to use the :meth:`save_result` method from the `Computation`
 class.
 
-So far, there is no way to restart a interrupted computation from the last save
-point. Pull requests are welcome(d)
+To restart an interrupted computation from the last save point, create the
+computation with `resume=True` (see `MyComputation.partialize` below). When
+relaunched after being reset from a partial or incomplete state, the `result`
+is preloaded with the last saved result and `self.checkpoint` holds whatever
+was given as `checkpoint` to :meth:`save_result` (None when starting from
+scratch). Computations which completed or aborted start from scratch.
 
 To run this example, open two terminals. In the first one, run this example
 (`python 009_saving_progress.py front-end`). In the second, do
@@ -39,8 +43,12 @@ class MyComputation(Computation):
         def P(x):
             return x**3 - x - 2
 
-        # Bisection algorithm
+        # Resume from the last checkpoint, if any
         m = i = 0
+        if self.checkpoint is not None:
+            a, b, i = self.checkpoint
+
+        # Bisection algorithm
         while abs(a-b) >= 1e-50:
             m = (a+b)/2.
             if P(a)*P(m) < 0:
@@ -54,8 +62,9 @@ class MyComputation(Computation):
             result["iteration"] = i
 
             if i % 10 == 0:
-                # Saving the result every 10 iterations
-                self.save_result()
+                # Saving the result every 10 iterations, together with what
+                # is needed to resume from there
+                self.save_result(checkpoint=(a, b, i + 1))
 
             # Wait some time to be able to see the update when running
             # `python 009_partial_results.py`
@@ -73,5 +82,6 @@ if __name__ == "__main__":
     param_set = ParameterSet()
     param_set.add_parameters(a=1, b=2)
 
-    experiment = Experiment("BasicUsagePartialSave", param_set, MyComputation)
+    experiment = Experiment("BasicUsagePartialSave", param_set,
+                            MyComputation.partialize(resume=True))
     environment.run(experiment)